@@ -17,8 +17,14 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'figgy-test-unique-snowflake'
+    },
+    'books': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'figgy-test-books'
     }
 }
+# The tests import and serve books from one process, which local memory serves
+STORAGE_BOOK_CACHE = 'books'
 
 LOGGING = {
     'version': 1,
@@ -86,6 +86,35 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+# Storage
+
+# How many alias resolutions the importer keeps in memory (see storage.resolution.AliasResolutionCache)
+STORAGE_ALIAS_CACHE_SIZE = 100000
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# The cache in CACHES that holds the books served by the API (see storage.book_cache), or None to serve every request
+# from the database. Imports and the ingestion daemon evict what they change from it, so it has to be a cache they and
+# the web server all reach, such as memcached: with local memory, the web server would go on serving what they changed
+# until it expires. The file-based backend is shared too, but counts its files on every write, so it only suits a small
+# catalog.
+STORAGE_BOOK_CACHE = None
+
+# How long books stay cached, in seconds, unless an import or an edit changes them first. This also bounds how long a
+# book cached by a request that read it just before a write committed is served.
+STORAGE_BOOK_CACHE_TIMEOUT = 300
+
+# How many seconds the change feed stays behind the present, so that every change it lists up to has committed
+STORAGE_CHANGE_FEED_LAG = 10
+
+# SQLite PRAGMAs the importers set while they load data, over those in storage.sqlite.DEFAULT_BULK_LOAD_PRAGMAS
+SQLITE_BULK_LOAD_PRAGMAS = {}
+
+
 try:
     from local import *
 except ImportError, e:
@@ -6,4 +6,5 @@ admin.autodiscover()
 urlpatterns = patterns(
     "",
     url(r"^admin/", include(admin.site.urls)),
+    url(r"^api/", include("storage.urls")),
 )
\ No newline at end of file
@@ -27,6 +27,10 @@ setup(
         'lxml>=3.2.0',
         'django-nose',
     ],
+    extras_require={
+        # Lets ingest_daemon pick up finished uploads as soon as they are closed, instead of scanning for them
+        'inotify': ['pyinotify'],
+    },
     entry_points="""
     # -*- Entry points: -*-
     """,
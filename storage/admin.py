@@ -1,40 +1,157 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import SEARCH_VAR, ChangeList
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Max, Q
 
+from storage.isbn import to_isbn13
+from storage.search import filter_books
 from storage.models import (
     Alias,
+    AliasDeletion,
     AliasUsedAsBookIdIssue,
     AliasUsedToResolveBookIdIssue,
     AliasPointsToConflictingBookIssue,
     Book,
+    ImportManifest,
     VersionUnspecifiedIssue
 )
 
 
+class LargeTablePaginator(Paginator):
+    """
+    A paginator that never counts every row of a large table. SQLite has to visit every row, or at least every index
+    entry, to answer a COUNT(*), which makes each changelist page slower as the catalog grows.
+
+    Without any filter or search, the count is estimated as the largest primary key, which SQLite reads straight off the
+    end of the table. Rows are seldom deleted, so this is close, and pages past the real end are simply empty. A
+    filtered or searched list is counted exactly, but only up to :attr:`max_count` rows, beyond which the last pages
+    are not linked. Users narrow down a search that big rather than page through it.
+    """
+
+    max_count = 10000
+
+    @property
+    def count(self):
+        if self._count is None:
+            if not self.object_list.query.where:
+                self._count = self.object_list.aggregate(last_pk=Max("pk"))["last_pk"] or 0
+            else:
+                self._count = self.object_list.order_by()[:self.max_count].count()
+        return self._count
+
+
+class LargeTableChangeList(ChangeList):
+    """
+    A changelist whose "N total" figure next to a filtered result is counted by the model admin's paginator too, rather
+    than with a COUNT(*) over the whole table.
+    """
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        result_count = paginator.count
+
+        if self.get_filters_params() or self.params.get(SEARCH_VAR):
+            full_result_count = self.model_admin.get_paginator(request, self.root_queryset, self.list_per_page).count
+        else:
+            full_result_count = result_count
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.queryset._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin for the tables that grow with the catalog: pages are counted with :class:`LargeTablePaginator`, and
+    whatever each row shows through foreign keys should be joined in with `list_select_related`, so a page costs the
+    same few queries whatever its size.
+    """
+
+    paginator = LargeTablePaginator
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
+
+
 class InlineAliasAdmin(admin.StackedInline):
     model = Alias
     extra = 0
 
 
-class AliasPointsToConflictingBookAdmin(admin.ModelAdmin):
+class AliasPointsToConflictingBookAdmin(LargeTableAdmin):
     list_display = ["book", "source_file", "scheme", "value"]
+    list_select_related = ["book"]
 
 
-class AliasUsedAsBookIdAdmin(admin.ModelAdmin):
+class AliasUsedAsBookIdAdmin(LargeTableAdmin):
     list_display = ["alias_used", "book_resolved", "source_file"]
+    # An alias shows the book it belongs to as well
+    list_select_related = ["alias_used__book", "book_resolved"]
 
 
-class AliasUsedToResolveBookIdAdmin(admin.ModelAdmin):
+class AliasUsedToResolveBookIdAdmin(LargeTableAdmin):
     list_display = ["alias_used", "book_resolved"]
+    list_select_related = ["alias_used__book", "book_resolved"]
 
 
-class VersionUnspecifiedAdmin(admin.ModelAdmin):
+class VersionUnspecifiedAdmin(LargeTableAdmin):
     list_display = ["book_id", "source_file"]
 
 
-class BookEditionAdmin(admin.ModelAdmin):
+class AliasDeletionAdmin(LargeTableAdmin):
+    list_display = ["book_id", "version", "scheme", "value", "created_time"]
+    search_fields = ["=book_id", "=value"]
+
+
+class ImportManifestAdmin(LargeTableAdmin):
+    list_display = ["path", "status", "checkpoint", "size", "last_modified_time"]
+    list_filter = ["status"]
+
+
+class BookEditionAdmin(LargeTableAdmin):
     inlines = [InlineAliasAdmin]
 
     list_display = ["id", "title", "list_aliases"]
+    # Newest first, straight off the primary key; the model's title ordering would sort the whole table for every page
+    ordering = ["-id"]
+    # Only used to show the search box, see get_search_results
+    search_fields = ["book_id"]
+
+    def get_queryset(self, request):
+        # Fetch the aliases of the whole page in one query for list_aliases
+        return super(BookEditionAdmin, self).get_queryset(request).prefetch_related("aliases")
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Find books by their exact book ID or the exact value of one of their aliases, or an ISBN of theirs in any form,
+        or by words and "quoted phrases" from their title and description, all of which are indexed (see
+        :mod:`storage.search`). The default search runs a case insensitive LIKE '%term%', which SQLite can only answer
+        by scanning every row.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        aliases = Q(value=search_term)
+        isbn = to_isbn13(search_term)
+        if isbn is not None:
+            aliases |= Q(canonical_value=isbn)
+        aliased = Alias.objects.filter(aliases).values("book_id")
+        return queryset.filter(Q(book_id=search_term) | Q(pk__in=aliased)) | filter_books(queryset, search_term), False
 
     def list_aliases(self, obj):
         if obj:
@@ -42,8 +159,10 @@ class BookEditionAdmin(admin.ModelAdmin):
 
     list_aliases.allow_tags = True
 
+admin.site.register(AliasDeletion, AliasDeletionAdmin)
 admin.site.register(AliasPointsToConflictingBookIssue, AliasPointsToConflictingBookAdmin)
 admin.site.register(AliasUsedToResolveBookIdIssue, AliasUsedToResolveBookIdAdmin)
 admin.site.register(AliasUsedAsBookIdIssue, AliasUsedAsBookIdAdmin)
 admin.site.register(Book, BookEditionAdmin)
+admin.site.register(ImportManifest, ImportManifestAdmin)
 admin.site.register(VersionUnspecifiedIssue, VersionUnspecifiedAdmin)
\ No newline at end of file
@@ -0,0 +1,508 @@
+# encoding: utf-8
+
+from django.db import transaction
+from django.utils import timezone
+
+from storage.isbn import ISBN_SCHEMES, alias_identity, canonical_value
+from storage.models import (
+    Alias,
+    AliasPointsToConflictingBookIssue,
+    AliasUsedAsBookIdIssue,
+    AliasUsedToResolveBookIdIssue,
+    Book,
+    VersionUnspecifiedIssue,
+    version_number,
+    version_sort_key
+)
+from storage.issues import ISSUE_MODELS, bulk_create_issues, issue_key
+import storage.book_cache
+
+# SQLite refuses queries with more than 999 parameters, so any IN (...) lookup is split into chunks of this size
+IN_QUERY_CHUNK_SIZE = 500
+
+# What importing a book record did to the book it was stored as
+BOOK_CREATED = "created"
+BOOK_UPDATED = "updated"
+BOOK_UNCHANGED = "unchanged"
+
+
+def in_chunks(values, size=IN_QUERY_CHUNK_SIZE):
+    """
+    Split a collection into lists of at most `size` items.
+    """
+    values = list(values)
+    for start in xrange(0, len(values), size):
+        yield values[start:start + size]
+
+
+class WriteCounts(object):
+    """
+    How many book records an import stored as a new book, as a change to an existing book, or left alone because the
+    book already held exactly what they said.
+    """
+
+    def __init__(self, created=0, updated=0, unchanged=0):
+        self.created = created
+        self.updated = updated
+        self.unchanged = unchanged
+
+    def add(self, outcome):
+        """
+        :param outcome:
+            One of :data:`BOOK_CREATED`, :data:`BOOK_UPDATED` or :data:`BOOK_UNCHANGED`.
+        """
+        setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def __iadd__(self, other):
+        self.created += other.created
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, WriteCounts) and \
+            (self.created, self.updated, self.unchanged) == (other.created, other.updated, other.unchanged)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "WriteCounts(created={0}, updated={1}, unchanged={2})".format(self.created, self.updated, self.unchanged)
+
+    def __str__(self):
+        return "{0} created, {1} updated, {2} unchanged".format(self.created, self.updated, self.unchanged)
+
+
+class BookSnapshot(object):
+    """
+    An in-memory view of the books, aliases and issues that a batch of book records can touch, together with every
+    change the batch makes to them.
+
+    Resolving a single book element against the database costs dozens of round trips (see
+    :func:`storage.tools.process_book_element`). The snapshot instead loads everything a batch can read up front with
+    a handful of IN queries: the aliases matching any identifier in the batch, every version of the books those point
+    to, the aliases of those versions, and the issues already recorded for the batch's source files. Resolution then
+    runs entirely against these in-memory indexes, and the changes are written back with bulk inserts in
+    :meth:`flush`.
+
+    Loading is incremental, so the same snapshot can be fed several batches in a row and later records always see the
+    effects of earlier ones, exactly as they would when processed one at a time.
+
+    Existing books are only written back when a record actually changed them (see :meth:`mark_changed`), and
+    :attr:`counts` tallies what each record did.
+    """
+    def __init__(self):
+        self.books = {}  # book_id -> [Book], every known version
+        self.aliases = {}  # alias_identity(scheme, value) -> [Alias], in creation order
+        self.book_aliases = {}  # id(Book) -> [Alias], in creation order
+
+        self._book_pks = {}
+        self._alias_pks = {}
+        self._loaded_book_ids = set()
+        self._loaded_values = set()
+        self._loaded_source_files = set()
+        self._issue_keys = set()
+        self._pending_issue_keys = set()
+        self._changed_book_pks = set()
+
+        self.new_books = []
+        self.changed_books = []
+        self.new_aliases = []
+        self.new_issues = []
+        self.counts = WriteCounts()
+
+    # Loading
+
+    def load(self, records):
+        """
+        Load everything the given records can read that is not already part of the snapshot.
+
+        :param records:
+            The :class:`storage.tools.BookRecord` objects about to be processed.
+        """
+        records = list(records)
+
+        # Aliases are matched on their canonical values, and a book ID may be an ISBN in any form
+        values = set()
+        for record in records:
+            values.add(canonical_value(ISBN_SCHEMES[0], record.book_id))
+            values.update(canonical_value(scheme, value) for scheme, value in record.aliases)
+        values -= self._loaded_values
+        self._loaded_values |= values
+
+        loaded_books = []
+        loaded_aliases = []
+        for chunk in in_chunks(values):
+            for alias in Alias.objects.filter(canonical_value__in=chunk).select_related("book"):
+                book = self._register_book(alias.book, loaded_books)
+                if self._register_alias(alias, book):
+                    loaded_aliases.append(alias)
+
+        book_ids = set(record.book_id for record in records)
+        book_ids.update(book.book_id for book in loaded_books)
+        book_ids -= self._loaded_book_ids
+        self._loaded_book_ids |= book_ids
+
+        for chunk in in_chunks(book_ids):
+            for book in Book.objects.filter(book_id__in=chunk):
+                self._register_book(book, loaded_books)
+
+        for chunk in in_chunks(set(book.pk for book in loaded_books)):
+            for alias in Alias.objects.filter(book__in=chunk):
+                if self._register_alias(alias, self._book_pks[alias.book_id]):
+                    loaded_aliases.append(alias)
+
+        # Only the lists that just grew can be out of order, so a snapshot spanning many batches is not re-sorted whole
+        by_pk = lambda alias: (alias.pk is None, alias.pk)
+        for key in set(alias_identity(alias.scheme, alias.value) for alias in loaded_aliases):
+            self.aliases[key].sort(key=by_pk)
+        for key in set(id(alias.book) for alias in loaded_aliases):
+            self.book_aliases[key].sort(key=by_pk)
+
+        source_files = set(record.source_file for record in records) - self._loaded_source_files
+        self._loaded_source_files |= source_files
+        for model in ISSUE_MODELS:
+            attnames = [model._meta.get_field(name).attname for name in self._issue_fields(model)]
+            for chunk in in_chunks(source_files):
+                for row in model.objects.filter(source_file__in=chunk).values_list(*attnames):
+                    self._issue_keys.add(issue_key(model, dict(zip(attnames, row))))
+
+    def _register_book(self, book, loaded_books):
+        existing = self._book_pks.get(book.pk)
+        if existing is not None:
+            return existing
+
+        self._book_pks[book.pk] = book
+        self.books.setdefault(book.book_id, []).append(book)
+        self.book_aliases.setdefault(id(book), [])
+        loaded_books.append(book)
+        return book
+
+    def _register_alias(self, alias, book):
+        """
+        :return:
+            True if the alias was added to the snapshot, False if it was already part of it.
+        """
+        if alias.pk is not None:
+            if alias.pk in self._alias_pks:
+                return False
+            self._alias_pks[alias.pk] = alias
+
+        alias.book = book
+        self.aliases.setdefault(alias_identity(alias.scheme, alias.value), []).append(alias)
+        self.book_aliases.setdefault(id(book), []).append(alias)
+        return True
+
+    @staticmethod
+    def _issue_fields(model):
+        return sorted(
+            field.name for field in model._meta.local_fields
+            if field.name not in ("id", "created_time", "last_modified_time")
+        )
+
+    # Reading
+
+    def first_alias(self, scheme, value):
+        """
+        The equivalent of `Alias.objects.filter(**alias_filter(scheme, value)).first()`, so an ISBN finds the first
+        alias holding it in any form.
+        """
+        aliases = self.aliases.get(alias_identity(scheme, value))
+        return aliases[0] if aliases else None
+
+    def versions(self, book_id):
+        """
+        Every known version of a book, the equivalent of `Book.objects.filter(book_id=book_id)`.
+        """
+        return self.books.get(book_id, [])
+
+    def first_version(self, book_id):
+        """
+        The equivalent of `Book.objects.filter(book_id=book_id).first()` under the default ordering of :class:`Book`.
+        """
+        versions = self.versions(book_id)
+        if not versions:
+            return None
+        return min(versions, key=lambda book: (book.title, book.version))
+
+    def aliases_of(self, book):
+        return self.book_aliases.get(id(book), [])
+
+    # Writing
+
+    def get_or_create_book(self, book_id, version):
+        """
+        The equivalent of `Book.objects.get_or_create(book_id=book_id, version=version)`.
+
+        :return:
+            The book, and whether it was created.
+        """
+        for book in self.versions(book_id):
+            if book.version == version:
+                return book, False
+
+        book = Book(book_id=book_id, version=version, version_key=version_sort_key(version))
+        self.books.setdefault(book_id, []).append(book)
+        self.book_aliases[id(book)] = []
+        self.new_books.append(book)
+        return book, True
+
+    def mark_changed(self, book):
+        """
+        Write the title and description of an existing book back on :meth:`flush`, and bump its modified time. New
+        books are inserted as they are at the time of the flush, so they need not be marked.
+        """
+        if book.pk is not None and book.pk not in self._changed_book_pks:
+            self._changed_book_pks.add(book.pk)
+            self.changed_books.append(book)
+
+    def get_or_create_alias(self, book, scheme, value):
+        """
+        The equivalent of `book.aliases.get_or_create(scheme=scheme, canonical_value=...)` in
+        :func:`storage.tools._process_book_aliases`.
+
+        :return:
+            The alias, and whether it was created.
+        """
+        canonical = canonical_value(scheme, value)
+        for alias in self.aliases_of(book):
+            if alias.scheme == scheme and alias.canonical_value == canonical:
+                return alias, False
+
+        alias = Alias(book=book, scheme=scheme, value=value, canonical_value=canonical)
+        self._register_alias(alias, book)
+        self.new_aliases.append(alias)
+        return alias, True
+
+    def record_issue(self, model, **kwargs):
+        """
+        The equivalent of `model.objects.get_or_create(**kwargs)` for the issue models.
+        """
+        key = issue_key(model, kwargs)
+        if key in self._issue_keys or key in self._pending_issue_keys:
+            return
+
+        self._pending_issue_keys.add(key)
+        self.new_issues.append((model, kwargs))
+
+    def flush(self):
+        """
+        Write every change made to the snapshot to the database in a single transaction, then reset the list of pending
+        changes. New rows are written with bulk inserts; existing books that changed get one UPDATE each, as this
+        version of Django has no bulk update.
+        """
+        with transaction.atomic():
+            Book.objects.bulk_create(self.new_books)
+            self._fetch_book_pks(self.new_books)
+
+            now = timezone.now()
+            for book in self.changed_books:
+                book.last_modified_time = now
+                Book.objects.filter(pk=book.pk).update(
+                    title=book.title,
+                    description=book.description,
+                    last_modified_time=now
+                )
+
+            for alias in self.new_aliases:
+                # Re-assign the now saved book so that the foreign key column picks up its primary key
+                alias.book = alias.book
+            Alias.objects.bulk_create(self.new_aliases)
+            self._fetch_alias_pks(self.new_aliases)
+
+            for model in ISSUE_MODELS:
+                bulk_create_issues(model, [
+                    model(**kwargs) for issue_model, kwargs in self.new_issues if issue_model is model
+                ])
+
+        # Bulk writes send no signals, so the cached documents of what changed are evicted here
+        storage.book_cache.book_cache.invalidate(
+            book_pks=set(book.pk for book in self.changed_books) | set(alias.book.pk for alias in self.new_aliases),
+            book_ids=set(book.book_id for book in self.new_books + self.changed_books)
+        )
+
+        for book in self.new_books:
+            self._book_pks[book.pk] = book
+        for alias in self.new_aliases:
+            self._alias_pks[alias.pk] = alias
+
+        # Pending issues referring to new rows were keyed by object until now; everything has a primary key by now
+        self._issue_keys.update(issue_key(model, kwargs) for model, kwargs in self.new_issues)
+
+        self.new_books, self.changed_books, self.new_aliases, self.new_issues = [], [], [], []
+        self._pending_issue_keys, self._changed_book_pks = set(), set()
+
+    def _fetch_book_pks(self, books):
+        pending = dict(((book.book_id, book.version), book) for book in books)
+        for chunk in in_chunks(set(book.book_id for book in books)):
+            for pk, book_id, version in Book.objects.filter(book_id__in=chunk).values_list("pk", "book_id", "version"):
+                book = pending.get((book_id, version))
+                if book is not None and book.pk is None:
+                    book.pk = pk
+
+    def _fetch_alias_pks(self, aliases):
+        pending = dict(((alias.book_id, alias.value), alias) for alias in aliases)
+        for chunk in in_chunks(set(alias.book_id for alias in aliases)):
+            for pk, book_pk, value in Alias.objects.filter(book__in=chunk).values_list("pk", "book", "value"):
+                alias = pending.get((book_pk, value))
+                if alias is not None and alias.pk is None:
+                    alias.pk = pk
+
+
+def _resolve_book_id(snapshot, record):
+    """
+    Snapshot counterpart of :func:`storage.tools._resolve_book_id`; see there for the resolution rules.
+    """
+    if snapshot.versions(record.book_id):
+        return record.book_id
+
+    # Both ISBN schemes share one identity, so this finds an ISBN-10 or ISBN-13 in any form
+    alias = snapshot.first_alias(ISBN_SCHEMES[0], record.book_id)
+    if alias is not None:
+        snapshot.record_issue(
+            AliasUsedAsBookIdIssue,
+            alias_used=alias,
+            book_resolved=alias.book,
+            source_file=record.source_file
+        )
+        return alias.book.book_id
+
+    for scheme, value in record.aliases:
+        alias = snapshot.first_alias(scheme, value)
+        if alias is not None:
+            snapshot.record_issue(
+                AliasUsedToResolveBookIdIssue,
+                alias_used=alias,
+                book_resolved=alias.book,
+                source_file=record.source_file
+            )
+            return alias.book.book_id
+
+    return record.book_id
+
+
+def _infer_book_version(snapshot, book_id, source_file, version):
+    """
+    Snapshot counterpart of :func:`storage.tools._infer_book_version`.
+    """
+    try:
+        return str(float(version))
+    except (TypeError, ValueError):
+        snapshot.record_issue(VersionUnspecifiedIssue, book_id=book_id, source_file=source_file)
+
+        existing_books = snapshot.versions(book_id)
+        if len(existing_books) == 0:
+            return "1.0"
+
+        latest_book = max(existing_books, key=lambda book: book.version_key)
+        return str(version_number(latest_book.version) + 1)
+
+
+def _process_book_aliases(snapshot, record, book, book_id):
+    """
+    Snapshot counterpart of :func:`storage.tools._process_book_aliases`.
+
+    :return:
+        Whether any alias was added to the book.
+    """
+    added = False
+    for scheme, value in record.aliases:
+        alias = snapshot.first_alias(scheme, value)
+        if alias is not None and alias.book.book_id != book_id:
+            snapshot.record_issue(
+                AliasPointsToConflictingBookIssue,
+                book=alias.book,
+                scheme=scheme,
+                source_file=record.source_file,
+                value=value
+            )
+            continue
+
+        _, created = snapshot.get_or_create_alias(book, scheme, value)
+        added = added or created
+
+    existing_book = snapshot.first_version(book_id)
+    missing_aliases = list(
+        set([(alias.scheme, alias.value) for alias in snapshot.aliases_of(existing_book)]) -
+        set([(alias.scheme, alias.value) for alias in snapshot.aliases_of(book)])
+    )
+
+    for scheme, value in missing_aliases:
+        _, created = snapshot.get_or_create_alias(book, scheme, value)
+        added = added or created
+
+    return added
+
+
+def process_book_record(snapshot, record):
+    """
+    Apply a single book record to the snapshot, following the same steps as
+    :func:`storage.tools.process_book_element`, and count what it did in :attr:`BookSnapshot.counts`.
+
+    :param snapshot:
+        The :class:`BookSnapshot` the record's identifiers have been loaded into.
+    :param record:
+        The :class:`storage.tools.BookRecord` to apply.
+
+    :return:
+        The :class:`Book` the record was stored as.
+    """
+    resolved_book_id = _resolve_book_id(snapshot, record)
+    version = _infer_book_version(snapshot, resolved_book_id, record.source_file, record.version)
+
+    book, created = snapshot.get_or_create_book(resolved_book_id, version)
+    changed = (book.title, book.description) != (record.title, record.description)
+    book.title = record.title
+    book.description = record.description
+    if _process_book_aliases(snapshot, record, book, resolved_book_id):
+        changed = True
+
+    if created:
+        snapshot.counts.add(BOOK_CREATED)
+    elif changed:
+        snapshot.mark_changed(book)
+        snapshot.counts.add(BOOK_UPDATED)
+    else:
+        snapshot.counts.add(BOOK_UNCHANGED)
+
+    return book
+
+
+def process_book_records(records):
+    """
+    Import a batch of book records with a fixed number of queries: one round of IN queries to load the snapshot the
+    batch needs, and one round of bulk inserts to write back what changed.
+
+    :param records:
+        The :class:`storage.tools.BookRecord` objects to import, in feed order.
+
+    :return:
+        The :class:`WriteCounts` of the batch.
+    """
+    records = list(records)
+
+    snapshot = BookSnapshot()
+    snapshot.load(records)
+    for record in records:
+        process_book_record(snapshot, record)
+    snapshot.flush()
+    return snapshot.counts
+
+
+def resolve_book_ids(records):
+    """
+    Work out which book each record resolves to given what is in the database right now, without writing anything.
+    Records are resolved independently of each other, so this does not see books or aliases that earlier records in the
+    list would create.
+
+    :param records:
+        The :class:`storage.tools.BookRecord` objects to resolve.
+
+    :return:
+        The resolved book identifier of each record, in the same order.
+    """
+    records = list(records)
+
+    snapshot = BookSnapshot()
+    snapshot.load(records)
+    return [_resolve_book_id(snapshot, record) for record in records]
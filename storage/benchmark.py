@@ -0,0 +1,73 @@
+# encoding: utf-8
+
+import os
+import resource
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from io import BytesIO
+
+from storage.importer import import_files
+from storage.profiling import QueryCounter
+from storage.resolution import alias_cache
+from storage.sqlite import BulkLoadProfile
+from storage.synthetic import generate_feed
+
+
+BenchmarkResult = namedtuple(
+    "BenchmarkResult",
+    ["books", "seconds", "queries", "peak_rss_kb", "alias_cache_hits", "alias_cache_misses"]
+)
+
+
+def peak_rss_kb():
+    """
+    :return:
+        The largest resident set size this process has had so far, in kilobytes.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return usage // 1024 if os.uname()[0] == "Darwin" else usage
+
+
+def benchmark_import(books, seed=0, batch_size=None, bulk_load=False, **feed_options):
+    """
+    Generate a synthetic feed of `books` books (see :func:`storage.synthetic.generate_feed`) and time importing it into
+    the current database. Generating the feed is not part of the timing.
+
+    The peak RSS is that of the whole process, so run the sizes from smallest to largest to tell them apart.
+
+    :param books:
+        How many books to import.
+    :param seed:
+        The seed for the synthetic feed.
+    :param batch_size:
+        If given, import through the batch engine in batches of this size, otherwise one book at a time.
+    :param bulk_load:
+        Import under the SQLite bulk load profile (see :class:`storage.sqlite.BulkLoadProfile`), including the
+        ANALYZE and checkpoint it ends with.
+
+    :return:
+        A :class:`BenchmarkResult`.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "synthetic-{0}.xml".format(books))
+        with open(filename, "wb") as file_handle:
+            generate_feed(file_handle, books, seed=seed, **feed_options)
+
+        alias_cache.clear()
+        with QueryCounter() as counter:
+            start = time.time()
+            with BulkLoadProfile(enabled=bulk_load):
+                failures = import_files([filename], batch_size=batch_size, force=True, stdout=BytesIO())
+            seconds = time.time() - start
+        if failures:
+            raise failures[0].error
+    finally:
+        shutil.rmtree(directory)
+
+    # The import clears the alias cache as it starts, and with it the cache's counters
+    stats = alias_cache.stats()
+    return BenchmarkResult(books, seconds, counter.count, peak_rss_kb(), stats["hits"], stats["misses"])
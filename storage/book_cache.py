@@ -0,0 +1,330 @@
+# encoding: utf-8
+
+import calendar
+import hashlib
+import json
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.signals import request_finished
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from storage.isbn import alias_identity
+from storage.models import Alias, Book
+from storage.serializers import serialize_book
+import storage.batch
+
+# The cache, out of settings.CACHES, that holds the book documents
+DEFAULT_BOOK_CACHE = "books"
+
+# How long documents are cached, in seconds
+DEFAULT_BOOK_CACHE_TIMEOUT = 300
+
+
+CachedBook = namedtuple("CachedBook", ["pk", "book_id", "version", "etag", "last_modified", "body", "identities"])
+
+
+def book_validators(book):
+    """
+    :return:
+        The ETag and Last-Modified time of a book. Both change whenever the book is saved, which the import does
+        whenever it touches the book or its aliases, and whenever one of its aliases is deleted.
+    """
+    last_modified = calendar.timegm(book.last_modified_time.utctimetuple())
+    etag = "{0}-{1}".format(book.pk, book.last_modified_time.strftime("%Y%m%d%H%M%S%f"))
+    return etag, last_modified
+
+
+def book_document(book, aliases):
+    """
+    :return:
+        A :class:`CachedBook` holding everything the API serves for a book: its JSON, its validators, and the identities
+        of its aliases (see :func:`storage.isbn.alias_identity`).
+    """
+    etag, last_modified = book_validators(book)
+    return CachedBook(
+        pk=book.pk,
+        book_id=book.book_id,
+        version=book.version,
+        etag=etag,
+        last_modified=last_modified,
+        body=json.dumps(serialize_book(book, aliases)),
+        identities=frozenset(alias_identity(alias.scheme, alias.value) for alias in aliases)
+    )
+
+
+def _book_key(pk):
+    return "storage.book.{0}".format(pk)
+
+
+def _pointer_key(kind, *parts):
+    # Book IDs and alias values may hold anything, which not every cache backend accepts in a key
+    return "storage.{0}.{1}".format(kind, hashlib.md5(json.dumps(parts)).hexdigest())
+
+
+def _version_key(book_id, version):
+    return _pointer_key("version", book_id, version)
+
+
+def _latest_key(book_id):
+    return _pointer_key("latest", book_id)
+
+
+def _alias_key(identity):
+    return _pointer_key("alias", *identity)
+
+
+class BookCache(object):
+    """
+    Serialized book documents, kept in one of the caches configured in `settings.CACHES` so that the backend can be
+    swapped: local memory serves a single process, and the file-based cache is shared by the web server and the
+    import commands of one machine.
+
+    Each document is stored once, under the primary key of its book. A book ID and version, the latest version of a
+    book ID, and an alias each point to a primary key, so a hit costs two cache reads and no query. Every pointer is
+    checked against the document it leads to, which makes a pointer left behind by a renamed or deleted book a miss
+    rather than a wrong answer.
+
+    Documents are evicted whenever a book or its aliases are written: through model signals for `Book.save()` and
+    `Alias.save()`, as :func:`storage.tools.process_book_element` and the admin write them, and explicitly by the batch
+    engine, whose bulk writes send no signals. Writes made within a transaction are evicted a second time once it
+    commits (see :meth:`after_commit`), since a request reading in between would cache what it still sees.
+
+    A request can still read a book just before a write commits and cache it just after the write was evicted, as
+    the cache backends have no way to refuse it. Documents therefore always expire, so that such a document is served
+    for at most `timeout` seconds.
+    """
+    def __init__(self, cache_name=DEFAULT_BOOK_CACHE, timeout=DEFAULT_BOOK_CACHE_TIMEOUT):
+        """
+        :param cache_name:
+            The name of the cache in `settings.CACHES`, or None to cache nothing.
+        :param timeout:
+            How long documents are kept, in seconds.
+        """
+        if timeout is None:
+            raise ValueError("Book documents have to expire, or a document cached as a write commits is never evicted")
+
+        self.cache_name = cache_name
+        self.timeout = timeout
+
+        self._cache = None
+        self._pending = threading.local()
+
+    @property
+    def enabled(self):
+        return self.cache_name is not None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_cache(self.cache_name)
+        return self._cache
+
+    def _follow(self, pointer_key):
+        if not self.enabled:
+            return None
+
+        pk = self.cache.get(pointer_key)
+        if pk is None:
+            return None
+        return self.cache.get(_book_key(pk))
+
+    def get_book(self, book_id, version=None):
+        """
+        :param version:
+            The version, as stored (see :func:`storage.lookups.normalize_version`), or None for the latest version.
+
+        :return:
+            The cached :class:`CachedBook`, or None.
+        """
+        if version is None:
+            document = self._follow(_latest_key(book_id))
+        else:
+            document = self._follow(_version_key(book_id, version))
+
+        if document is None or document.book_id != book_id or version not in (None, document.version):
+            return None
+        return document
+
+    def get_alias(self, scheme, value):
+        """
+        :return:
+            The cached :class:`CachedBook` of the book an alias belongs to, or None.
+        """
+        identity = alias_identity(scheme, value)
+        document = self._follow(_alias_key(identity))
+        if document is None or identity not in document.identities:
+            return None
+        return document
+
+    def add(self, book, aliases, latest=False, alias=None):
+        """
+        Cache the document of a book, and point its book ID and version at it.
+
+        :param book:
+            The :class:`storage.models.Book`.
+        :param aliases:
+            All of its :class:`storage.models.Alias` objects, in the order they were added.
+        :param latest:
+            Whether the book is the latest version of its book ID, and should be found by its book ID alone.
+        :param alias:
+            A (scheme, value) pair that was resolved to the book, and should find it from now on.
+
+        :return:
+            The :class:`CachedBook`.
+        """
+        document = book_document(book, aliases)
+        if self.enabled:
+            self.cache.set_many(self._entries(document, latest, alias), timeout=self.timeout)
+        return document
+
+    @staticmethod
+    def _entries(document, latest=False, alias=None):
+        entries = {
+            _book_key(document.pk): document,
+            _version_key(document.book_id, document.version): document.pk,
+        }
+        if latest:
+            entries[_latest_key(document.book_id)] = document.pk
+        if alias is not None:
+            entries[_alias_key(alias_identity(*alias))] = document.pk
+        return entries
+
+    def invalidate(self, book_pks=(), book_ids=(), identities=()):
+        """
+        Evict the documents of books that changed, the latest versions of book IDs that gained or changed a version, and
+        the books of alias identities whose first alias may have changed.
+        """
+        if not self.enabled:
+            return
+
+        keys = set(_book_key(pk) for pk in book_pks)
+        keys.update(_latest_key(book_id) for book_id in book_ids)
+        keys.update(_alias_key(identity) for identity in identities)
+        if not keys:
+            return
+
+        self.cache.delete_many(list(keys))
+        if connection.in_atomic_block:
+            self._pending_keys().update(keys)
+        self._pending_book_ids().update(book_ids)
+
+    def _pending_keys(self):
+        if not hasattr(self._pending, "keys"):
+            self._pending.keys = set()
+        return self._pending.keys
+
+    def _pending_book_ids(self):
+        if not hasattr(self._pending, "book_ids"):
+            self._pending.book_ids = set()
+        return self._pending.book_ids
+
+    def after_commit(self, warm=False):
+        """
+        Evict again what this thread evicted within transactions, once they have committed.
+
+        :param warm:
+            Also cache the documents of every version of the book IDs written (see :meth:`warm`).
+
+        :return:
+            How many documents were cached.
+        """
+        keys, book_ids = self._pending_keys(), self._pending_book_ids()
+        self._pending.keys, self._pending.book_ids = set(), set()
+
+        if keys and self.enabled:
+            self.cache.delete_many(list(keys))
+        if warm and book_ids:
+            return self.warm(book_ids)
+        return 0
+
+    def warm(self, book_ids=None):
+        """
+        Cache the documents of every version of some books, or of the whole catalog, with one query for a chunk of books
+        and another for their aliases.
+
+        :param book_ids:
+            The book IDs to cache. If not given, every book is cached.
+
+        :return:
+            How many documents were cached.
+        """
+        if not self.enabled:
+            return 0
+
+        if book_ids is None:
+            return self._warm_books(Book.objects.order_by("book_id", "version_key").iterator())
+
+        count = 0
+        for chunk in storage.batch.in_chunks(sorted(set(book_ids))):
+            count += self._warm_books(Book.objects.filter(book_id__in=chunk).order_by("book_id", "version_key"))
+        return count
+
+    def _warm_books(self, books):
+        """
+        Cache books ordered by book ID and version, the last version of each book ID being its latest.
+        """
+        count = 0
+        chunk = []
+        for book in books:
+            if chunk and chunk[-1].book_id != book.book_id and len(chunk) >= storage.batch.IN_QUERY_CHUNK_SIZE:
+                count += self._warm_chunk(chunk)
+                chunk = []
+            chunk.append(book)
+        if chunk:
+            count += self._warm_chunk(chunk)
+        return count
+
+    def _warm_chunk(self, books):
+        """
+        Cache a chunk of books that holds every version of its book IDs.
+        """
+        aliases = dict((book.pk, []) for book in books)
+        for alias in Alias.objects.filter(book__in=list(aliases)).order_by("pk"):
+            aliases[alias.book_id].append(alias)
+
+        entries = {}
+        for index, book in enumerate(books):
+            latest = index + 1 == len(books) or books[index + 1].book_id != book.book_id
+            entries.update(self._entries(book_document(book, aliases[book.pk]), latest=latest))
+        self.cache.set_many(entries, timeout=self.timeout)
+        return len(books)
+
+    def clear(self):
+        self._pending.keys, self._pending.book_ids = set(), set()
+        if self.enabled:
+            self.cache.clear()
+
+
+book_cache = BookCache(
+    getattr(settings, "STORAGE_BOOK_CACHE", DEFAULT_BOOK_CACHE),
+    getattr(settings, "STORAGE_BOOK_CACHE_TIMEOUT", DEFAULT_BOOK_CACHE_TIMEOUT)
+)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def _evict_book(sender, instance, **kwargs):
+    book_cache.invalidate(book_pks=[instance.pk], book_ids=[instance.book_id])
+
+
+@receiver(post_save, sender=Alias)
+def _evict_aliased_book(sender, instance, created, **kwargs):
+    # A new alias comes after any other alias of its identity, so only a changed one can become the first
+    identities = [] if created else [alias_identity(instance.scheme, instance.value)]
+    book_cache.invalidate(book_pks=[instance.book_id], identities=identities)
+
+
+@receiver(post_delete, sender=Alias)
+def _evict_unaliased_book(sender, instance, **kwargs):
+    book_cache.invalidate(book_pks=[instance.book_id], identities=[alias_identity(instance.scheme, instance.value)])
+
+
+@receiver(request_finished)
+def _evict_after_request(sender, **kwargs):
+    # Requests, such as admin edits, commit before they finish
+    book_cache.after_commit()
@@ -0,0 +1,156 @@
+# encoding: utf-8
+
+import calendar
+import heapq
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from storage.models import Alias, AliasDeletion, AliasPointsToConflictingBookIssue, Book
+
+# What the change feed reports, in the order changes sharing a modified time are listed
+CHANGE_KINDS = (
+    ("book", Book),
+    ("alias", Alias),
+    ("alias_deleted", AliasDeletion),
+    ("conflict", AliasPointsToConflictingBookIssue),
+)
+
+# How many changes a page holds unless asked otherwise, and at most
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# How many seconds the change feed stays behind the present by default, which has to outlast the time between a row
+# being timestamped and committed. Imports commit their rows with the time they commit (see :func:`atomic_changes`),
+# but any other write can wait for SQLite's write lock, five seconds by default, in between.
+DEFAULT_CHANGE_FEED_LAG = 10
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+ChangeCursor = namedtuple("ChangeCursor", ["modified", "kind", "pk"])
+
+Change = namedtuple("Change", ["kind", "cursor", "instance"])
+
+ChangePage = namedtuple("ChangePage", ["changes", "cursor", "more", "high_water"])
+
+
+def safe_high_water():
+    """
+    The latest modified time the change feed lists changes up to: `settings.STORAGE_CHANGE_FEED_LAG` seconds ago.
+    Every row timestamped before it has committed, so a consumer that has synced up to it has missed nothing.
+    """
+    return timezone.now() - timedelta(seconds=getattr(settings, "STORAGE_CHANGE_FEED_LAG", DEFAULT_CHANGE_FEED_LAG))
+
+
+@contextmanager
+def atomic_changes():
+    """
+    A transaction, like `transaction.atomic`, whose changes are timestamped with the time it ends.
+
+    Rows are timestamped when they are written, but only seen once their transaction commits, and an import's
+    transaction can last minutes. Meanwhile the change feed may hand out cursors past the rows it wrote first, which
+    consumers would never see. Restamping every change of the transaction as it ends keeps the time between a row's
+    timestamp and its commit down to the commit itself, well within :data:`DEFAULT_CHANGE_FEED_LAG`.
+    """
+    with transaction.atomic():
+        started = timezone.now()
+        yield
+        now = timezone.now()
+        for _, model in CHANGE_KINDS:
+            model.objects.filter(last_modified_time__gte=started).update(last_modified_time=now)
+
+
+def format_cursor(cursor):
+    """
+    Write a cursor as an opaque token: the modified time in microseconds since the epoch, the rank of the kind of
+    change in :data:`CHANGE_KINDS` and the primary key, separated by dashes.
+    """
+    modified = cursor.modified.astimezone(timezone.utc)
+    microseconds = calendar.timegm(modified.utctimetuple()) * 10 ** 6 + modified.microsecond
+    return "{0}-{1}-{2}".format(microseconds, cursor.kind, cursor.pk)
+
+
+def parse_cursor(token):
+    """
+    Read a cursor written by :func:`format_cursor`.
+
+    :raise ValueError:
+        If the token is not a cursor.
+    """
+    try:
+        microseconds, kind, pk = [int(part) for part in token.split("-")]
+    except (AttributeError, ValueError):
+        raise ValueError(u"Not a change cursor: {0!r}".format(token))
+    if not 0 <= kind < len(CHANGE_KINDS) or microseconds < 0:
+        raise ValueError(u"Not a change cursor: {0!r}".format(token))
+    return ChangeCursor(_EPOCH + timedelta(microseconds=microseconds), kind, pk)
+
+
+def _changed_after(queryset, kind, cursor):
+    """
+    Narrow a queryset of one kind of change to the rows listed after the cursor, that is rows modified later, or at
+    the same time but of a later kind, or of the same kind with a greater primary key.
+    """
+    if cursor is None:
+        return queryset
+    if kind > cursor.kind:
+        return queryset.filter(last_modified_time__gte=cursor.modified)
+    if kind < cursor.kind:
+        return queryset.filter(last_modified_time__gt=cursor.modified)
+    return queryset.filter(last_modified_time__gte=cursor.modified) \
+        .exclude(last_modified_time=cursor.modified, pk__lte=cursor.pk)
+
+
+def changes_since(cursor=None, limit=DEFAULT_PAGE_SIZE, high_water=None):
+    """
+    List the books, aliases, alias deletions and alias conflicts modified after a cursor, oldest first.
+
+    Books and aliases are indexed on their modified time, and since the import only saves what actually changed (see
+    :func:`storage.tools.process_book_element`), a sync costs queries in proportion to what changed since the last
+    one, not to the size of the catalog. Many rows share a modified time, as every book an import batch writes gets
+    the same one, so changes are ordered by modified time, then by kind and primary key, and the cursor holds all
+    three. A page therefore ends at an exact row, and the next page picks up right after it, however many rows
+    share its time. Each page costs one query per kind of change, each reading at most `limit` rows off the index on
+    the modified time (which SQLite extends with the primary key).
+
+    Rows are timestamped when they are written but only seen once their transaction commits, so changes are only
+    listed up to a high-water mark that every row timestamped before has committed by (see :func:`safe_high_water`),
+    and the cursors handed out never go past it. The changes after it are listed once the feed catches up with them.
+
+    :param cursor:
+        The :class:`ChangeCursor` of the last change seen, or None to list every change from the beginning.
+    :param limit:
+        The most changes to list.
+    :param high_water:
+        The latest modified time to list changes up to, :func:`safe_high_water` by default.
+
+    :return:
+        A :class:`ChangePage` of :class:`Change` objects, the cursor to ask for the next page with (the cursor given
+        if there were no changes), whether there may be more changes after it, and the high-water mark.
+    """
+    if high_water is None:
+        high_water = safe_high_water()
+
+    streams = []
+    for kind, (name, model) in enumerate(CHANGE_KINDS):
+        queryset = _changed_after(model.objects.filter(last_modified_time__lte=high_water), kind, cursor) \
+            .order_by("last_modified_time", "pk")
+        if model in (Alias, AliasPointsToConflictingBookIssue):
+            queryset = queryset.select_related("book")
+        streams.append([
+            Change(name, ChangeCursor(instance.last_modified_time, kind, instance.pk), instance)
+            for instance in queryset[:limit]
+        ])
+
+    changes = []
+    for _, change in heapq.merge(*[[(change.cursor, change) for change in stream] for stream in streams]):
+        if len(changes) == limit:
+            break
+        changes.append(change)
+
+    next_cursor = changes[-1].cursor if changes else cursor
+    return ChangePage(changes, next_cursor, len(changes) == limit, high_water)
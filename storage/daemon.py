@@ -0,0 +1,349 @@
+# encoding: utf-8
+
+import os
+import sys
+import threading
+import time
+from Queue import Empty, Queue
+from contextlib import contextmanager
+
+from django.db import DatabaseError, connection
+
+from storage.batch import WriteCounts, process_book_records
+from storage.book_cache import book_cache
+from storage.changes import atomic_changes
+from storage.importer import read_book_records
+from storage.manifest import changed_files, record_import
+from storage.resolution import alias_cache
+import storage.tools
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# How long a file must go without being written to before it is considered complete, when we cannot tell otherwise.
+# Every such file waits this long before it is imported, while an upload that stalls for longer is taken half written,
+# fails to parse and is moved to failed/. Uploaders that stall should write under a name ending in one of
+# IN_PROGRESS_SUFFIXES and rename the file when done, or the daemon should run with pyinotify or a longer --settle.
+DEFAULT_SETTLE_SECONDS = 2
+
+# How often the drop directory is scanned
+DEFAULT_POLL_INTERVAL = 0.2
+
+# Names that uploads in progress commonly go by before being renamed into place
+IN_PROGRESS_SUFFIXES = (".part", ".partial", ".filepart", ".tmp")
+
+
+def is_feed_name(name):
+    return not name.startswith(".") and not name.endswith(IN_PROGRESS_SUFFIXES)
+
+
+class DropDirectoryWatcher(object):
+    """
+    Watch a directory for feed files that have been completely written.
+
+    With pyinotify installed, a file is complete once the writer closes it or it is moved into the directory, which is
+    how SFTP servers and `rsync` put finished uploads in place, however long the upload pauses on the way. Files that
+    were already there when we started may have been closed before we were watching, so those alone are also scanned
+    for, as without pyinotify, until they are reported.
+
+    Without pyinotify, the directory is scanned every `interval` seconds, and a file is complete once it has not been
+    written to for `settle` seconds, which trades how soon files are imported against how long an upload may pause
+    (see :data:`DEFAULT_SETTLE_SECONDS`). Hidden files and names ending in :data:`IN_PROGRESS_SUFFIXES` are never
+    reported.
+    """
+
+    def __init__(self, directory, settle=DEFAULT_SETTLE_SECONDS, interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+        self.directory = directory
+        self.settle = settle
+        self.interval = interval
+        self._reported = set()
+        self._preexisting = None
+
+        self._notifier = None
+        self._events = []
+        if use_inotify and pyinotify is not None:
+            manager = pyinotify.WatchManager()
+            manager.add_watch(directory, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+            self._notifier = pyinotify.Notifier(
+                manager,
+                default_proc_fun=self._events.append,
+                timeout=int(interval * 1000)
+            )
+
+    @property
+    def uses_inotify(self):
+        return self._notifier is not None
+
+    def poll(self):
+        """
+        Scan the directory once.
+
+        :return:
+            The complete files not reported before, oldest first.
+        """
+        return self._scan(os.listdir(self.directory))
+
+    def _scan(self, names):
+        now = time.time()
+        complete = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not is_feed_name(name) or path in self._reported:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if os.path.isfile(path) and now - mtime >= self.settle:
+                complete.append((mtime, path))
+
+        paths = [path for _, path in sorted(complete)]
+        self._reported.update(paths)
+        return paths
+
+    def wait(self):
+        """
+        Wait up to `interval` seconds for files to complete.
+
+        :return:
+            The complete files not reported before, in the order they arrived.
+        """
+        if self._notifier is None:
+            time.sleep(self.interval)
+            return self.poll()
+
+        # Scan for the files that were there when we started; any other file is reported by its events alone
+        if self._preexisting is None:
+            self._preexisting = set(os.listdir(self.directory))
+        paths = self._scan(self._preexisting)
+        for name in list(self._preexisting):
+            path = os.path.join(self.directory, name)
+            if path in self._reported or not os.path.exists(path):
+                self._preexisting.discard(name)
+
+        if self._notifier.check_events():
+            self._notifier.read_events()
+            self._notifier.process_events()
+        for event in self._events:
+            if is_feed_name(event.name) and event.pathname not in self._reported and os.path.isfile(event.pathname):
+                self._reported.add(event.pathname)
+                paths.append(event.pathname)
+        del self._events[:]
+        return paths
+
+    def forget(self, path):
+        """
+        Report the file again should a file of this name arrive later.
+        """
+        self._reported.discard(path)
+
+
+class Turnstile(object):
+    """
+    Let threads through one at a time in ticket order, whatever order they arrive in.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+
+    @contextmanager
+    def turn(self, ticket):
+        with self._condition:
+            while self._next_ticket != ticket:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._next_ticket += 1
+                self._condition.notify_all()
+
+
+class IngestionDaemon(object):
+    """
+    Import feed files as they are dropped into a directory, moving each to a done or failed directory afterwards.
+
+    Django starts once, and each worker thread keeps its database connection from one file to the next. Files are
+    queued in the order they completed. Workers parse files ahead in parallel, but the books are written one file at
+    a time in queue order, as later files may update the books of earlier ones; this also keeps SQLite to a single
+    writer. Each file is written in a transaction of its own through the batch engine (see :mod:`storage.batch`), and
+    recorded in the import manifest, so a file dropped again unchanged is moved to done without being imported.
+
+    :param directory:
+        The drop directory.
+    :param done_directory:
+        Where imported files are moved. Defaults to "done" inside the drop directory.
+    :param failed_directory:
+        Where files that failed to import are moved. Defaults to "failed" inside the drop directory.
+    :param workers:
+        How many files to parse at once. With 0, everything happens in the watching thread.
+    :param batch_size:
+        How many books to write per batch.
+    """
+
+    def __init__(
+        self,
+        directory,
+        done_directory=None,
+        failed_directory=None,
+        workers=1,
+        batch_size=storage.tools.DEFAULT_BATCH_SIZE,
+        settle=DEFAULT_SETTLE_SECONDS,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        use_inotify=True,
+        stdout=sys.stdout
+    ):
+        self.directory = directory
+        self.done_directory = done_directory or os.path.join(directory, "done")
+        self.failed_directory = failed_directory or os.path.join(directory, "failed")
+        self.workers = workers
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.watcher = DropDirectoryWatcher(directory, settle, poll_interval, use_inotify)
+
+        self._queue = Queue()
+        self._turnstile = Turnstile()
+        self._tickets = 0
+        self._stopping = threading.Event()
+        self._output_lock = threading.Lock()
+
+    def _write_line(self, line):
+        with self._output_lock:
+            self.stdout.write(line + "\n")
+
+    def stop(self):
+        """
+        Stop watching for new files; files already queued are still imported.
+        """
+        self._stopping.set()
+
+    def run(self, once=False):
+        """
+        Watch the drop directory until :meth:`stop` is called.
+
+        :param once:
+            Import the complete files in the directory now, then return.
+        """
+        for directory in (self.done_directory, self.failed_directory):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        threads = [
+            threading.Thread(target=self._work, name="ingest-{0}".format(number)) for number in range(self.workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        self._write_line("Watching {0} for feeds{1}.".format(
+            self.directory, " with inotify" if self.watcher.uses_inotify else ""
+        ))
+        try:
+            if once:
+                self._enqueue(self.watcher.poll())
+            else:
+                while not self._stopping.is_set():
+                    self._enqueue(self.watcher.wait())
+        finally:
+            if threads:
+                for _ in threads:
+                    self._queue.put(None)
+                for thread in threads:
+                    # Joining with a timeout keeps the main thread responsive to signals
+                    while thread.is_alive():
+                        thread.join(1)
+
+    def _enqueue(self, paths):
+        for path in paths:
+            ticket, self._tickets = self._tickets, self._tickets + 1
+            if self.workers:
+                self._queue.put((ticket, path))
+            else:
+                self._ingest(ticket, path)
+
+    def _work(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            if item is None:
+                return
+            try:
+                self._ingest(*item)
+            except Exception as error:
+                # Keep the worker alive for the files still to come
+                self._write_line("Failed to ingest {0}: {1}".format(item[1], error))
+
+    def _ingest(self, ticket, path):
+        """
+        Parse a file, then wait for its turn to write it.
+        """
+        started = time.time()
+        records, error = None, None
+        try:
+            records = read_book_records(path)
+        except Exception as read_error:
+            error = read_error
+
+        with self._turnstile.turn(ticket):
+            try:
+                counts, error = self._write(path, records, error)
+            except DatabaseError as database_error:
+                # Start over with a fresh connection for the next file
+                connection.close()
+                counts, error = None, database_error
+
+            self._move(path, self.failed_directory if error is not None else self.done_directory)
+            self.watcher.forget(path)
+
+        if error is not None:
+            self._write_line("Failed to import {0}: {1}".format(path, error))
+        elif counts is not None:
+            self._write_line("Imported {0} ({1} books: {2}) in {3:.3f}s.".format(
+                path, len(records), counts, time.time() - started
+            ))
+        else:
+            self._write_line("Skipped {0}, unchanged since it was last imported.".format(path))
+
+    def _write(self, path, records, error):
+        """
+        :return:
+            The :class:`storage.batch.WriteCounts` of the file, or None if it was not imported, and the error it failed
+            with, if any.
+        """
+        planned = changed_files([path])
+        if not planned:
+            return None, None
+        state = planned[0][1]
+
+        if error is None:
+            # Aliases may have been edited by the admin or another import since the last file, or rolled back with it
+            alias_cache.clear()
+            try:
+                counts = WriteCounts()
+                with atomic_changes():
+                    for start in xrange(0, len(records), self.batch_size):
+                        counts += process_book_records(records[start:start + self.batch_size])
+                    record_import(state)
+                return counts, None
+            except Exception as write_error:
+                error = write_error
+            finally:
+                # Requests made while the file was being written may have cached what they saw before it committed
+                book_cache.after_commit()
+
+        record_import(state, error)
+        return None, error
+
+    def _move(self, path, directory):
+        """
+        Move a file out of the drop directory, keeping earlier files of the same name.
+        """
+        target = os.path.join(directory, os.path.basename(path))
+        if os.path.exists(target):
+            target = "{0}.{1}".format(target, time.strftime("%Y%m%d%H%M%S"))
+        os.rename(path, target)
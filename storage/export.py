@@ -0,0 +1,208 @@
+# encoding: utf-8
+
+import json
+import re
+
+from storage.batch import in_chunks
+from storage.models import (
+    Alias,
+    AliasPointsToConflictingBookIssue,
+    AliasUsedAsBookIdIssue,
+    AliasUsedToResolveBookIdIssue,
+    Book,
+    VersionUnspecifiedIssue
+)
+
+# How many books are read per query when exporting
+DEFAULT_EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ("jsonl", "xml")
+
+# How many books are written to the file at once; writing each line on its own is costly with gzip
+_WRITE_BUFFER_BOOKS = 1000
+
+_BOOK_COLUMNS = ("pk", "book_id", "version", "title", "description", "last_modified_time")
+
+# The issues attached to a book through a foreign key, and the columns describing them
+_BOOK_ISSUES = (
+    (AliasUsedAsBookIdIssue, "book_resolved", ("source_file", "alias_used__scheme", "alias_used__value")),
+    (AliasUsedToResolveBookIdIssue, "book_resolved", ("source_file", "alias_used__scheme", "alias_used__value")),
+    (AliasPointsToConflictingBookIssue, "book", ("source_file", "scheme", "value")),
+)
+
+
+# What must be escaped in XML text and double-quoted attributes; whitespace in attributes would otherwise be normalized
+_XML_ESCAPES = {
+    u"&": u"&amp;",
+    u"<": u"&lt;",
+    u">": u"&gt;",
+    u'"': u"&quot;",
+    u"\n": u"&#10;",
+    u"\r": u"&#13;",
+    u"\t": u"&#9;",
+}
+_XML_TEXT_ESCAPE = re.compile(u"[&<>]")
+_XML_ATTRIBUTE_ESCAPE = re.compile(u'[&<>"\n\r\t]')
+
+
+def _escape(value):
+    return _XML_TEXT_ESCAPE.sub(lambda match: _XML_ESCAPES[match.group()], value)
+
+
+def _quote(value):
+    """
+    Quote an attribute value like :func:`xml.sax.saxutils.quoteattr`, which is several times slower as it replaces
+    every character it escapes in a separate pass.
+    """
+    return u'"{0}"'.format(_XML_ATTRIBUTE_ESCAPE.sub(lambda match: _XML_ESCAPES[match.group()], value))
+
+
+def _issue(model, source_file, scheme=None, value=None):
+    issue = {"issue": model.__name__, "source_file": source_file}
+    if scheme is not None:
+        issue["scheme"] = scheme
+        issue["value"] = value
+    return issue
+
+
+def iter_catalog(chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Stream every book with its aliases and the issues recorded against it, in primary key order.
+
+    A catalog does not fit in memory as model instances, and fetching each book's aliases on its own costs a query
+    per book. Books are instead read `chunk_size` at a time, each chunk picking up after the last primary key of the
+    one before, so that every chunk is a short range scan of the primary key however far into the table it is, where
+    OFFSET would scan and throw away every row before it. The aliases and issues of a chunk are then fetched with
+    one query per table over the same primary key range, and rows are read as tuples rather than model instances.
+    Only one chunk is held in memory at a time.
+
+    Issues pointing at a book through a foreign key are attached to that book. A :class:`VersionUnspecifiedIssue`
+    only records a book ID, so it is attached to every version of the book.
+
+    :param chunk_size:
+        How many books to read per query.
+
+    :return:
+        A generator of dictionaries, each describing a book like :func:`storage.serializers.serialize_book` with its
+        aliases, plus its issues.
+    """
+    last_pk = 0
+    while True:
+        rows = list(Book.objects.filter(pk__gt=last_pk).order_by("pk").values_list(*_BOOK_COLUMNS)[:chunk_size])
+        if not rows:
+            return
+        first_pk, last_pk = rows[0][0], rows[-1][0]
+
+        aliases = {}
+        for book_pk, scheme, value in Alias.objects.filter(book__gte=first_pk, book__lte=last_pk) \
+                .order_by("pk").values_list("book", "scheme", "value"):
+            aliases.setdefault(book_pk, []).append({"scheme": scheme, "value": value})
+
+        issues = {}
+        for model, book_field, columns in _BOOK_ISSUES:
+            rows_in_range = model.objects.filter(**{
+                book_field + "__gte": first_pk,
+                book_field + "__lte": last_pk
+            })
+            for row in rows_in_range.order_by("pk").values_list(book_field, *columns):
+                issues.setdefault(row[0], []).append(_issue(model, *row[1:]))
+
+        unspecified_versions = {}
+        for chunk in in_chunks(set(row[1] for row in rows)):
+            for book_id, source_file in VersionUnspecifiedIssue.objects.filter(book_id__in=chunk) \
+                    .order_by("pk").values_list("book_id", "source_file"):
+                unspecified_versions.setdefault(book_id, []).append(_issue(VersionUnspecifiedIssue, source_file))
+
+        for pk, book_id, version, title, description, last_modified_time in rows:
+            yield {
+                "book_id": book_id,
+                "version": version,
+                "title": title,
+                "description": description,
+                "last_modified": last_modified_time.isoformat(),
+                "aliases": aliases.get(pk, []),
+                "issues": issues.get(pk, []) + unspecified_versions.get(book_id, []),
+            }
+
+
+def _write_buffered(lines, file_handle):
+    """
+    Write lines to a file a few at a time.
+
+    :return:
+        How many lines were written.
+    """
+    count = 0
+    buffered = []
+    for line in lines:
+        buffered.append(line)
+        count += 1
+        if len(buffered) >= _WRITE_BUFFER_BOOKS:
+            file_handle.write("".join(buffered))
+            buffered = []
+    file_handle.write("".join(buffered))
+    return count
+
+
+def write_jsonl(documents, file_handle):
+    """
+    Write one JSON document per line. Keys are left unsorted, as sorting them makes the json module fall back from
+    its C encoder to a pure Python one several times slower.
+    """
+    return _write_buffered((json.dumps(document) + "\n" for document in documents), file_handle)
+
+
+def _book_xml(document):
+    parts = [u"<book id={0}>".format(_quote(document["book_id"]))]
+    parts.append(u"<title>{0}</title>".format(_escape(document["title"])))
+    parts.append(u"<version>{0}</version>".format(_escape(document["version"])))
+    if document["description"] is not None:
+        parts.append(u"<description>{0}</description>".format(_escape(document["description"])))
+
+    parts.append(u"<aliases>")
+    for alias in document["aliases"]:
+        parts.append(u"<alias scheme={0} value={1}/>".format(_quote(alias["scheme"]), _quote(alias["value"])))
+    parts.append(u"</aliases>")
+
+    if document["issues"]:
+        parts.append(u"<issues>")
+        for issue in document["issues"]:
+            parts.append(u"<issue {0}/>".format(u" ".join(
+                u"{0}={1}".format(name, _quote(issue[name]))
+                for name in ("issue", "source_file", "scheme", "value") if name in issue
+            )))
+        parts.append(u"</issues>")
+
+    parts.append(u"</book>\n")
+    return u"".join(parts).encode("utf-8")
+
+
+def write_xml(documents, file_handle):
+    """
+    Write the books as a feed in the shape of the files under data/, wrapped in a <books> element, so that it can be
+    imported again. Issues are listed in an <issues> element of each book, which the importer does not read.
+    """
+    file_handle.write("<books>\n")
+    count = _write_buffered((_book_xml(document) for document in documents), file_handle)
+    file_handle.write("</books>\n")
+    return count
+
+
+def export_catalog(file_handle, format="jsonl", chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Write every book in the catalog to a file (see :func:`iter_catalog`).
+
+    :param file_handle:
+        The binary file to write to, which may be a :class:`gzip.GzipFile`.
+    :param format:
+        One of :data:`EXPORT_FORMATS`: "jsonl" for a JSON document per line, or "xml" for a feed.
+    :param chunk_size:
+        How many books to read per query.
+
+    :return:
+        How many books were written.
+    """
+    writers = {"jsonl": write_jsonl, "xml": write_xml}
+    if format not in writers:
+        raise ValueError("Unknown export format {0!r}, expected one of {1}".format(format, ", ".join(EXPORT_FORMATS)))
+    return writers[format](iter_catalog(chunk_size), file_handle)
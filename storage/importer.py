@@ -0,0 +1,484 @@
+# encoding: utf-8
+
+import sys
+from collections import namedtuple
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from multiprocessing import Pool
+
+from django.db import connection, transaction
+
+from storage.batch import WriteCounts, process_book_records, resolve_book_ids
+from storage.book_cache import book_cache
+from storage.changes import atomic_changes
+from storage.isbn import ISBN_SCHEMES, alias_identity
+from storage.issues import issue_recorder
+from storage.manifest import changed_files, file_state, record_import, resume_point
+from storage.resolution import alias_cache
+from storage.sources import iter_feed_sources
+import storage.tools
+
+# How many files :func:`import_files` commits in one transaction by default
+DEFAULT_COMMIT_EVERY = 1
+
+# How many books :func:`import_file_in_checkpoints` commits at a time when resuming without being told, and without
+# the manifest telling either
+DEFAULT_CHECKPOINT_EVERY = 10000
+
+
+ImportFailure = namedtuple("ImportFailure", ["filename", "error"])
+
+
+class _CountingIterator(object):
+    """
+    Iterate over an iterable, counting the items taken from it.
+    """
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        item = next(self._iterator)
+        self.count += 1
+        return item
+
+
+def iter_file_books(filename):
+    """
+    Stream the books of a feed, across every XML file of an archive.
+
+    :return:
+        A generator of (source file, <book> element) pairs, in file order.
+    """
+    for source_file, file_handle in iter_feed_sources(filename):
+        for book_node in storage.tools.iter_book_elements(file_handle):
+            yield source_file, book_node
+
+
+def _import_books(books, batch_size=None):
+    """
+    Import (source file, <book> element) pairs one book at a time or in batches.
+
+    :return:
+        The :class:`storage.batch.WriteCounts` of the books.
+    """
+    counts = WriteCounts()
+    for source_file, group in groupby(books, key=itemgetter(0)):
+        book_nodes = (book_node for _, book_node in group)
+        if batch_size:
+            counts += storage.tools.process_book_elements(book_nodes, source_file, batch_size=batch_size)
+        else:
+            for book_node in book_nodes:
+                counts.add(storage.tools.process_book_element(book_node, source_file))
+    return counts
+
+
+def import_file(filename, batch_size=None):
+    """
+    Import every book in a single feed, one book at a time or in batches. The issues the feed raises are buffered
+    and written together at the end (see :class:`storage.issues.IssueRecorder`).
+
+    :param filename:
+        The path of the feed: an XML file, possibly compressed, or an archive of them (see
+        :func:`storage.sources.iter_feed_sources`).
+    :param batch_size:
+        If given, resolve and write books in batches of this size (see :func:`storage.tools.process_book_elements`).
+
+    :return:
+        The :class:`storage.batch.WriteCounts` of the feed.
+    """
+    with issue_recorder.buffering():
+        return _import_books(iter_file_books(filename), batch_size)
+
+
+def import_file_in_checkpoints(filename, state, checkpoint_every, batch_size=None, skip=0, warm_cache=False):
+    """
+    Import a feed in transactions of `checkpoint_every` books, each of which also records in the
+    :class:`storage.models.ImportManifest` how many books of the file are committed. An import that dies partway
+    therefore leaves whole checkpoints behind, and the manifest says exactly which books they cover.
+
+    Resuming skips those books and carries on from the next one. Because the checkpoints fall on the same books
+    whether or not the import was interrupted, and every batch and issue buffer ends with its checkpoint, the books
+    after a checkpoint are written against exactly the same database either way, and the result is the same as that of
+    a single uninterrupted run. Starting over instead would import the committed books a second time, giving those
+    without a version yet another one (see :func:`storage.tools._infer_book_version`).
+
+    The checkpoint and batch sizes are recorded with each checkpoint, and resuming has to use the same ones (see
+    :func:`resume_options`).
+
+    This must run outside of any transaction, for each checkpoint to commit.
+
+    :param state:
+        The :class:`storage.manifest.FileState` of the file.
+    :param checkpoint_every:
+        How many books to commit at a time.
+    :param batch_size:
+        If given, resolve and write books in batches of this size. Batches never span checkpoints.
+    :param skip:
+        How many books at the start of the file to skip, as an unfinished import committed them already (see
+        :func:`storage.manifest.resume_point`).
+    :param warm_cache:
+        Cache the documents of the books written as each checkpoint commits (see
+        :meth:`storage.book_cache.BookCache.after_commit`).
+
+    :return:
+        The :class:`storage.batch.WriteCounts` of the books imported, leaving out those skipped.
+    """
+    books = _CountingIterator(iter_file_books(filename))
+
+    # The skipped books are still parsed to find where the rest start, but nothing is written for them
+    for _ in islice(books, skip):
+        pass
+
+    counts = WriteCounts()
+    while True:
+        start = books.count
+        with atomic_changes():
+            with issue_recorder.buffering():
+                counts += _import_books(islice(books, checkpoint_every), batch_size)
+            finished = books.count - start < checkpoint_every
+            record_import(
+                state,
+                checkpoint=None if finished else books.count,
+                checkpoint_every=checkpoint_every,
+                batch_size=batch_size
+            )
+        book_cache.after_commit(warm=warm_cache)
+
+        if finished:
+            return counts
+
+
+def resume_options(point, checkpoint_every=None, batch_size=None):
+    """
+    Work out the checkpoint and batch sizes to import a file with. A file resumed from a checkpoint is imported with
+    those it was started with, as other ones would put later checkpoints and batches on other books than an
+    uninterrupted import did.
+
+    :param point:
+        The :class:`storage.manifest.ResumePoint` to resume from, or None to start from the beginning.
+    :param checkpoint_every:
+        The checkpoint size asked for, if any. Defaults to :data:`DEFAULT_CHECKPOINT_EVERY` for a new import.
+    :param batch_size:
+        The batch size asked for, if any.
+
+    :raises ValueError:
+        If a size asked for differs from the one the resumed import was started with.
+
+    :return:
+        A (checkpoint_every, batch_size) pair; the batch size is None to import one book at a time.
+    """
+    if point is None or not point.checkpoint_every:
+        # Checkpoints taken before their sizes were recorded are resumed with the sizes asked for
+        return checkpoint_every or DEFAULT_CHECKPOINT_EVERY, batch_size
+
+    if checkpoint_every and checkpoint_every != point.checkpoint_every:
+        raise ValueError("The import was started with checkpoints of {0} books, and has to be resumed with them".format(
+            point.checkpoint_every
+        ))
+    if batch_size is not None and batch_size != point.batch_size:
+        raise ValueError("The import was started {0}, and has to be resumed that way".format(
+            "with batches of {0} books".format(point.batch_size) if point.batch_size else "one book at a time"
+        ))
+    return point.checkpoint_every, point.batch_size or None
+
+
+def read_book_records(filename):
+    """
+    Parse every book in a feed into :class:`storage.tools.BookRecord` objects, without touching the database.
+
+    :return:
+        The records, in file order.
+    """
+    return [
+        storage.tools.read_book_element(book_node, source_file)
+        for source_file, book_node in iter_file_books(filename)
+    ]
+
+
+def _read_and_resolve_file(filename):
+    """
+    Parse a file into book records and work out which book each one resolves to. This is the part of an import that
+    only reads, so it runs in the worker processes.
+
+    :return:
+        A list of (resolved book ID, :class:`storage.tools.BookRecord`) pairs, in file order, or an
+        :class:`ImportFailure` if the file could not be read.
+    """
+    try:
+        records = read_book_records(filename)
+        return zip(resolve_book_ids(records), records)
+    except Exception as error:
+        return ImportFailure(filename, error)
+
+
+def _close_connection():
+    """
+    Worker initializer: never share the parent's database connection across a fork.
+    """
+    connection.close()
+
+
+def partition_records(resolved_records):
+    """
+    Group book records so that records which can affect each other's outcome end up in the same group.
+
+    Resolving a record only ever looks at the books and aliases sharing one of its identifiers: its own ID, which may
+    be an ISBN, its aliases and the book it resolved to. Records sharing none of those can be written in any order
+    relative to each other without changing the result. So we join records sharing any identifier into one group, which
+    collects all the versions and aliases of a book (and anything that could be mistaken for it) into a single group.
+    Aliases are compared as resolution compares them, by :func:`storage.isbn.alias_identity`, so every form of an ISBN
+    is the same identifier.
+
+    :param resolved_records:
+        (resolved book ID, record) pairs in import order.
+
+    :return:
+        A list of groups, each a list of records in import order, ordered by the position of their first record.
+    """
+    parents = {}
+
+    def find(key):
+        root = key
+        while parents.setdefault(root, root) != root:
+            root = parents[root]
+        while parents[key] != root:
+            parents[key], key = root, parents[key]
+        return root
+
+    record_keys = []
+    for resolved_book_id, record in resolved_records:
+        keys = [resolved_book_id, record.book_id, alias_identity(ISBN_SCHEMES[0], record.book_id)]
+        keys.extend(alias_identity(scheme, value) for scheme, value in record.aliases)
+        root = find(keys[0])
+        for key in keys[1:]:
+            other = find(key)
+            if other != root:
+                parents[other] = root
+        record_keys.append((keys[0], record))
+
+    groups = {}
+    ordered_groups = []
+    for key, record in record_keys:
+        root = find(key)
+        if root not in groups:
+            groups[root] = []
+            ordered_groups.append(groups[root])
+        groups[root].append(record)
+
+    return ordered_groups
+
+
+def _write_records(records, batch_size):
+    counts = WriteCounts()
+    for start in xrange(0, len(records), batch_size):
+        counts += process_book_records(records[start:start + batch_size])
+    return counts
+
+
+def import_files_in_parallel(filenames, workers, batch_size=storage.tools.DEFAULT_BATCH_SIZE, states=None):
+    """
+    Import many files, parsing and resolving them in a pool of worker processes, then writing everything from this
+    process.
+
+    The workers only read, so they never compete for the database. Their records are partitioned by
+    :func:`partition_records` and written group by group through the batch engine, each group in import order. Every
+    version and alias of a book therefore goes through the one writer in a fixed order, and the result is the same
+    as importing the files one after another.
+
+    The workers resolve each record against the database as it was before the import, which is all partitioning
+    needs. The writer still resolves every record again, as a record may resolve to a book or alias written by an
+    earlier record of its group; only parsing, and resolution for partitioning, run in parallel.
+
+    The records of all the files are written in one transaction. Should writing fail, it is rolled back and the files
+    are written again one after another from the records already read, each with a savepoint of its own, so that only
+    the files that fail are rolled back. The import of each file is recorded in the manifest in the same transaction
+    as its books, or once its books were rolled back, so that a run that dies in between imports nothing twice.
+
+    :param filenames:
+        The paths of the XML files, in import order.
+    :param workers:
+        The number of processes parsing and resolving files. With a single worker everything runs in this process.
+    :param batch_size:
+        How many records to write per batch.
+    :param states:
+        The :func:`storage.manifest.file_state` of each file by path, to record in the manifest as it is imported. If
+        not given, nothing is recorded.
+
+    :return:
+        A list of :class:`ImportFailure` for the files that could not be read or written, of which nothing is written,
+        in import order, and the :class:`storage.batch.WriteCounts` of the others.
+    """
+    if workers > 1:
+        # Forked workers must open their own connections rather than inherit ours
+        connection.close()
+        pool = Pool(workers, initializer=_close_connection)
+        try:
+            resolved_files = pool.map(_read_and_resolve_file, filenames, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        resolved_files = map(_read_and_resolve_file, filenames)
+
+    failures = [result for result in resolved_files if isinstance(result, ImportFailure)]
+    read_files = [(filename, result) for filename, result in zip(filenames, resolved_files) if isinstance(result, list)]
+
+    def record_file(filename, error=None):
+        if states is not None:
+            record_import(states[filename], error)
+
+    for failure in failures:
+        record_file(failure.filename, failure.error)
+
+    try:
+        with atomic_changes():
+            groups = partition_records(chain.from_iterable(result for _, result in read_files))
+            counts = _write_records([record for group in groups for record in group], batch_size)
+            for filename, _ in read_files:
+                record_file(filename)
+    except Exception:
+        # The caches may hold aliases and issues that were just rolled back
+        alias_cache.clear()
+        issue_recorder.clear()
+
+        counts = WriteCounts()
+        for filename, resolved_records in read_files:
+            try:
+                with atomic_changes():
+                    counts += _write_records([record for _, record in resolved_records], batch_size)
+                    record_file(filename)
+            except Exception as error:
+                alias_cache.clear()
+                issue_recorder.clear()
+                failures.append(ImportFailure(filename, error))
+                record_file(filename, error)
+        failures.sort(key=lambda failure: filenames.index(failure.filename))
+
+    return failures, counts
+
+
+def import_files(
+    filenames,
+    batch_size=None,
+    workers=None,
+    commit_every=DEFAULT_COMMIT_EVERY,
+    force=False,
+    trust_mtime=False,
+    warm_cache=False,
+    checkpoint_every=None,
+    resume=False,
+    stdout=sys.stdout
+):
+    """
+    Import feeds into the database in order, skipping files that have not changed since they were last imported
+    (see :func:`storage.manifest.changed_files`).
+
+    Files are committed together in transactions of `commit_every` files, which saves SQLite from syncing to disk after
+    every statement. Each file gets its own savepoint within the transaction, so a file that fails to import is rolled
+    back on its own and reported, and the rest of the transaction still commits.
+
+    With `checkpoint_every`, each file is committed instead a stretch of books at a time, and an import that died
+    partway can be resumed from its last checkpoint (see :func:`import_file_in_checkpoints`). A file that fails then
+    keeps the checkpoints it committed.
+
+    :param filenames:
+        The paths of the feeds, which may be compressed or archived (see :func:`storage.sources.iter_feed_sources`).
+    :param batch_size:
+        If given, resolve and write books in batches of this size.
+    :param workers:
+        If given, parse and resolve the files in this many worker processes (see :func:`import_files_in_parallel`).
+    :param commit_every:
+        How many files to commit per transaction.
+    :param force:
+        Import every file, even those that have not changed.
+    :param trust_mtime:
+        Take files whose size and modification time match the manifest to be unchanged without reading them (see
+        :func:`storage.manifest.changed_files`).
+    :param warm_cache:
+        Cache the documents of the books written as each transaction commits, rather than leave the API to cache them
+        on their first request (see :meth:`storage.book_cache.BookCache.warm`).
+    :param checkpoint_every:
+        If given, commit each file this many books at a time. This cannot be combined with `workers`.
+    :param resume:
+        Resume files whose last import did not finish from their last checkpoint, rather than import them from the
+        start, with the checkpoint and batch sizes they were started with (see :func:`resume_options`). Other files are
+        imported in checkpoints, of :data:`DEFAULT_CHECKPOINT_EVERY` books if `checkpoint_every` is not given.
+    :param stdout:
+        Where to report progress, and how many books were created, updated or left unchanged.
+
+    :return:
+        A list of :class:`ImportFailure` for the files that were rolled back.
+    """
+    # Issues may have been reviewed and deleted, and aliases edited elsewhere, since the last import
+    issue_recorder.clear()
+    alias_cache.clear()
+
+    if force:
+        planned = [(filename, file_state(filename)) for filename in filenames]
+    else:
+        planned = changed_files(filenames, trust_mtime)
+        if len(planned) < len(filenames):
+            stdout.write("Skipping {0} unchanged files.\n".format(len(filenames) - len(planned)))
+
+    if workers:
+        stdout.write("Importing {0} files into database with {1} workers.\n".format(len(planned), workers))
+        failures, counts = import_files_in_parallel(
+            [filename for filename, _ in planned],
+            workers,
+            batch_size or storage.tools.DEFAULT_BATCH_SIZE,
+            states=dict(planned)
+        )
+        book_cache.after_commit(warm=warm_cache)
+    elif checkpoint_every or resume:
+        failures = []
+        counts = WriteCounts()
+        for filename, state in planned:
+            point = resume_point(state) if resume else None
+            if point is not None:
+                stdout.write("Resuming {0} after book {1}.\n".format(filename, point.checkpoint))
+            else:
+                stdout.write("Importing {0} into database.\n".format(filename))
+            try:
+                file_checkpoint_every, file_batch_size = resume_options(point, checkpoint_every, batch_size)
+                counts += import_file_in_checkpoints(
+                    filename,
+                    state,
+                    file_checkpoint_every,
+                    file_batch_size,
+                    skip=point.checkpoint if point is not None else 0,
+                    warm_cache=warm_cache
+                )
+            except Exception as error:
+                # The caches may hold aliases and issues that were just rolled back
+                alias_cache.clear()
+                issue_recorder.clear()
+                failures.append(ImportFailure(filename, error))
+                record_import(state, error)
+    else:
+        failures = []
+        counts = WriteCounts()
+        for start in xrange(0, len(planned), commit_every):
+            with atomic_changes():
+                for filename, state in planned[start:start + commit_every]:
+                    stdout.write("Importing {0} into database.\n".format(filename))
+                    try:
+                        with transaction.atomic():
+                            file_counts = import_file(filename, batch_size)
+                            record_import(state)
+                        counts += file_counts
+                    except Exception as error:
+                        # The caches may hold aliases and issues that were just rolled back
+                        alias_cache.clear()
+                        issue_recorder.clear()
+                        failures.append(ImportFailure(filename, error))
+                        record_import(state, error)
+            book_cache.after_commit(warm=warm_cache)
+
+    for failure in failures:
+        stdout.write("Failed to import {0}: {1}\n".format(failure.filename, failure.error))
+    stdout.write("Books: {0}.\n".format(counts))
+    return failures
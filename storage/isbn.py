@@ -0,0 +1,73 @@
+# encoding: utf-8
+
+import re
+
+# The alias schemes that hold ISBNs, which we trust as universal identifiers
+ISBN_SCHEMES = ("ISBN-10", "ISBN-13")
+
+# Feeds write ISBNs with hyphens or spaces between their parts, as they are printed
+_SEPARATORS = re.compile(r"[\s-]+")
+
+
+def isbn10_check_digit(digits):
+    """
+    :return:
+        The ISBN-10 check digit for the first nine digits of an ISBN-10.
+    """
+    remainder = (11 - sum((10 - position) * int(digit) for position, digit in enumerate(digits)) % 11) % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+def isbn13_check_digit(digits):
+    """
+    :return:
+        The ISBN-13 check digit for the first twelve digits of an ISBN-13.
+    """
+    return str((10 - sum((3 if position % 2 else 1) * int(digit) for position, digit in enumerate(digits)) % 10) % 10)
+
+
+def to_isbn13(value):
+    """
+    Read an ISBN-10 or ISBN-13, with or without separators, as the 13 digits of its ISBN-13. Every ISBN-10 has an
+    ISBN-13, made by prefixing it with 978 and recomputing the check digit.
+
+    :return:
+        The digits of the ISBN-13, or None if the value is not an ISBN or its check digit is wrong.
+    """
+    if not value:
+        return None
+
+    digits = _SEPARATORS.sub("", value).upper()
+    if len(digits) == 10 and digits[:9].isdigit() and isbn10_check_digit(digits[:9]) == digits[9]:
+        stem = "978" + digits[:9]
+        return stem + isbn13_check_digit(stem)
+    if len(digits) == 13 and digits.isdigit() and digits[:3] in ("978", "979") and \
+            isbn13_check_digit(digits[:12]) == digits[12]:
+        return digits
+    return None
+
+
+def canonical_value(scheme, value):
+    """
+    The form of an alias value that is stored in :attr:`storage.models.Alias.canonical_value` and matched on: the
+    ISBN-13 digits for a valid ISBN of either ISBN scheme, so that "0-306-40615-2" and "9780306406157" are the same
+    value, and the value as it is otherwise. ISBNs with a wrong check digit are kept as they are too, as we cannot tell
+    which digit is wrong.
+    """
+    if scheme in ISBN_SCHEMES:
+        return to_isbn13(value) or value
+    return value
+
+
+def alias_identity(scheme, value):
+    """
+    What makes two aliases the same identifier. An ISBN is the same identifier whichever ISBN scheme and form it is
+    written in, so both ISBN schemes share an identity keyed on the canonical value; any other alias is identified by
+    its scheme and value.
+
+    :return:
+        A hashable (scheme, value) pair.
+    """
+    if scheme in ISBN_SCHEMES:
+        return "ISBN", canonical_value(scheme, value)
+    return scheme, value
@@ -0,0 +1,166 @@
+# encoding: utf-8
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import Model
+from django.utils.encoding import force_text
+
+from storage.models import (
+    AliasPointsToConflictingBookIssue,
+    AliasUsedAsBookIdIssue,
+    AliasUsedToResolveBookIdIssue,
+    VersionUnspecifiedIssue
+)
+
+ISSUE_MODELS = (
+    AliasPointsToConflictingBookIssue,
+    AliasUsedAsBookIdIssue,
+    AliasUsedToResolveBookIdIssue,
+    VersionUnspecifiedIssue,
+)
+
+# SQLite refuses queries with more than 999 parameters, so source files are looked up this many at a time
+_SOURCE_FILE_CHUNK_SIZE = 500
+
+
+def issue_key(model, kwargs):
+    """
+    Build a hashable key for an issue, equal for any two sets of field values that `get_or_create` would consider the
+    same issue. Related objects and their primary keys give the same key, as do byte and unicode strings. Django
+    considers every unsaved instance equal to every other unsaved instance of the same model, so an unsaved related
+    object is told apart by the Python object itself until it is saved.
+
+    :param model:
+        The issue model.
+    :param kwargs:
+        The field values of the issue, by field name or column name.
+    """
+    fields = dict((field.name, field) for field in model._meta.local_fields)
+    fields.update((field.attname, field) for field in model._meta.local_fields)
+
+    values = []
+    for name, value in kwargs.items():
+        field = fields[name]
+        if isinstance(value, Model):
+            value = value.pk if value.pk is not None else ("new", id(value))
+        elif isinstance(value, bytes):
+            value = force_text(value)
+        values.append((field.attname, value))
+    return model, tuple(sorted(values))
+
+
+def bulk_create_issues(model, issues):
+    """
+    Insert new issues in one statement. Should another importer have recorded one of them in the meantime, the unique
+    constraint on the issue table rejects the statement, and the issues are inserted one at a time instead, skipping
+    those that already exist.
+    """
+    if not issues:
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(issues)
+    except IntegrityError:
+        for issue in issues:
+            try:
+                with transaction.atomic():
+                    issue.save(force_insert=True)
+            except IntegrityError:
+                pass
+
+
+class IssueRecorder(object):
+    """
+    Records issues for manual review during an import.
+
+    The issue models are written with `get_or_create`, which costs a query to look for the issue and another to insert
+    it, and messy feeds raise an issue for a large share of their books. Within :meth:`buffering`, the recorder instead
+    keeps new issues in memory, skips any it has already seen in this import, and writes the rest when the block ends,
+    with a query per issue type to find those already in the database and a bulk insert for the others. Outside of it,
+    issues are written straight away.
+
+    The recorder remembers which issues exist so that the same issue is not looked up again, which holds as long as
+    nothing else deletes issues in the meantime; :func:`storage.importer.import_files` clears it at the start of every
+    import, and whenever a file is rolled back.
+    """
+
+    def __init__(self):
+        self._buffering = 0
+        self._known = set()
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @contextmanager
+    def buffering(self):
+        """
+        Buffer the issues recorded within the block and write them when it ends. Nothing is written if the block raises.
+        Nested blocks are written with the outermost.
+        """
+        self._buffering += 1
+        try:
+            yield self
+        except Exception:
+            self._buffering -= 1
+            self.clear()
+            raise
+
+        self._buffering -= 1
+        if not self._buffering:
+            self.flush()
+
+    def record(self, model, **kwargs):
+        """
+        The equivalent of `model.objects.get_or_create(**kwargs)` for the issue models.
+        """
+        key = issue_key(model, kwargs)
+        if key in self._known or key in self._pending:
+            return
+
+        if self._buffering:
+            self._pending[key] = (model, kwargs)
+        else:
+            model.objects.get_or_create(**kwargs)
+
+    def flush(self):
+        """
+        Write the buffered issues that are not in the database yet.
+        """
+        pending, self._pending = self._pending, OrderedDict()
+        for model in ISSUE_MODELS:
+            entries = [(key, kwargs) for key, (issue_model, kwargs) in pending.items() if issue_model is model]
+            if not entries:
+                continue
+
+            existing = self._existing_keys(model, entries)
+            bulk_create_issues(model, [model(**kwargs) for key, kwargs in entries if key not in existing])
+            self._known.update(key for key, _ in entries)
+
+    @staticmethod
+    def _existing_keys(model, entries):
+        attnames = sorted(
+            field.attname for field in model._meta.local_fields
+            if field.name not in ("id", "created_time", "last_modified_time")
+        )
+        source_files = list(set(force_text(kwargs["source_file"]) for _, kwargs in entries))
+
+        keys = set()
+        for start in xrange(0, len(source_files), _SOURCE_FILE_CHUNK_SIZE):
+            chunk = source_files[start:start + _SOURCE_FILE_CHUNK_SIZE]
+            for row in model.objects.filter(source_file__in=chunk).values_list(*attnames):
+                keys.add((model, tuple(zip(attnames, row))))
+        return keys
+
+    def clear(self):
+        """
+        Forget every issue, buffered or known.
+        """
+        self._known = set()
+        self._pending = OrderedDict()
+
+
+issue_recorder = IssueRecorder()
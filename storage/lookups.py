@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+from collections import namedtuple
+
+from storage.batch import in_chunks
+from storage.isbn import ISBN_SCHEMES, alias_identity, canonical_value
+from storage.models import Alias, Book, alias_filter
+
+# Universal identifiers we trust to resolve a book, unlike proprietary aliases
+# (see :func:`storage.tools._resolve_book_id`)
+TRUSTED_SCHEMES = ISBN_SCHEMES
+
+# How a resolution would have been recorded by the import, if it had resolved a <book> element this way
+ALIAS_USED_AS_BOOK_ID = "alias_used_as_book_id"
+ALIAS_USED_TO_RESOLVE_BOOK_ID = "alias_used_to_resolve_book_id"
+
+
+Resolution = namedtuple("Resolution", ["scheme", "value", "book", "trusted", "flag"])
+
+
+def normalize_version(version):
+    """
+    Versions are stored the way the import writes them, as `str(float(version))`, so "2" is stored as "2.0". Apply the
+    same to a version being looked up, leaving versions that are not numbers as they are.
+    """
+    try:
+        return str(float(version))
+    except (TypeError, ValueError):
+        return version
+
+
+def find_book(book_id, version=None):
+    """
+    Find a book by its book ID, with a single query on the (book_id, version) or (book_id, version_key) index.
+
+    :param book_id:
+        The book ID.
+    :param version:
+        The version to find. If not given, the latest version is found, as ordered by :attr:`Book.version_key`.
+
+    :return:
+        The :class:`Book`, or None.
+    """
+    books = Book.objects.filter(book_id=book_id)
+    if version is not None:
+        return books.filter(version=normalize_version(version)).first()
+    return books.order_by("-version_key").first()
+
+
+def find_book_by_alias(scheme, value):
+    """
+    Find the book an alias belongs to, with a single query on the (scheme, value) or canonical_value index of
+    :class:`Alias`. Like the import (see :func:`storage.resolution.lookup_alias`), the first matching alias wins, and
+    an ISBN matches in either form.
+
+    :return:
+        The :class:`Book`, or None.
+    """
+    lookups = dict(("aliases__" + name, lookup) for name, lookup in alias_filter(scheme, value).items())
+    return Book.objects.filter(**lookups).order_by("aliases__id").first()
+
+
+def aliases_of(book):
+    """
+    :return:
+        The aliases of a book in the order they were added, with a single query on the book's foreign key index.
+    """
+    return list(Alias.objects.filter(book=book).order_by("pk"))
+
+
+def resolve_identifiers(identifiers):
+    """
+    Resolve many identifiers to books at once, with the same rules as the import applies to the ID of a <book> element
+    (see :func:`storage.tools._resolve_book_id`):
+
+    * a bare value that is a book ID resolves to the latest version of that book;
+    * otherwise a bare value that is an ISBN-10 or ISBN-13 resolves to the book of that alias, which is trusted but
+      flagged like an :class:`storage.models.AliasUsedAsBookIdIssue`;
+    * otherwise a bare value that is any other alias resolves to the book of that alias, which is not trusted and
+      flagged like an :class:`storage.models.AliasUsedToResolveBookIdIssue`;
+    * a (scheme, value) pair resolves to the book of that alias, trusted if the scheme is an ISBN and otherwise flagged
+      like an :class:`storage.models.AliasUsedToResolveBookIdIssue`.
+
+    Where several aliases share a scheme and value, the first one wins, as in :func:`storage.resolution.lookup_alias`.
+    ISBNs match in either form, against aliases of both ISBN schemes. Everything is loaded with two IN queries per
+    :data:`storage.batch.IN_QUERY_CHUNK_SIZE` values, whatever the mix.
+
+    :param identifiers:
+        A list of (scheme, value) pairs, with a scheme of None for bare values.
+
+    :return:
+        A :class:`Resolution` for each identifier, in the same order, with a book of None for those that did not
+        resolve.
+    """
+    bare_values = set(value for scheme, value in identifiers if scheme is None)
+    values = set(canonical_value(scheme, value) for scheme, value in identifiers if scheme is not None)
+    # A bare value may be an ISBN in any form, or any other alias
+    values.update(bare_values)
+    values.update(canonical_value(TRUSTED_SCHEMES[0], value) for value in bare_values)
+
+    latest_books = {}
+    for chunk in in_chunks(bare_values):
+        for book in Book.objects.filter(book_id__in=chunk):
+            latest = latest_books.get(book.book_id)
+            if latest is None or book.version_key > latest.version_key:
+                latest_books[book.book_id] = book
+
+    first_aliases = {}
+    for chunk in in_chunks(values):
+        for alias in Alias.objects.filter(canonical_value__in=chunk).select_related("book").order_by("pk"):
+            first_aliases.setdefault(alias_identity(alias.scheme, alias.value), alias)
+
+    # For bare values, the first alias of any untrusted scheme
+    untrusted_aliases = {}
+    for alias in sorted(first_aliases.values(), key=lambda alias: alias.pk):
+        if alias.scheme not in TRUSTED_SCHEMES:
+            untrusted_aliases.setdefault(alias.value, alias)
+
+    resolutions = []
+    for scheme, value in identifiers:
+        if scheme is not None:
+            alias = first_aliases.get(alias_identity(scheme, value))
+            trusted = scheme in TRUSTED_SCHEMES
+            resolutions.append(Resolution(
+                scheme,
+                value,
+                alias.book if alias is not None else None,
+                trusted,
+                None if trusted or alias is None else ALIAS_USED_TO_RESOLVE_BOOK_ID
+            ))
+        elif value in latest_books:
+            resolutions.append(Resolution(scheme, value, latest_books[value], True, None))
+        else:
+            trusted_alias = first_aliases.get(alias_identity(TRUSTED_SCHEMES[0], value))
+            if trusted_alias is not None:
+                resolutions.append(Resolution(scheme, value, trusted_alias.book, True, ALIAS_USED_AS_BOOK_ID))
+            elif value in untrusted_aliases:
+                resolutions.append(Resolution(
+                    scheme, value, untrusted_aliases[value].book, False, ALIAS_USED_TO_RESOLVE_BOOK_ID
+                ))
+            else:
+                resolutions.append(Resolution(scheme, value, None, False, None))
+
+    return resolutions
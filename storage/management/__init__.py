@@ -1,3 +1,17 @@
 # encoding: utf-8
-# Created by David Rideout <drideout@safaribooksonline.com> on 2/7/14 3:46 PM
-# Copyright (c) 2013 Safari Books Online, LLC. All rights reserved.
\ No newline at end of file
+
+from django.db.models.signals import post_syncdb
+from django.dispatch import receiver
+
+from storage.search import create_search_index
+import storage.models
+
+
+@receiver(post_syncdb, sender=storage.models)
+def create_book_search_index(sender, created_models, db, **kwargs):
+    """
+    syncdb creates the book table, but knows nothing of the full-text index over it (see :mod:`storage.search`).
+    Existing databases get the index from `migrate_storage`.
+    """
+    if storage.models.Book in created_models:
+        create_search_index(using=db)
@@ -0,0 +1,81 @@
+# encoding: utf-8
+
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connection
+
+from storage.benchmark import benchmark_import
+import storage.tools
+
+
+class Command(NoArgsCommand):
+    help = (
+        "Import synthetic feeds of increasing size into a throwaway database and report books/sec, SQL queries per "
+        "book, peak RSS and how many alias lookups the alias cache answered"
+    )
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            "--sizes",
+            dest="sizes",
+            default="1000,10000,100000",
+            help="Comma separated numbers of books to import, one run each."
+        ),
+        make_option(
+            "--batch-size",
+            type="int",
+            dest="batch_size",
+            default=storage.tools.DEFAULT_BATCH_SIZE,
+            help="Import in batches of this size; 0 imports one book at a time."
+        ),
+        make_option("--seed", type="int", dest="seed", default=0, help="The seed for the synthetic feeds."),
+        make_option(
+            "--db-file",
+            dest="db_file",
+            default=None,
+            help="Create the throwaway database in this file rather than in memory, to measure disk and journaling."
+        ),
+        make_option(
+            "--bulk-load",
+            action="store_true",
+            dest="bulk_load",
+            default=False,
+            help="Import under the SQLite bulk load profile (see storage.sqlite)."
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        try:
+            sizes = sorted(int(size) for size in options["sizes"].split(","))
+        except ValueError:
+            raise CommandError("--sizes takes comma separated numbers, not {0!r}.".format(options["sizes"]))
+
+        self.stdout.write("{0:>10} {1:>10} {2:>10} {3:>14} {4:>14} {5:>16}".format(
+            "books", "seconds", "books/sec", "queries/book", "peak RSS (MB)", "alias hits (%)"
+        ))
+        if options["db_file"]:
+            connection.settings_dict["TEST_NAME"] = options["db_file"]
+
+        for size in sizes:
+            # Every run starts from an empty database, created like the test database so ours is left alone
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                result = benchmark_import(
+                    size,
+                    seed=options["seed"],
+                    batch_size=options["batch_size"] or None,
+                    bulk_load=options["bulk_load"]
+                )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+            alias_lookups = result.alias_cache_hits + result.alias_cache_misses
+            self.stdout.write("{0:>10} {1:>10.2f} {2:>10.1f} {3:>14.2f} {4:>14.1f} {5:>16}".format(
+                result.books,
+                result.seconds,
+                result.books / result.seconds if result.seconds else 0,
+                float(result.queries) / result.books if result.books else 0,
+                result.peak_rss_kb / 1024.0,
+                # The batch engine resolves against its snapshot rather than the alias cache
+                "{0:.1f}".format(100.0 * result.alias_cache_hits / alias_lookups) if alias_lookups else "n/a"
+            ))
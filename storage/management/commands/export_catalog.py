@@ -0,0 +1,66 @@
+# encoding: utf-8
+
+import gzip
+import time
+from contextlib import closing
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.export import DEFAULT_EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_catalog
+
+
+class Command(BaseCommand):
+    args = "<filename>"
+    help = "Write every book with its aliases and issues to a JSON lines or XML file, optionally gzipped"
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--format",
+            type="choice",
+            choices=EXPORT_FORMATS,
+            dest="format",
+            default=None,
+            help="jsonl or xml. Defaults to xml for file names ending in .xml or .xml.gz, and jsonl otherwise."
+        ),
+        make_option(
+            "--gzip",
+            action="store_true",
+            dest="gzip",
+            default=False,
+            help="Compress the file with gzip. Implied by file names ending in .gz."
+        ),
+        make_option(
+            "--chunk-size",
+            type="int",
+            dest="chunk_size",
+            default=DEFAULT_EXPORT_CHUNK_SIZE,
+            help="How many books to read per query."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the name of the file to write.")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        filename = args[0]
+        compress = options["gzip"] or filename.endswith(".gz")
+        export_format = options["format"]
+        if export_format is None:
+            stem = filename[:-len(".gz")] if filename.endswith(".gz") else filename
+            export_format = "xml" if stem.endswith(".xml") else "jsonl"
+
+        started = time.time()
+        if compress:
+            # The default level 9 costs several times the CPU of level 6 for a slightly smaller file
+            file_handle = gzip.GzipFile(filename, "wb", compresslevel=6)
+        else:
+            file_handle = open(filename, "wb")
+        with closing(file_handle):
+            books = export_catalog(file_handle, export_format, options["chunk_size"])
+
+        seconds = time.time() - started
+        self.stdout.write("Exported {0} books to {1} in {2:.1f}s ({3:.0f} books/sec).".format(
+            books, filename, seconds, books / seconds if seconds else 0
+        ))
@@ -0,0 +1,68 @@
+# encoding: utf-8
+
+import json
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from storage.changes import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    changes_since,
+    format_cursor,
+    parse_cursor,
+    safe_high_water
+)
+from storage.serializers import serialize_change
+
+
+class Command(NoArgsCommand):
+    help = "Print the changes after a cursor as JSON lines, the same as the change feed API, then the next cursor"
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            "--cursor",
+            dest="cursor",
+            default=None,
+            help="The cursor the last sync ended at. Without one, every change is printed."
+        ),
+        make_option(
+            "--page-size",
+            type="int",
+            dest="page_size",
+            default=DEFAULT_PAGE_SIZE,
+            help="How many changes to read per query."
+        ),
+        make_option(
+            "--limit",
+            type="int",
+            dest="limit",
+            default=None,
+            help="Stop after about this many changes, at the end of a page. By default, print every change."
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        try:
+            cursor = parse_cursor(options["cursor"]) if options["cursor"] else None
+        except ValueError as error:
+            raise CommandError(error)
+        if not 1 <= options["page_size"] <= MAX_PAGE_SIZE:
+            raise CommandError("--page-size must be between 1 and {0}.".format(MAX_PAGE_SIZE))
+
+        printed = 0
+        high_water = safe_high_water()
+        while True:
+            page = changes_since(cursor, options["page_size"], high_water)
+            for change in page.changes:
+                self.stdout.write(json.dumps(serialize_change(change)))
+            printed += len(page.changes)
+            cursor = page.cursor
+            if not page.more or (options["limit"] is not None and printed >= options["limit"]):
+                break
+
+        # The changes go to stdout to be piped elsewhere, so the cursor to continue from goes to stderr
+        self.stderr.write("Printed {0} changes up to {1}. Next cursor: {2}".format(
+            printed,
+            high_water.isoformat(),
+            format_cursor(cursor) if cursor is not None else "none, there are no changes yet"
+        ))
@@ -0,0 +1,76 @@
+# encoding: utf-8
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.synthetic import generate_feed
+
+
+class Command(BaseCommand):
+    args = "<filename>"
+    help = "Write a synthetic feed of <book> elements for testing and benchmarking imports"
+    option_list = BaseCommand.option_list + (
+        make_option("--books", type="int", dest="books", default=1000, help="How many books to write."),
+        make_option("--seed", type="int", dest="seed", default=0, help="The seed for the random choices."),
+        make_option(
+            "--aliases-per-book",
+            type="int",
+            dest="aliases_per_book",
+            default=2,
+            help="How many aliases each book has."
+        ),
+        make_option(
+            "--version-churn",
+            type="float",
+            dest="version_churn",
+            default=0.2,
+            help="The share of books that are new editions of earlier ones."
+        ),
+        make_option(
+            "--missing-version-rate",
+            type="float",
+            dest="missing_version_rate",
+            default=0.05,
+            help="The share of books without a version."
+        ),
+        make_option(
+            "--alias-as-id-rate",
+            type="float",
+            dest="alias_as_id_rate",
+            default=0.05,
+            help="The share of books identified by one of their aliases."
+        ),
+        make_option(
+            "--conflicting-alias-rate",
+            type="float",
+            dest="conflicting_alias_rate",
+            default=0.02,
+            help="The share of books carrying an alias of another book."
+        ),
+        make_option(
+            "--first-book",
+            type="int",
+            dest="first_book",
+            default=0,
+            help="The number of the first book, to generate feeds describing different books."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the name of the file to write.")
+
+        with open(args[0], "wb") as file_handle:
+            generate_feed(
+                file_handle,
+                options["books"],
+                seed=options["seed"],
+                aliases_per_book=options["aliases_per_book"],
+                version_churn=options["version_churn"],
+                missing_version_rate=options["missing_version_rate"],
+                alias_as_id_rate=options["alias_as_id_rate"],
+                conflicting_alias_rate=options["conflicting_alias_rate"],
+                first_book=options["first_book"]
+            )
+        self.stdout.write("Wrote {0} books to {1}.".format(options["books"], args[0]))
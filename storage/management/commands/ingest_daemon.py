@@ -0,0 +1,96 @@
+# encoding: utf-8
+
+import signal
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.daemon import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, IngestionDaemon
+from storage.sqlite import BulkLoadProfile
+import storage.tools
+
+
+class Command(BaseCommand):
+    args = "<drop directory>"
+    help = "Import feed files as they are dropped into a directory, until stopped with SIGINT or SIGTERM"
+    option_list = BaseCommand.option_list + (
+        make_option("--done-dir", dest="done_dir", default=None, help="Where to move imported files."),
+        make_option("--failed-dir", dest="failed_dir", default=None, help="Where to move files that failed."),
+        make_option(
+            "--workers",
+            type="int",
+            dest="workers",
+            default=1,
+            help="How many files to parse at once; files are still written one at a time, in arrival order."
+        ),
+        make_option(
+            "--batch-size",
+            type="int",
+            dest="batch_size",
+            default=storage.tools.DEFAULT_BATCH_SIZE,
+            help="How many books to write per batch."
+        ),
+        make_option(
+            "--settle",
+            type="float",
+            dest="settle",
+            default=DEFAULT_SETTLE_SECONDS,
+            help="Consider a file complete once it has not been written to for this many seconds, when scanning "
+                 "without inotify or for files already there at startup. It has to outlast the longest pause of an "
+                 "upload that is not written under a temporary name."
+        ),
+        make_option(
+            "--poll-interval",
+            type="float",
+            dest="poll_interval",
+            default=DEFAULT_POLL_INTERVAL,
+            help="How often to scan the drop directory, in seconds."
+        ),
+        make_option(
+            "--no-inotify",
+            action="store_false",
+            dest="use_inotify",
+            default=True,
+            help="Scan the drop directory even if pyinotify is installed."
+        ),
+        make_option(
+            "--once",
+            action="store_true",
+            dest="once",
+            default=False,
+            help="Import the complete files in the drop directory, then exit."
+        ),
+        make_option(
+            "--no-bulk-load",
+            action="store_false",
+            dest="bulk_load",
+            default=True,
+            help="Import with SQLite's default settings rather than the bulk load profile (see storage.sqlite)."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the drop directory to watch.")
+
+        daemon = IngestionDaemon(
+            args[0],
+            done_directory=options["done_dir"],
+            failed_directory=options["failed_dir"],
+            workers=max(options["workers"], 0),
+            batch_size=options["batch_size"],
+            settle=options["settle"],
+            poll_interval=options["poll_interval"],
+            use_inotify=options["use_inotify"],
+            stdout=self.stdout
+        )
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping once the queued files are imported.")
+            daemon.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        # Every worker thread's connection gets the profile as it opens
+        with BulkLoadProfile(enabled=options["bulk_load"]):
+            daemon.run(once=options["once"])
@@ -0,0 +1,127 @@
+# encoding: utf-8
+
+import random
+import threading
+import time
+import urllib2
+from collections import Counter
+from optparse import make_option
+from urllib import quote
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from storage.models import Alias, Book
+from storage.profiling import percentile
+
+
+def _fetch(url, etag=None):
+    """
+    :return:
+        The status code and ETag of a GET request.
+    """
+    request = urllib2.Request(url)
+    if etag:
+        request.add_header("If-None-Match", etag)
+    try:
+        response = urllib2.urlopen(request)
+        response.read()
+        return response.getcode(), response.info().getheader("ETag")
+    except urllib2.HTTPError as error:
+        return error.code, error.info().getheader("ETag")
+
+
+class Command(NoArgsCommand):
+    help = (
+        "Send lookups for books in the local database to a running server, such as `manage.py runserver`, and report "
+        "requests/sec and latency percentiles"
+    )
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            "--url",
+            dest="url",
+            default="http://127.0.0.1:8000/api/",
+            help="The root of the API."
+        ),
+        make_option("--requests", type="int", dest="requests", default=1000, help="How many requests to send."),
+        make_option(
+            "--concurrency",
+            type="int",
+            dest="concurrency",
+            default=8,
+            help="How many requests to have in flight at once."
+        ),
+        make_option(
+            "--conditional",
+            action="store_true",
+            dest="conditional",
+            default=False,
+            help="Send If-None-Match with the ETag of a first request, as a caching client would."
+        ),
+        make_option("--seed", type="int", dest="seed", default=0, help="The seed for picking identifiers."),
+    )
+
+    def _urls(self, root, count, rng):
+        """
+        A mix of lookups by book ID, by book ID and version and by alias, for books picked from the database.
+        """
+        books = list(Book.objects.order_by("?").values_list("book_id", "version")[:1000])
+        aliases = list(Alias.objects.order_by("?").values_list("scheme", "value")[:1000])
+        if not books:
+            raise CommandError("There are no books in the database to look up.")
+
+        urls = []
+        for _ in xrange(count):
+            kind = rng.randint(0, 2)
+            if kind == 2 and aliases:
+                scheme, value = rng.choice(aliases)
+                urls.append("{0}aliases/{1}/{2}/".format(root, quote(scheme, ""), quote(value, "")))
+            elif kind == 1:
+                book_id, version = rng.choice(books)
+                urls.append("{0}books/{1}/{2}/".format(root, quote(book_id, ""), quote(version, "")))
+            else:
+                urls.append("{0}books/{1}/".format(root, quote(rng.choice(books)[0], "")))
+        return urls
+
+    def handle_noargs(self, **options):
+        root = options["url"].rstrip("/") + "/"
+        urls = self._urls(root, options["requests"], random.Random(options["seed"]))
+
+        etags = {}
+        if options["conditional"]:
+            for url in set(urls):
+                etags[url] = _fetch(url)[1]
+
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        pending = iter(urls)
+
+        def worker():
+            while True:
+                with lock:
+                    url = next(pending, None)
+                if url is None:
+                    return
+                started = time.time()
+                status, _ = _fetch(url, etags.get(url))
+                with lock:
+                    latencies.append((time.time() - started) * 1000)
+                    statuses[status] += 1
+
+        started = time.time()
+        threads = [threading.Thread(target=worker) for _ in xrange(max(options["concurrency"], 1))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - started
+
+        self.stdout.write("{0} requests in {1:.2f}s, {2:.1f} requests/sec".format(
+            len(latencies), seconds, len(latencies) / seconds if seconds else 0
+        ))
+        self.stdout.write("Latency (ms): p50 {0:.2f}, p95 {1:.2f}, p99 {2:.2f}, max {3:.2f}".format(
+            percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99), max(latencies)
+        ))
+        self.stdout.write("Responses: {0}".format(
+            ", ".join("{0} x {1}".format(count, status) for status, count in sorted(statuses.items()))
+        ))
@@ -0,0 +1,12 @@
+# encoding: utf-8
+
+from django.core.management.base import NoArgsCommand
+
+import storage.schema
+
+
+class Command(NoArgsCommand):
+    help = "Add the columns, indexes and backfilled values that newer storage models need to an existing database"
+
+    def handle_noargs(self, **options):
+        storage.schema.upgrade(stdout=self.stdout)
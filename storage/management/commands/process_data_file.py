@@ -2,19 +2,150 @@
 # Created by David Rideout <drideout@safaribooksonline.com> on 2/7/14 4:56 PM
 # Copyright (c) 2013 Safari Books Online, LLC. All rights reserved.
 
-from django.core.management.base import BaseCommand
+import json
+from optparse import make_option
 
-from lxml import etree
-import storage.tools
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.planner import plan_import
+from storage.profiling import ImportProfiler
+from storage.sqlite import BulkLoadProfile
+import storage.importer
 
 
 class Command(BaseCommand):
     args = "<filename filename2 filename3 ...>"
-    help = "Process an xml file"
+    help = "Process xml files holding one or more <book> elements, optionally compressed or in zip or tar archives"
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--batch-size",
+            type="int",
+            dest="batch_size",
+            default=None,
+            help="Resolve and write books in batches of this size instead of one at a time."
+        ),
+        make_option(
+            "--workers",
+            type="int",
+            dest="workers",
+            default=None,
+            help="Parse and resolve files in this many processes, writing from a single one."
+        ),
+        make_option(
+            "--commit-every",
+            type="int",
+            dest="commit_every",
+            default=storage.importer.DEFAULT_COMMIT_EVERY,
+            help="Commit this many files per transaction; a file that fails is rolled back on its own."
+        ),
+        make_option(
+            "--force",
+            action="store_true",
+            dest="force",
+            default=False,
+            help="Import every file, even those unchanged since they were last imported."
+        ),
+        make_option(
+            "--trust-mtime",
+            action="store_true",
+            dest="trust_mtime",
+            default=False,
+            help="Skip files whose size and modified time match their last import without reading them."
+        ),
+        make_option(
+            "--profile",
+            action="store_true",
+            dest="profile",
+            default=False,
+            help="Time each phase of the import and count its SQL queries, and print a summary at the end."
+        ),
+        make_option(
+            "--profile-json",
+            dest="profile_json",
+            default=None,
+            help="With --profile, also write the summary as JSON to this file."
+        ),
+        make_option(
+            "--dry-run",
+            action="store_true",
+            dest="dry_run",
+            default=False,
+            help="Work out what the import would change and print a summary, without writing anything."
+        ),
+        make_option(
+            "--plan-json",
+            dest="plan_json",
+            default=None,
+            help="With --dry-run, also write every planned change as JSON to this file."
+        ),
+        make_option(
+            "--no-bulk-load",
+            action="store_false",
+            dest="bulk_load",
+            default=True,
+            help="Import with SQLite's default settings rather than the bulk load profile (see storage.sqlite)."
+        ),
+        make_option(
+            "--warm-cache",
+            action="store_true",
+            dest="warm_cache",
+            default=False,
+            help="Cache what the API serves for the books written as each transaction commits (see storage.book_cache)."
+        ),
+        make_option(
+            "--checkpoint-every",
+            type="int",
+            dest="checkpoint_every",
+            default=None,
+            help="Commit each file this many books at a time, so that an import that dies partway can be resumed."
+        ),
+        make_option(
+            "--resume",
+            action="store_true",
+            dest="resume",
+            default=False,
+            help="Resume files whose last import did not finish from their last checkpoint, instead of from the start."
+        ),
+    )
 
     def handle(self, *args, **options):
-        for filename in args:
-            with open(filename, "rb") as file_handle:
-                print "Importing {} into database.".format(filename)
-                book_node = etree.parse(file_handle).getroot()
-                storage.tools.process_book_element(book_node, filename)
\ No newline at end of file
+        if options["dry_run"]:
+            planner = plan_import(args, batch_size=options["batch_size"])
+            self.stdout.write(planner.format_summary())
+            if options["plan_json"]:
+                with open(options["plan_json"], "wb") as file_handle:
+                    json.dump(planner.report(), file_handle, indent=2)
+            return
+
+        if options["profile"] and options["workers"]:
+            raise CommandError("--profile only sees this process, so it cannot be combined with --workers.")
+        if (options["checkpoint_every"] or options["resume"]) and options["workers"]:
+            raise CommandError("--checkpoint-every and --resume cannot be combined with --workers.")
+
+        def import_files():
+            with BulkLoadProfile(enabled=options["bulk_load"]):
+                return storage.importer.import_files(
+                    args,
+                    batch_size=options["batch_size"],
+                    workers=options["workers"],
+                    commit_every=options["commit_every"],
+                    force=options["force"],
+                    trust_mtime=options["trust_mtime"],
+                    warm_cache=options["warm_cache"],
+                    checkpoint_every=options["checkpoint_every"],
+                    resume=options["resume"],
+                    stdout=self.stdout
+                )
+
+        if options["profile"]:
+            with ImportProfiler() as profiler:
+                failures = import_files()
+            self.stdout.write("\n" + profiler.format_report())
+            if options["profile_json"]:
+                with open(options["profile_json"], "wb") as file_handle:
+                    json.dump(profiler.report(), file_handle, indent=2)
+        else:
+            failures = import_files()
+
+        if failures:
+            raise CommandError("{0} of {1} files failed to import.".format(len(failures), len(args)))
@@ -0,0 +1,16 @@
+# encoding: utf-8
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import transaction
+
+from storage.search import SEARCH_TABLE, rebuild_search_index
+
+
+class Command(NoArgsCommand):
+    help = "Index the title and description of every book for full-text search from scratch"
+
+    def handle_noargs(self, **options):
+        with transaction.atomic():
+            if not rebuild_search_index():
+                raise CommandError("This database cannot hold the full-text index; it needs SQLite with FTS5.")
+        self.stdout.write("Rebuilt {0}".format(SEARCH_TABLE))
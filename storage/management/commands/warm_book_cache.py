@@ -0,0 +1,17 @@
+# encoding: utf-8
+
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.book_cache import book_cache
+
+
+class Command(BaseCommand):
+    args = "<book_id book_id2 ...>"
+    help = "Cache what the API serves for every version of the given books, or of every book when none are given"
+
+    def handle(self, *args, **options):
+        if not book_cache.enabled:
+            raise CommandError("The book cache is turned off; set STORAGE_BOOK_CACHE to one of the CACHES.")
+
+        count = book_cache.warm(args or None)
+        self.stdout.write("Cached {0} books in the {1} cache".format(count, book_cache.cache_name))
@@ -0,0 +1,157 @@
+# encoding: utf-8
+
+import hashlib
+import os
+from collections import namedtuple
+
+from django.utils import timezone
+
+from storage.batch import in_chunks
+from storage.models import ImportManifest
+
+
+FileState = namedtuple("FileState", ["path", "size", "mtime", "digest"])
+
+ResumePoint = namedtuple("ResumePoint", ["checkpoint", "checkpoint_every", "batch_size"])
+
+
+def file_digest(filename):
+    """
+    :return:
+        The hex SHA-256 digest of a file's contents, read in chunks so large feeds are never held in memory.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file_handle:
+        for chunk in iter(lambda: file_handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(filename):
+    """
+    :return:
+        The :class:`FileState` of a file as it is on disk right now, or None if it cannot be read.
+    """
+    try:
+        stat = os.stat(filename)
+        return FileState(os.path.abspath(filename), stat.st_size, stat.st_mtime, file_digest(filename))
+    except (IOError, OSError):
+        return None
+
+
+def changed_files(filenames, trust_mtime=False):
+    """
+    Work out which files need importing according to the :class:`ImportManifest`: files we have not imported before,
+    files whose last import failed, and files whose contents changed since they were imported.
+
+    The digest decides whether a file changed, so every file is read. Files that only had their modification time
+    change are skipped, and their manifest is updated to match.
+
+    :param filenames:
+        The paths of the files, in import order.
+    :param trust_mtime:
+        Skip files whose size and modification time still match the manifest without reading them. A file rewritten
+        with the same size by a copy that keeps modification times, such as `rsync -t`, `cp -p` or a tar extraction,
+        is then taken to be unchanged.
+
+    :return:
+        A list of (filename, :class:`FileState`) pairs for the files to import, in import order. The state is None for
+        files that cannot be read, so that they are reported when their import fails.
+    """
+    paths = [(filename, os.path.abspath(filename)) for filename in filenames]
+
+    manifests = {}
+    for chunk in in_chunks(set(path for _, path in paths)):
+        for manifest in ImportManifest.objects.filter(path__in=chunk, status=ImportManifest.STATUS_IMPORTED):
+            manifests[manifest.path] = manifest
+
+    changed = []
+    for filename, path in paths:
+        manifest = manifests.get(path)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            changed.append((filename, None))
+            continue
+
+        unmoved = manifest is not None and manifest.size == stat.st_size and manifest.mtime == stat.st_mtime
+        if unmoved and trust_mtime:
+            continue
+
+        state = file_state(filename)
+        if manifest is not None and state is not None and manifest.digest == state.digest:
+            if not unmoved:
+                ImportManifest.objects.filter(pk=manifest.pk).update(
+                    size=state.size,
+                    mtime=state.mtime,
+                    last_modified_time=timezone.now()
+                )
+            continue
+
+        changed.append((filename, state))
+
+    return changed
+
+
+def record_import(state, error=None, checkpoint=None, checkpoint_every=None, batch_size=None):
+    """
+    Record the outcome of importing a file in the :class:`ImportManifest`.
+
+    :param state:
+        The :class:`FileState` of the file when it was imported. Nothing is recorded if this is None.
+    :param error:
+        The error the import failed with, if it failed. The checkpoint of an earlier, unfinished import of the same
+        contents is kept, since the books it covers are still committed.
+    :param checkpoint:
+        If the import is not finished, how many books of the file it has committed so far.
+    :param checkpoint_every:
+        With `checkpoint`, how many books each checkpoint commits.
+    :param batch_size:
+        With `checkpoint`, how many books the import writes per batch, or None if it writes them one at a time.
+    """
+    if state is None:
+        return
+
+    if error is not None:
+        status = ImportManifest.STATUS_FAILED
+    elif checkpoint is not None:
+        status = ImportManifest.STATUS_PARTIAL
+    else:
+        status = ImportManifest.STATUS_IMPORTED
+
+    fields = dict(
+        size=state.size,
+        mtime=state.mtime,
+        digest=state.digest,
+        status=status,
+        message=unicode(error) if error is not None else u""
+    )
+    if error is None:
+        fields.update(checkpoint=checkpoint or 0, checkpoint_every=0, batch_size=0)
+        if checkpoint:
+            fields.update(checkpoint_every=checkpoint_every or 0, batch_size=batch_size or 0)
+    else:
+        # A checkpoint only holds for the contents it was taken of
+        ImportManifest.objects.filter(path=state.path).exclude(digest=state.digest).update(
+            checkpoint=0,
+            checkpoint_every=0,
+            batch_size=0
+        )
+    if not ImportManifest.objects.filter(path=state.path).update(last_modified_time=timezone.now(), **fields):
+        ImportManifest.objects.create(path=state.path, **fields)
+
+
+def resume_point(state):
+    """
+    :return:
+        The :class:`ResumePoint` of an earlier, unfinished import of the same contents of a file: how many books it
+        committed, and so how many to skip to resume it, and the checkpoint and batch sizes it was importing with, 0
+        where they were not recorded. None if there is nothing to resume.
+    """
+    if state is None:
+        return None
+
+    point = ImportManifest.objects.filter(path=state.path, digest=state.digest, checkpoint__gt=0).exclude(
+        status=ImportManifest.STATUS_IMPORTED
+    ).values_list("checkpoint", "checkpoint_every", "batch_size").first()
+    return ResumePoint(*point) if point is not None else None
@@ -1,6 +1,51 @@
 # encoding: utf-8
 
+import re
+
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from storage.isbn import ISBN_SCHEMES, canonical_value
+
+_VERSION_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# Version numbers are clamped to this so that every sort key has the same width
+_MAX_VERSION_NUMBER = 10 ** 17 - 1
+
+
+def version_number(version):
+    """
+    Read the number out of a book version: the version itself if it is a number such as "2.0", otherwise the first
+    number that appears in it, so that "20th anniversary edition" counts as 20. Versions without any number count as 0.
+    """
+    try:
+        number = float(version)
+    except (TypeError, ValueError):
+        match = _VERSION_NUMBER.search(version or "")
+        number = float(match.group()) if match else 0.0
+
+    # float() also accepts "nan" and "inf", which are not versions
+    if number != number or number < 0:
+        return 0.0
+    return min(number, _MAX_VERSION_NUMBER)
+
+
+def version_sort_key(version):
+    """
+    Build a string that sorts book versions in numeric order, so that the latest version of a book can be found with an
+    indexed ORDER BY rather than by loading and sorting every version in Python.
+
+    The key is the version number padded to a fixed width. Versions that are not plain numbers sort right after the
+    number they start with, ordered by their text, so "20th anniversary edition" sorts between "20.0" and "21.0".
+    """
+    key = "{0:024.6f}".format(version_number(version))
+    try:
+        float(version)
+        return key
+    except (TypeError, ValueError):
+        return u"{0} {1}".format(key, (version or u"").lower())
 
 
 class BaseModel(models.Model):
@@ -38,13 +83,23 @@ class Book(BaseModel):
         blank=False
     )
     version = models.CharField(max_length=10, db_index=True, help_text="The version of the book.")
+    version_key = models.CharField(
+        max_length=64,
+        editable=False,
+        help_text="The version in a form that sorts numerically, see :func:`version_sort_key`."
+    )
 
     def __unicode__(self):
         return u"{0} - version {1}".format(self.title, self.version)
 
+    def save(self, *args, **kwargs):
+        self.version_key = version_sort_key(self.version)
+        super(Book, self).save(*args, **kwargs)
+
     class Meta:
         ordering = ["title", "version"]
-        unique_together = (("id", "version"), )
+        unique_together = (("book_id", "version"), )
+        index_together = (("book_id", "version_key"), )
 
 
 class Alias(BaseModel):
@@ -54,17 +109,64 @@ class Alias(BaseModel):
     For example, a book can be referred to with an ISBN-10 (older, deprecated scheme), ISBN-13 (newer scheme),
     or any number of other aliases.
 
-    We consider the tuple (scheme, value) as a unique identifier for an Alias.
+    We consider the tuple (scheme, value) as a unique identifier for an Alias. ISBNs are the exception: feeds write the
+    same ISBN as an ISBN-10 or an ISBN-13, with or without hyphens, so ISBNs are matched on their canonical value
+    instead, whichever ISBN scheme they were given in (see :func:`storage.isbn.alias_identity`).
     """
     book = models.ForeignKey(Book, related_name="aliases")
     scheme = models.CharField(max_length=40, help_text="The scheme of identifier")
     value = models.CharField(max_length=255, db_index=True, help_text="The value of this identifier")
+    canonical_value = models.CharField(
+        max_length=255,
+        db_index=True,
+        editable=False,
+        help_text="The value in the form it is matched on, see :func:`storage.isbn.canonical_value`."
+    )
 
     def __unicode__(self):
         return u"Book: {0}, ID Scheme: {1}, Value: {2}".format(unicode(self.book), self.scheme, self.value)
 
+    def save(self, *args, **kwargs):
+        self.canonical_value = canonical_value(self.scheme, self.value)
+        super(Alias, self).save(*args, **kwargs)
+
     class Meta:
         unique_together = (("book", "value"), )
+        index_together = (("scheme", "value"), )
+
+
+def alias_filter(scheme, value):
+    """
+    Build the filter for the aliases that are the same identifier as the given scheme and value. An ISBN matches the
+    aliases of either ISBN scheme with the same canonical value, a single probe of the canonical_value index whichever
+    form it is written in; any other alias matches on its scheme and value.
+
+    :return:
+        A dictionary of keyword arguments for `Alias.objects.filter()`.
+    """
+    if scheme in ISBN_SCHEMES:
+        return {"scheme__in": ISBN_SCHEMES, "canonical_value": canonical_value(scheme, value)}
+    return {"scheme": scheme, "value": value}
+
+
+class AliasDeletion(BaseModel):
+    """
+    A record that an :class:`Alias` was deleted, so that consumers of the change feed (see :mod:`storage.changes`) can
+    drop it too. Aliases are only ever deleted by hand when cleaning up after a bad update, or along with their book,
+    and once the row is gone nothing else would tell a consumer that it existed.
+
+    The book is kept by its identifier and version rather than by a foreign key, as it may well be deleted with its
+    aliases.
+    """
+    book_id = models.CharField(max_length=30, help_text="The identifier of the book the alias belonged to.")
+    version = models.CharField(max_length=10, help_text="The version of the book the alias belonged to.")
+    scheme = models.CharField(max_length=40, help_text="The scheme of identifier")
+    value = models.CharField(max_length=255, help_text="The value of this identifier")
+
+    def __unicode__(self):
+        return u"Book: {0} - version {1}, ID Scheme: {2}, Value: {3}".format(
+            self.book_id, self.version, self.scheme, self.value
+        )
 
 
 class UpdateIssues(BaseModel):
@@ -72,9 +174,15 @@ class UpdateIssues(BaseModel):
     The base class for incoming updates that will track problematic data and allow us to go back and alter the
     strategies used to deal with the problems in the given data.
 
-    This is to be subclassed to specify what type of issue is being reported.
+    This is to be subclassed to specify what type of issue is being reported. Each subclass lists the fields that make
+    an issue distinct in `unique_together`, so that an issue is recorded once per source file however many importers
+    run (see :class:`storage.issues.IssueRecorder`).
     """
-    source_file = models.CharField(max_length=255, help_text="The filename of the XML that contains the issue.")
+    source_file = models.CharField(
+        max_length=255,
+        db_index=True,
+        help_text="The filename of the XML that contains the issue."
+    )
 
     class Meta:
         abstract = True
@@ -98,6 +206,9 @@ class AliasUsedAsBookIdIssue(UpdateIssues):
     alias_used = models.ForeignKey(Alias)
     book_resolved = models.ForeignKey(Book)
 
+    class Meta:
+        unique_together = (("alias_used", "book_resolved", "source_file"), )
+
 
 class AliasUsedToResolveBookIdIssue(UpdateIssues):
     """
@@ -113,6 +224,9 @@ class AliasUsedToResolveBookIdIssue(UpdateIssues):
     alias_used = models.ForeignKey(Alias)
     book_resolved = models.ForeignKey(Book)
 
+    class Meta:
+        unique_together = (("alias_used", "book_resolved", "source_file"), )
+
 
 class AliasPointsToConflictingBookIssue(UpdateIssues):
     """
@@ -129,6 +243,9 @@ class AliasPointsToConflictingBookIssue(UpdateIssues):
     scheme = models.CharField(max_length=40, help_text="The scheme of identifier")
     value = models.CharField(max_length=255, db_index=True, help_text="The value of this identifier")
 
+    class Meta:
+        unique_together = (("book", "scheme", "source_file", "value"), )
+
 
 class VersionUnspecifiedIssue(UpdateIssues):
     """
@@ -146,4 +263,78 @@ class VersionUnspecifiedIssue(UpdateIssues):
     So again, we choose to mark what we've done so that should our understanding of the data change, we can make
     corrections as the business needs.
     """
-    book_id = models.CharField(max_length=30, help_text="The book identifier.")
\ No newline at end of file
+    book_id = models.CharField(max_length=30, help_text="The book identifier.")
+
+    class Meta:
+        unique_together = (("book_id", "source_file"), )
+
+
+class ImportManifest(BaseModel):
+    """
+    A record of each feed file we have imported, so that re-running the import over the same files can skip the ones
+    that have not changed since.
+
+    We re-run the import over every file on each deploy, and almost none of them change between runs. We remember the
+    size and modification time of each file as well as a digest of its contents. The digest decides whether a file
+    changed, so a file that was merely touched or copied around is still skipped, and one copied over with its old
+    modification time is still imported. Only when asked do we skip files whose size and modification time match
+    without reading them (see :func:`storage.manifest.changed_files`).
+
+    We also keep the outcome of the last import, so that files which failed are retried on the next run.
+
+    Large feeds can be imported in checkpoints, each committing a stretch of books along with how far into the file it
+    got (see :func:`storage.importer.import_file_in_checkpoints`). Should the import die, the file is left partly
+    imported, and resuming skips the books already committed rather than importing them a second time. The checkpoint
+    and batch sizes are kept with the checkpoint, as the rest of the file has to be imported with the same ones to end
+    up as it would have without the interruption.
+    """
+    STATUS_IMPORTED = "imported"
+    STATUS_PARTIAL = "partial"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_IMPORTED, "Imported"),
+        (STATUS_PARTIAL, "Partly imported"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    path = models.CharField(max_length=255, unique=True, help_text="The absolute path of the imported file.")
+    size = models.BigIntegerField(help_text="The size of the file in bytes when it was last imported.")
+    mtime = models.FloatField(help_text="The modification time of the file when it was last imported.")
+    digest = models.CharField(max_length=64, help_text="The SHA-256 digest of the file when it was last imported.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, help_text="The outcome of the last import.")
+    message = models.TextField(blank=True, default="", help_text="Why the last import failed, if it did.")
+    checkpoint = models.BigIntegerField(
+        default=0,
+        help_text="How many books of the file, in file order, an unfinished import committed."
+    )
+    checkpoint_every = models.PositiveIntegerField(
+        default=0,
+        help_text="How many books each checkpoint of the unfinished import committed."
+    )
+    batch_size = models.PositiveIntegerField(
+        default=0,
+        help_text="How many books the unfinished import wrote per batch, or 0 if it wrote them one at a time."
+    )
+
+    def __unicode__(self):
+        return u"{0} ({1})".format(self.path, self.status)
+
+
+@receiver(post_delete, sender=Alias)
+def record_alias_deletion(sender, instance, **kwargs):
+    """
+    Leave an :class:`AliasDeletion` behind for every deleted alias, including those deleted along with their book.
+    Aliases are deleted before the book they point to, so the book can still be read here.
+    """
+    book = Book.objects.filter(pk=instance.book_id).values_list("book_id", "version").first()
+    if book is not None:
+        AliasDeletion.objects.create(book_id=book[0], version=book[1], scheme=instance.scheme, value=instance.value)
+
+
+@receiver(post_delete, sender=Alias)
+def touch_unaliased_book(sender, instance, **kwargs):
+    """
+    Move the modified time of the book a deleted alias belonged to on, as the book is served with its aliases, and its
+    modified time is what its ETag and Last-Modified time are made of (see :func:`storage.book_cache.book_validators`).
+    """
+    Book.objects.filter(pk=instance.book_id).update(last_modified_time=timezone.now())
@@ -0,0 +1,177 @@
+# encoding: utf-8
+
+from collections import namedtuple
+
+from django.db.models import Model
+
+from storage.batch import ISSUE_MODELS, BookSnapshot, process_book_record
+from storage.importer import read_book_records
+from storage.models import Alias, Book
+import storage.tools
+
+
+PlannedChange = namedtuple("PlannedChange", ["instance", "source_file"])
+PlannedIssue = namedtuple("PlannedIssue", ["model", "fields"])
+
+
+def _describe(value):
+    """
+    Describe a field value of a planned change for JSON; books and aliases may not exist yet, so they are described by
+    what identifies them rather than by primary key.
+    """
+    if isinstance(value, Book):
+        return {"book_id": value.book_id, "version": value.version}
+    if isinstance(value, Alias):
+        return {"book_id": value.book.book_id, "scheme": value.scheme, "value": value.value}
+    if isinstance(value, Model):
+        return unicode(value)
+    return value
+
+
+class ImportPlanner(object):
+    """
+    Work out what importing some files would do, without writing anything.
+
+    This runs the resolution logic of the batch engine (see :mod:`storage.batch`), which makes the same decisions as
+    :func:`storage.tools.process_book_element`. It runs against a single :class:`storage.batch.BookSnapshot` that is
+    loaded a batch at a time but never flushed, so the books, aliases and issues each record would create stay in
+    memory and later records in the feed see them, as they would see them in the database during a real import. The
+    database is only read, with a few IN queries per batch.
+
+    As in a real import, a file that cannot be read changes nothing. Unlike a real import, files are planned whether or
+    not they changed since they were last imported, as checking the import manifest may update it.
+    """
+
+    def __init__(self, batch_size=storage.tools.DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.snapshot = BookSnapshot()
+
+        self.files = []
+        self.failures = []
+        self.books_read = 0
+        self.books_created = []
+        self.new_book_ids = 0
+        self.books_updated = []
+        self.versions_inferred = []
+        self.aliases_added = []
+        self.aliases_inherited = []
+        self.issues = []
+
+    def plan_file(self, filename):
+        try:
+            records = read_book_records(filename)
+        except Exception as error:
+            self.failures.append((filename, error))
+            return
+
+        self.files.append(filename)
+        for start in xrange(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            self.snapshot.load(batch)
+            for record in batch:
+                self._plan_record(record)
+
+    def _plan_record(self, record):
+        snapshot = self.snapshot
+        new_books, changed_books = len(snapshot.new_books), len(snapshot.changed_books)
+        new_aliases, new_issues = len(snapshot.new_aliases), len(snapshot.new_issues)
+
+        book = process_book_record(snapshot, record)
+        self.books_read += 1
+
+        for created in snapshot.new_books[new_books:]:
+            self.books_created.append(PlannedChange(created, record.source_file))
+            if len(snapshot.versions(created.book_id)) == 1:
+                self.new_book_ids += 1
+        for updated in snapshot.changed_books[changed_books:]:
+            self.books_updated.append(PlannedChange(updated, record.source_file))
+
+        try:
+            float(record.version)
+        except (TypeError, ValueError):
+            self.versions_inferred.append(PlannedChange(book, record.source_file))
+
+        record_aliases = set(record.aliases)
+        for alias in snapshot.new_aliases[new_aliases:]:
+            if (alias.scheme, alias.value) in record_aliases:
+                self.aliases_added.append(PlannedChange(alias, record.source_file))
+            else:
+                self.aliases_inherited.append(PlannedChange(alias, record.source_file))
+
+        self.issues.extend(PlannedIssue(model, fields) for model, fields in snapshot.new_issues[new_issues:])
+
+    def summary(self):
+        """
+        :return:
+            A list of (key, description, count) triples.
+        """
+        counts = [
+            ("files", "Files planned", len(self.files)),
+            ("failures", "Files that cannot be read", len(self.failures)),
+            ("books_read", "Books read", self.books_read),
+            ("books_created", "Books created", len(self.books_created)),
+            ("new_book_ids", "  with a new book ID", self.new_book_ids),
+            ("new_versions", "  as a new version of a known book", len(self.books_created) - self.new_book_ids),
+            ("books_updated", "Books updated in place", len(self.books_updated)),
+            ("books_unchanged", "Books already up to date", self.snapshot.counts.unchanged),
+            ("versions_inferred", "Versions inferred", len(self.versions_inferred)),
+            ("aliases_added", "Aliases added", len(self.aliases_added)),
+            ("aliases_inherited", "Aliases inherited from an earlier version", len(self.aliases_inherited)),
+            ("issues", "Issues raised", len(self.issues)),
+        ]
+        for model in ISSUE_MODELS:
+            counts.append((
+                model.__name__,
+                "  " + model.__name__,
+                sum(1 for issue in self.issues if issue.model is model)
+            ))
+        return counts
+
+    def format_summary(self):
+        lines = [u"Dry run, nothing was written."]
+        lines.extend(u"{0:<45} {1:>10}".format(description, count) for _, description, count in self.summary())
+        for filename, error in self.failures:
+            lines.append(u"Cannot read {0}: {1}".format(filename, error))
+        return u"\n".join(lines) + u"\n"
+
+    def report(self):
+        """
+        :return:
+            The summary and every planned change, as a dictionary that can be written out as JSON.
+        """
+        def changes(planned):
+            return [
+                dict(_describe(change.instance), source_file=change.source_file)
+                for change in planned
+            ]
+
+        return {
+            "summary": dict((key, count) for key, _, count in self.summary()),
+            "files": self.files,
+            "failures": [{"filename": filename, "error": unicode(error)} for filename, error in self.failures],
+            "books_created": changes(self.books_created),
+            "books_updated": changes(self.books_updated),
+            "versions_inferred": changes(self.versions_inferred),
+            "aliases_added": changes(self.aliases_added),
+            "aliases_inherited": changes(self.aliases_inherited),
+            "issues": [
+                dict(
+                    ((name, _describe(value)) for name, value in issue.fields.items()),
+                    issue=issue.model.__name__
+                )
+                for issue in self.issues
+            ],
+        }
+
+
+def plan_import(filenames, batch_size=None):
+    """
+    Plan importing files in order with an :class:`ImportPlanner`.
+
+    :return:
+        The :class:`ImportPlanner`, holding the plan.
+    """
+    planner = ImportPlanner(batch_size or storage.tools.DEFAULT_BATCH_SIZE)
+    for filename in filenames:
+        planner.plan_file(filename)
+    return planner
@@ -0,0 +1,316 @@
+# encoding: utf-8
+
+import functools
+import math
+import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.util import CursorWrapper
+
+
+class _CountingCursorWrapper(CursorWrapper):
+    def __init__(self, cursor, db, counter):
+        super(_CountingCursorWrapper, self).__init__(cursor, db)
+        self.counter = counter
+
+    def execute(self, sql, params=None):
+        self.counter.count += 1
+        return super(_CountingCursorWrapper, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter.count += 1
+        return super(_CountingCursorWrapper, self).executemany(sql, param_list)
+
+
+class QueryCounter(object):
+    """
+    Count the SQL statements run on a connection within a `with` block.
+
+    Django only records queries in `connection.queries` when DEBUG is on, and then keeps every one of them, which is no
+    good for counting the queries of an import of a hundred thousand books. So instead of reading that list, this swaps
+    the connection's debug cursor for one that only counts. Only cursors created inside the block are counted.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.count = 0
+
+    def __enter__(self):
+        self._use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        self.connection.make_debug_cursor = lambda cursor: _CountingCursorWrapper(cursor, self.connection, self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del self.connection.make_debug_cursor
+        self.connection.use_debug_cursor = self._use_debug_cursor
+
+
+def percentile(values, percent):
+    """
+    :return:
+        The nearest-rank percentile of a list of numbers, or None if it is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+class ImportProfiler(object):
+    """
+    Time an import phase by phase and count the SQL queries each phase runs, within a `with` block:
+
+    * parse: reading <book> elements out of the XML;
+    * resolve: working out which book a <book> element is (`_resolve_book_id`);
+    * version: working out its version (`_infer_book_version`);
+    * aliases: attaching its aliases (`_process_book_aliases`);
+    * issues: recording issues for manual review, wherever they come from;
+    * write: everything else done for a book, mostly saving it, and with batches, writing the batch back;
+    * load: with batches, loading the snapshot a batch is resolved against.
+
+    Phases nest, and each is charged only for the time and queries not spent in a phase nested inside it, so the
+    phases add up to the whole import. Time outside every phase, such as checking the import manifest, is "other".
+    The profiler also counts how many alias lookups :data:`storage.resolution.alias_cache` answered, to tell whether
+    `STORAGE_ALIAS_CACHE_SIZE` is large enough.
+
+    The functions making up each phase are swapped for timing wrappers on entering the block and put back on leaving
+    it, so an import run without the profiler runs exactly the same code as before. The profiler only sees this
+    process, so it does not see the work done by parallel workers.
+    """
+
+    PHASES = ("parse", "resolve", "version", "aliases", "issues", "write", "load", "other")
+
+    def __init__(self, slowest_files=10):
+        self.slowest_files = slowest_files
+        self.counter = QueryCounter()
+        self.phase_seconds = dict((phase, 0.0) for phase in self.PHASES)
+        self.phase_queries = dict((phase, 0) for phase in self.PHASES)
+        self.phase_calls = dict((phase, 0) for phase in self.PHASES)
+        self.book_seconds = []
+        self.book_queries = []
+        self.files = []
+        self.alias_cache_hits = 0
+        self.alias_cache_misses = 0
+        self._stack = []
+        self._patches = []
+
+    def __enter__(self):
+        import storage.batch
+        import storage.importer
+        import storage.issues
+        import storage.resolution
+        import storage.tools
+
+        self._patch(storage.importer, "import_file", self._file_wrapper)
+        self._patch(storage.importer, "import_file_in_checkpoints", self._file_wrapper)
+        self._patch(storage.tools, "iter_book_elements", self._iterator_wrapper, "parse")
+        self._patch(storage.tools, "read_book_element", self._phase_wrapper, "parse")
+        self._patch(storage.tools, "process_book_element", self._book_wrapper)
+        self._patch(storage.batch, "process_book_record", self._book_wrapper)
+        for module in (storage.tools, storage.batch):
+            self._patch(module, "_resolve_book_id", self._phase_wrapper, "resolve")
+            self._patch(module, "_infer_book_version", self._phase_wrapper, "version")
+            self._patch(module, "_process_book_aliases", self._phase_wrapper, "aliases")
+        self._patch(storage.tools, "_record_issue", self._phase_wrapper, "issues")
+        self._patch(storage.issues.IssueRecorder, "flush", self._phase_wrapper, "issues")
+        self._patch(storage.batch.BookSnapshot, "record_issue", self._phase_wrapper, "issues")
+        self._patch(storage.batch.BookSnapshot, "load", self._phase_wrapper, "load")
+        self._patch(storage.batch.BookSnapshot, "flush", self._phase_wrapper, "write")
+        # The cache's own counters start over whenever it is cleared, as every import and rolled back file does
+        self._patch(storage.resolution.AliasResolutionCache, "get", self._alias_cache_wrapper)
+
+        self.counter.__enter__()
+        self._started = self._mark = time.time()
+        self._mark_queries = 0
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from storage.resolution import alias_cache
+
+        self._charge()
+        self.seconds = time.time() - self._started
+        self.alias_cache_size, self.alias_cache_max_size = len(alias_cache), alias_cache.max_size
+        self.counter.__exit__(exc_type, exc_value, traceback)
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches = []
+
+    def _patch(self, owner, name, wrapper, *args):
+        # Take the original from the class or module itself, so methods are put back as plain functions
+        original = vars(owner)[name]
+        self._patches.append((owner, name, original))
+        setattr(owner, name, functools.wraps(original)(wrapper(original, *args)))
+
+    def _charge(self):
+        """
+        Charge the time and queries since the last phase change to the phase running now.
+        """
+        now, queries = time.time(), self.counter.count
+        phase = self._stack[-1] if self._stack else "other"
+        self.phase_seconds[phase] += now - self._mark
+        self.phase_queries[phase] += queries - self._mark_queries
+        self._mark, self._mark_queries = now, queries
+
+    def _enter(self, phase):
+        self._charge()
+        self._stack.append(phase)
+        self.phase_calls[phase] += 1
+
+    def _leave(self):
+        self._charge()
+        self._stack.pop()
+
+    def _phase_wrapper(self, function, phase):
+        def wrapper(*args, **kwargs):
+            self._enter(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._leave()
+        return wrapper
+
+    def _iterator_wrapper(self, function, phase):
+        def wrapper(*args, **kwargs):
+            iterator = iter(function(*args, **kwargs))
+            while True:
+                self._enter(phase)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self._leave()
+                yield item
+        return wrapper
+
+    def _book_wrapper(self, function):
+        def wrapper(*args, **kwargs):
+            started, queries = time.time(), self.counter.count
+            self._enter("write")
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._leave()
+                self.book_seconds.append(time.time() - started)
+                self.book_queries.append(self.counter.count - queries)
+        return wrapper
+
+    def _alias_cache_wrapper(self, function):
+        def wrapper(*args, **kwargs):
+            entry = function(*args, **kwargs)
+            if entry is None:
+                self.alias_cache_misses += 1
+            else:
+                self.alias_cache_hits += 1
+            return entry
+        return wrapper
+
+    def _file_wrapper(self, function):
+        def wrapper(filename, *args, **kwargs):
+            started, queries, books = time.time(), self.counter.count, len(self.book_seconds)
+            try:
+                return function(filename, *args, **kwargs)
+            finally:
+                self.files.append({
+                    "filename": filename,
+                    "seconds": time.time() - started,
+                    "queries": self.counter.count - queries,
+                    "books": len(self.book_seconds) - books,
+                })
+        return wrapper
+
+    def report(self):
+        """
+        :return:
+            Everything the profiler measured, as a dictionary that can be written out as JSON. Latencies are in
+            milliseconds; with batches, a book's latency leaves out its share of loading and writing the batch.
+        """
+        books = len(self.book_seconds)
+        latencies = [seconds * 1000 for seconds in self.book_seconds]
+        alias_lookups = self.alias_cache_hits + self.alias_cache_misses
+        return {
+            "seconds": self.seconds,
+            "queries": self.counter.count,
+            "books": books,
+            "books_per_second": books / self.seconds if self.seconds else None,
+            "queries_per_book": float(self.counter.count) / books if books else None,
+            "phases": [
+                {
+                    "phase": phase,
+                    "calls": self.phase_calls[phase],
+                    "seconds": self.phase_seconds[phase],
+                    "queries": self.phase_queries[phase],
+                }
+                for phase in self.PHASES
+            ],
+            "book_latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies) if latencies else None,
+            },
+            "book_queries": {
+                "p50": percentile(self.book_queries, 50),
+                "p95": percentile(self.book_queries, 95),
+                "p99": percentile(self.book_queries, 99),
+                "max": max(self.book_queries) if self.book_queries else None,
+            },
+            "alias_cache": {
+                "hits": self.alias_cache_hits,
+                "misses": self.alias_cache_misses,
+                "hit_rate": float(self.alias_cache_hits) / alias_lookups if alias_lookups else None,
+                "size": self.alias_cache_size,
+                "max_size": self.alias_cache_max_size,
+            },
+            "slowest_files": sorted(self.files, key=lambda entry: -entry["seconds"])[:self.slowest_files],
+        }
+
+    def format_report(self):
+        """
+        :return:
+            :meth:`report` as a table for the console.
+        """
+        report = self.report()
+        lines = ["{0:<10} {1:>10} {2:>10} {3:>7} {4:>10}".format("phase", "calls", "seconds", "%", "queries")]
+        for phase in report["phases"]:
+            lines.append("{0:<10} {1:>10} {2:>10.3f} {3:>6.1f}% {4:>10}".format(
+                phase["phase"],
+                phase["calls"],
+                phase["seconds"],
+                100 * phase["seconds"] / report["seconds"] if report["seconds"] else 0,
+                phase["queries"]
+            ))
+        lines.append("{0:<10} {1:>10} {2:>10.3f} {3:>6.1f}% {4:>10}".format(
+            "total", "", report["seconds"], 100, report["queries"]
+        ))
+
+        if report["books"]:
+            lines.append("")
+            lines.append("{0} books, {1:.1f} books/sec, {2:.2f} queries/book".format(
+                report["books"], report["books_per_second"], report["queries_per_book"]
+            ))
+            lines.append("Per-book latency (ms): p50 {p50:.2f}, p95 {p95:.2f}, p99 {p99:.2f}, max {max:.2f}".format(
+                **report["book_latency_ms"]
+            ))
+            lines.append("Per-book queries: p50 {p50}, p95 {p95}, p99 {p99}, max {max}".format(
+                **report["book_queries"]
+            ))
+
+        alias_cache = report["alias_cache"]
+        if alias_cache["hit_rate"] is not None:
+            lines.append(
+                "Alias cache: {0:.1f}% hit rate, {hits} hits, {misses} misses, {size} of {max_size} entries".format(
+                    100 * alias_cache["hit_rate"], **alias_cache
+                )
+            )
+
+        if report["slowest_files"]:
+            lines.append("")
+            lines.append("Slowest files:")
+            lines.append("{0:>10} {1:>10} {2:>10}  {3}".format("seconds", "queries", "books", "file"))
+            for entry in report["slowest_files"]:
+                lines.append("{seconds:>10.3f} {queries:>10} {books:>10}  {filename}".format(**entry))
+
+        return "\n".join(lines) + "\n"
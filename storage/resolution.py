@@ -0,0 +1,182 @@
+# encoding: utf-8
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from storage.isbn import alias_identity
+from storage.models import Alias, Book, alias_filter
+
+# How many (scheme, value) resolutions :data:`alias_cache` holds before evicting the least recently used ones
+DEFAULT_ALIAS_CACHE_SIZE = 100000
+
+
+AliasResolution = namedtuple("AliasResolution", ["alias_pk", "book_pk", "book_id"])
+
+
+class AliasResolutionCache(object):
+    """
+    A bounded, least-recently-used map from an alias (scheme, value) to the book it resolves to. Aliases are keyed by
+    their identity (see :func:`storage.isbn.alias_identity`), so every form of an ISBN shares one entry.
+
+    Resolving a book ID looks up the same identifiers over and over: every update of a known book checks its ID against
+    the ISBN aliases and checks each of its aliases for conflicts. Each of those lookups used to cost a query for the
+    alias plus a second one to follow its foreign key to the book. In a steady stream of updates nearly every
+    identifier is already known, so we remember what each alias resolved to and answer from memory.
+
+    Only aliases that exist are cached, which keeps the cache correct as new aliases are written: an alias being created
+    can never make a cached answer wrong. Aliases that are changed or deleted, and books whose ID changes, are evicted
+    through model signals. As with `Alias.objects.filter(**alias_filter(scheme, value)).first()`, each entry is the
+    earliest alias created for its identity, so the cache is only written through when an alias is created for an
+    identity that did not exist yet.
+    """
+    def __init__(self, max_size=DEFAULT_ALIAS_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._keys_by_alias = {}
+        self._keys_by_book = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, scheme, value):
+        """
+        :return:
+            The cached :class:`AliasResolution` for the alias, or None when it is not cached.
+        """
+        key = alias_identity(scheme, value)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def add(self, scheme, value, alias_pk, book_pk, book_id):
+        """
+        Cache what an alias resolves to, evicting the least recently used entry if the cache is full.
+
+        :return:
+            The new :class:`AliasResolution`.
+        """
+        key = alias_identity(scheme, value)
+        entry = AliasResolution(alias_pk, book_pk, book_id)
+        with self._lock:
+            self._discard(key)
+            while len(self._entries) >= self.max_size:
+                self._discard(next(iter(self._entries)))
+
+            self._entries[key] = entry
+            self._keys_by_alias[alias_pk] = key
+            self._keys_by_book.setdefault(book_pk, set()).add(key)
+        return entry
+
+    def discard(self, scheme, value):
+        self._discard(alias_identity(scheme, value))
+
+    def _discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+
+            self._keys_by_alias.pop(entry.alias_pk, None)
+            book_keys = self._keys_by_book.get(entry.book_pk)
+            if book_keys is not None:
+                book_keys.discard(key)
+                if not book_keys:
+                    del self._keys_by_book[entry.book_pk]
+
+    def discard_alias(self, alias_pk):
+        with self._lock:
+            key = self._keys_by_alias.get(alias_pk)
+            if key is not None:
+                self._discard(key)
+
+    def discard_book(self, book_pk, unless_book_id=None):
+        """
+        Evict every alias resolving to a book, optionally keeping them if they still resolve to the given book ID.
+        """
+        with self._lock:
+            for key in list(self._keys_by_book.get(book_pk, ())):
+                if unless_book_id is None or self._entries[key].book_id != unless_book_id:
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_alias.clear()
+            self._keys_by_book.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return:
+            A dictionary of the cache's size and hit/miss counters, for reporting.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+            }
+
+
+alias_cache = AliasResolutionCache(getattr(settings, "STORAGE_ALIAS_CACHE_SIZE", DEFAULT_ALIAS_CACHE_SIZE))
+
+
+def lookup_alias(scheme, value):
+    """
+    Find what an alias resolves to, the equivalent of `Alias.objects.filter(**alias_filter(scheme, value)).first()`
+    followed by its book, answered from :data:`alias_cache` when possible and with a single query otherwise. An ISBN
+    finds the first alias holding the same ISBN in any form, of either ISBN scheme.
+
+    :param scheme:
+        The scheme of the alias (such as ISBN-10).
+    :param value:
+        The value of the alias (such as 1000000001).
+
+    :return:
+        The :class:`AliasResolution` for the alias, or None if no such alias exists.
+    """
+    entry = alias_cache.get(scheme, value)
+    if entry is not None:
+        return entry
+
+    alias = Alias.objects.filter(**alias_filter(scheme, value)).select_related("book").first()
+    if alias is None:
+        return None
+
+    return alias_cache.add(scheme, value, alias.pk, alias.book.pk, alias.book.book_id)
+
+
+@receiver(post_save, sender=Alias)
+@receiver(post_delete, sender=Alias)
+def _evict_alias(sender, instance, **kwargs):
+    alias_cache.discard_alias(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def _evict_renamed_book(sender, instance, created, **kwargs):
+    if not created:
+        alias_cache.discard_book(instance.pk, unless_book_id=instance.book_id)
+
+
+@receiver(post_delete, sender=Book)
+def _evict_book(sender, instance, **kwargs):
+    alias_cache.discard_book(instance.pk)
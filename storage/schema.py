@@ -0,0 +1,183 @@
+# encoding: utf-8
+
+import sys
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from storage.isbn import canonical_value
+from storage.issues import ISSUE_MODELS
+from storage.models import Alias, Book, ImportManifest, version_sort_key
+from storage.search import SEARCH_TABLE, create_search_index, rebuild_search_index
+
+# How many rows each backfill statement updates at a time
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _columns(cursor, table):
+    cursor.execute("PRAGMA table_info({0})".format(connection.ops.quote_name(table)))
+    return set(row[1] for row in cursor.fetchall())
+
+
+def _indexes(cursor, table):
+    """
+    :return:
+        A list of (columns, unique) for every index on the table, with columns as a tuple in index order.
+    """
+    cursor.execute("PRAGMA index_list({0})".format(connection.ops.quote_name(table)))
+    indexes = []
+    for row in cursor.fetchall():
+        name, unique = row[1], bool(row[2])
+        cursor.execute("PRAGMA index_info({0})".format(connection.ops.quote_name(name)))
+        indexes.append((tuple(info[2] for info in sorted(cursor.fetchall())), unique))
+    return indexes
+
+
+def _add_column(cursor, model, field_name, stdout):
+    """
+    Add a model field's column to an existing table. SQLite adds columns without rewriting the table, so this is cheap
+    whatever the size of the table.
+    """
+    table = model._meta.db_table
+    field = model._meta.get_field(field_name)
+    if field.column in _columns(cursor, table):
+        return False
+
+    definition = field.db_type(connection=connection)
+    if not field.null:
+        default = field.get_default() if field.has_default() else ""
+        if isinstance(default, (int, long)):
+            definition += " NOT NULL DEFAULT {0}".format(default)
+        else:
+            definition += " NOT NULL DEFAULT '{0}'".format(default.replace("'", "''"))
+    stdout.write("Adding column {0}.{1}\n".format(table, field.column))
+    cursor.execute("ALTER TABLE {0} ADD COLUMN {1} {2}".format(
+        connection.ops.quote_name(table),
+        connection.ops.quote_name(field.column),
+        definition
+    ))
+    return True
+
+
+def _add_index_together(cursor, model, field_names, stdout):
+    """
+    Create the index Django would create for `index_together = ((field_names...), )`, unless an index with the same
+    leading columns already exists.
+    """
+    fields = [model._meta.get_field(name) for name in field_names]
+    columns = tuple(field.column for field in fields)
+    if any(index_columns[:len(columns)] == columns for index_columns, _ in _indexes(cursor, model._meta.db_table)):
+        return False
+
+    stdout.write("Creating index on {0} ({1})\n".format(model._meta.db_table, ", ".join(columns)))
+    for statement in connection.creation.sql_indexes_for_fields(model, fields, no_style()):
+        cursor.execute(statement)
+    return True
+
+
+def _unique_columns(model, field_names):
+    return tuple(model._meta.get_field(name).column for name in field_names)
+
+
+def _add_unique_together(cursor, model, field_names, stdout):
+    """
+    Create a unique index for `unique_together = ((field_names...), )` unless one already exists. Existing rows that
+    break the constraint are reported and the index is left out, rather than failing the whole upgrade.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    columns = _unique_columns(model, field_names)
+    if (columns, True) in _indexes(cursor, table):
+        return False
+
+    cursor.execute("SELECT {0}, COUNT(*) FROM {1} GROUP BY {0} HAVING COUNT(*) > 1 LIMIT 10".format(
+        ", ".join(qn(column) for column in columns), qn(table)
+    ))
+    duplicates = cursor.fetchall()
+    if duplicates:
+        stdout.write("Not creating unique index on {0} ({1}), these values are duplicated: {2}\n".format(
+            table, ", ".join(columns), ", ".join(repr(row[:-1]) for row in duplicates)
+        ))
+        return False
+
+    stdout.write("Creating unique index on {0} ({1})\n".format(table, ", ".join(columns)))
+    cursor.execute("CREATE UNIQUE INDEX {0} ON {1} ({2})".format(
+        qn("{0}_{1}_uniq".format(table, "_".join(columns))),
+        qn(table),
+        ", ".join(qn(column) for column in columns)
+    ))
+    return True
+
+
+def _delete_duplicates(cursor, model, field_names, stdout):
+    """
+    Delete all but the first row of each group of rows sharing the same values for the given fields. Only meant for
+    tables where such rows carry nothing the first one does not, like the issue tables.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    columns = ", ".join(qn(model._meta.get_field(name).column) for name in field_names)
+    cursor.execute("DELETE FROM {0} WHERE id NOT IN (SELECT MIN(id) FROM {0} GROUP BY {1})".format(qn(table), columns))
+    if cursor.rowcount > 0:
+        stdout.write("Deleted {0} duplicate rows from {1}\n".format(cursor.rowcount, table))
+
+
+def _backfill(cursor, table, source_columns, target_column, function, stdout):
+    """
+    Fill in a column computed from other ones for every row where it is still empty, a chunk of rows at a time.
+    """
+    qn = connection.ops.quote_name
+    total = 0
+    last_pk = 0
+    while True:
+        # Rows are paged by primary key, as the function may well compute an empty value for some of them
+        cursor.execute("SELECT id, {0} FROM {1} WHERE {2} = '' AND id > %s ORDER BY id LIMIT {3}".format(
+            ", ".join(qn(column) for column in source_columns), qn(table), qn(target_column), BACKFILL_CHUNK_SIZE
+        ), [last_pk])
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        updates = [(function(*row[1:]), row[0]) for row in rows]
+        cursor.executemany("UPDATE {0} SET {1} = %s WHERE id = %s".format(qn(table), qn(target_column)), updates)
+        total += len(updates)
+        last_pk = rows[-1][0]
+
+    if total:
+        stdout.write("Filled in {0}.{1} for {2} rows\n".format(table, target_column, total))
+
+
+def upgrade(stdout=sys.stdout):
+    """
+    Bring a database created by an older version of the storage models up to date. `syncdb` only creates missing
+    tables, so columns and indexes added to existing tables are applied here. Every step checks whether it is needed
+    first, so running this against an up to date database does nothing.
+
+    None of the steps rewrite a table: SQLite adds columns in place and builds each index in a single pass over the
+    table, so this is safe to run against large tables, although writers wait while an index is being built.
+    """
+    cursor = connection.cursor()
+    with transaction.atomic():
+        _add_column(cursor, Book, "version_key", stdout)
+        _backfill(cursor, Book._meta.db_table, ("version", ), "version_key", version_sort_key, stdout)
+        _add_index_together(cursor, Book, ("book_id", "version_key"), stdout)
+
+        _add_unique_together(cursor, Book, ("book_id", "version"), stdout)
+        _add_index_together(cursor, Alias, ("scheme", "value"), stdout)
+        _add_column(cursor, Alias, "canonical_value", stdout)
+        _backfill(cursor, Alias._meta.db_table, ("scheme", "value"), "canonical_value", canonical_value, stdout)
+        _add_index_together(cursor, Alias, ("canonical_value", ), stdout)
+        _add_column(cursor, ImportManifest, "checkpoint", stdout)
+        _add_column(cursor, ImportManifest, "checkpoint_every", stdout)
+        _add_column(cursor, ImportManifest, "batch_size", stdout)
+
+        if create_search_index():
+            stdout.write("Creating full-text index {0}\n".format(SEARCH_TABLE))
+            rebuild_search_index()
+        for model in ISSUE_MODELS:
+            _add_index_together(cursor, model, ("source_file", ), stdout)
+
+            unique_fields = model._meta.unique_together[0]
+            if (_unique_columns(model, unique_fields), True) not in _indexes(cursor, model._meta.db_table):
+                _delete_duplicates(cursor, model, unique_fields, stdout)
+                _add_unique_together(cursor, model, unique_fields, stdout)
@@ -0,0 +1,165 @@
+# encoding: utf-8
+
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+
+from storage.models import Book
+
+# The full-text index over the title and description of every book
+SEARCH_TABLE = "storage_book_search"
+
+# How much more a match in the title counts than a match in the description when ranking results
+TITLE_WEIGHT = 10.0
+
+# How many results a search returns by default, and at most
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# A search is made of "quoted phrases" and bare words
+_TERMS = re.compile(r'"([^"]*)"|(\S+)')
+
+# The index is an FTS5 external content table: it keeps only the index and reads the text from storage_book, so the
+# descriptions are not stored twice. Triggers keep it in step with every write to storage_book, whether it comes from
+# Book.save(), a bulk insert or a queryset update.
+_CREATE_STATEMENTS = (
+    "CREATE VIRTUAL TABLE {table} USING fts5(title, description, content='storage_book', content_rowid='id')",
+    "CREATE TRIGGER {table}_insert AFTER INSERT ON storage_book BEGIN "
+    "INSERT INTO {table} (rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER {table}_delete AFTER DELETE ON storage_book BEGIN "
+    "INSERT INTO {table} ({table}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "END",
+    "CREATE TRIGGER {table}_update AFTER UPDATE OF title, description ON storage_book BEGIN "
+    "INSERT INTO {table} ({table}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO {table} (rowid, title, description) VALUES (new.id, new.title, new.description); END",
+)
+
+# The databases known to have the index, so that searches only check for it once
+_indexed_databases = set()
+
+
+def search_supported(using=DEFAULT_DB_ALIAS):
+    """
+    :return:
+        Whether the database can hold the full-text index: an SQLite built with FTS5.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+    return bool(cursor.fetchone()[0])
+
+
+def search_index_exists(using=DEFAULT_DB_ALIAS):
+    if using in _indexed_databases:
+        return True
+    if connections[using].vendor != "sqlite":
+        return False
+
+    cursor = connections[using].cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+    if cursor.fetchone() is None:
+        return False
+
+    _indexed_databases.add(using)
+    return True
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS):
+    """
+    Create the full-text index and the triggers that keep it up to date, unless it already exists or the database
+    cannot hold it. The index starts out empty; see :func:`rebuild_search_index` for filling it from existing books.
+
+    :return:
+        Whether the index was created.
+    """
+    if not search_supported(using) or search_index_exists(using):
+        return False
+
+    cursor = connections[using].cursor()
+    for statement in _CREATE_STATEMENTS:
+        cursor.execute(statement.format(table=SEARCH_TABLE))
+    return True
+
+
+def rebuild_search_index(using=DEFAULT_DB_ALIAS):
+    """
+    Index every book from scratch, creating the index first if need be. The triggers keep the index up to date, so this
+    is only needed to fill in a new index or to repair one.
+
+    :return:
+        Whether there is an index to rebuild.
+    """
+    create_search_index(using)
+    if not search_index_exists(using):
+        return False
+
+    connections[using].cursor().execute("INSERT INTO {0} ({0}) VALUES ('rebuild')".format(SEARCH_TABLE))
+    return True
+
+
+def search_terms(text):
+    """
+    Split a search into its "quoted phrases" and bare words.
+    """
+    terms = [phrase or word for phrase, word in _TERMS.findall(text or "")]
+    return [term for term in terms if term.strip()]
+
+
+def match_expression(terms):
+    """
+    Build an FTS5 query matching books that hold every term. Each term is quoted, so that whatever an editor types is
+    searched for as text rather than read as FTS5 query syntax.
+    """
+    return u" ".join(u'"{0}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def filter_books(queryset, text, using=DEFAULT_DB_ALIAS):
+    """
+    Restrict a queryset of books to those whose title or description holds every term of the search, through the
+    full-text index when there is one, and with a scan of the table otherwise.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset.none()
+
+    if not search_index_exists(using):
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        return queryset
+
+    return queryset.extra(
+        where=["{0}.id IN (SELECT rowid FROM {1} WHERE {1} MATCH %s)".format(Book._meta.db_table, SEARCH_TABLE)],
+        params=[match_expression(terms)]
+    )
+
+
+def search_books(text, limit=DEFAULT_SEARCH_LIMIT, offset=0, using=DEFAULT_DB_ALIAS):
+    """
+    Find the books whose title or description holds every term of a search, best matches first, as ranked by BM25 with
+    matches in the title counting :data:`TITLE_WEIGHT` times as much. Every version of a book is a result of its own.
+
+    This costs one query on the index and one to load the books. Without the index, the books are found with a scan
+    of the table and come back in title order.
+
+    :return:
+        A list of at most `limit` :class:`storage.models.Book` objects, skipping the first `offset` results.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+
+    if not search_index_exists(using):
+        return list(filter_books(Book.objects.using(using), text, using)[offset:offset + limit])
+
+    cursor = connections[using].cursor()
+    cursor.execute(
+        "SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, %s, 1.0) LIMIT %s OFFSET %s".format(SEARCH_TABLE),
+        [match_expression(terms), TITLE_WEIGHT, limit, offset]
+    )
+    pks = [row[0] for row in cursor.fetchall()]
+    books = Book.objects.using(using).in_bulk(pks)
+    return [books[pk] for pk in pks if pk in books]
@@ -0,0 +1,73 @@
+# encoding: utf-8
+
+from storage.changes import format_cursor
+
+
+def serialize_alias(alias):
+    return {"scheme": alias.scheme, "value": alias.value}
+
+
+def serialize_book(book, aliases=None):
+    """
+    The representation of a book served by the API.
+
+    :param book:
+        The :class:`storage.models.Book`.
+    :param aliases:
+        Its :class:`storage.models.Alias` objects. If not given, the aliases are left out.
+
+    :return:
+        A dictionary that can be written out as JSON.
+    """
+    data = {
+        "book_id": book.book_id,
+        "version": book.version,
+        "title": book.title,
+        "description": book.description,
+        "last_modified": book.last_modified_time.isoformat(),
+    }
+    if aliases is not None:
+        data["aliases"] = [serialize_alias(alias) for alias in aliases]
+    return data
+
+
+def serialize_resolution(resolution):
+    """
+    The representation of a :class:`storage.lookups.Resolution` served by the bulk resolution API.
+    """
+    return {
+        "scheme": resolution.scheme,
+        "value": resolution.value,
+        "book": serialize_book(resolution.book) if resolution.book is not None else None,
+        "trusted": resolution.trusted,
+        "flag": resolution.flag,
+    }
+
+
+def serialize_change(change):
+    """
+    The representation of a :class:`storage.changes.Change` served by the change feed. Every change carries its kind,
+    its cursor and when it happened; a book change carries the book, and the other kinds the alias they are about and
+    the book it belongs to.
+    """
+    data = {
+        "kind": change.kind,
+        "cursor": format_cursor(change.cursor),
+        "modified": change.cursor.modified.isoformat(),
+    }
+
+    instance = change.instance
+    if change.kind == "book":
+        data["book"] = serialize_book(instance)
+    elif change.kind == "alias_deleted":
+        data.update(book_id=instance.book_id, version=instance.version, scheme=instance.scheme, value=instance.value)
+    else:
+        data.update(
+            book_id=instance.book.book_id,
+            version=instance.book.version,
+            scheme=instance.scheme,
+            value=instance.value
+        )
+        if change.kind == "conflict":
+            data["source_file"] = instance.source_file
+    return data
@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+import bz2
+import gzip
+import tarfile
+import zipfile
+from contextlib import closing
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Suffixes of single compressed feeds, and how to open them
+_COMPRESSED_SUFFIXES = (
+    (".gz", lambda filename: gzip.GzipFile(filename, "rb")),
+    (".bz2", lambda filename: bz2.BZ2File(filename, "rb")),
+    (".xz", lambda filename: _open_xz(filename)),
+)
+
+_TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def _open_xz(filename):
+    if lzma is None:
+        raise IOError("Reading {0} needs the lzma module; on Python 2, install backports.lzma".format(filename))
+    return lzma.LZMAFile(filename, "rb")
+
+
+def member_source(archive, member):
+    """
+    :return:
+        The `source_file` recorded for books read from an archive member, such as "feeds.zip:book-1.xml".
+    """
+    return u"{0}:{1}".format(archive, member)
+
+
+def _is_feed_member(name):
+    return name.lower().endswith(".xml")
+
+
+def _iter_zip(filename):
+    with closing(zipfile.ZipFile(filename)) as archive:
+        for info in archive.infolist():
+            if _is_feed_member(info.filename):
+                with closing(archive.open(info)) as file_handle:
+                    yield member_source(filename, info.filename), file_handle
+
+
+def _iter_tar(filename):
+    if filename.lower().endswith((".tar.xz", ".txz")):
+        # tarfile cannot decompress xz on Python 2, so hand it the decompressed stream, which it leaves open
+        with closing(_open_xz(filename)) as decompressed:
+            for source in _iter_tar_members(filename, tarfile.open(fileobj=decompressed, mode="r|")):
+                yield source
+    else:
+        for source in _iter_tar_members(filename, tarfile.open(filename, mode="r|*")):
+            yield source
+
+
+def _iter_tar_members(filename, archive):
+    with closing(archive):
+        # In stream mode each member can only be read before moving on to the next one
+        for member in archive:
+            if member.isfile() and _is_feed_member(member.name):
+                with closing(archive.extractfile(member)) as file_handle:
+                    yield member_source(filename, member.name), file_handle
+
+
+def iter_feed_sources(filename):
+    """
+    Open a feed for reading, whatever it is packed in, and without unpacking it to disk:
+
+    * a plain XML file is read as it is;
+    * a file compressed with gzip (.gz), bzip2 (.bz2) or xz (.xz) is decompressed as it is read;
+    * each XML member of a zip or tar archive (optionally compressed: .tar.gz, .tgz, .tar.bz2, .tbz2, .tar.xz, .txz) is
+      read in turn, straight out of the archive. Members not ending in ".xml" are skipped.
+
+    Books read from an archive member are traced back to it with a `source_file` of the archive path and member name
+    (see :func:`member_source`); everything else uses the file name.
+
+    :param filename:
+        The path of the feed.
+
+    :return:
+        A generator of (source_file, file_handle) pairs. Each file handle is closed once the next pair is asked for.
+    """
+    lowered = filename.lower()
+    if lowered.endswith(".zip"):
+        for source in _iter_zip(filename):
+            yield source
+        return
+
+    if lowered.endswith(_TAR_SUFFIXES):
+        for source in _iter_tar(filename):
+            yield source
+        return
+
+    for suffix, open_compressed in _COMPRESSED_SUFFIXES:
+        if lowered.endswith(suffix):
+            with closing(open_compressed(filename)) as file_handle:
+                yield filename, file_handle
+            return
+
+    with open(filename, "rb") as file_handle:
+        yield filename, file_handle
@@ -0,0 +1,127 @@
+# encoding: utf-8
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+# The PRAGMAs of the bulk load profile; the SQLITE_BULK_LOAD_PRAGMAS setting overrides or adds to them
+DEFAULT_BULK_LOAD_PRAGMAS = {
+    # Readers keep reading the last committed state while the import writes, instead of waiting on its locks. This
+    # is stored in the database file, so it outlasts the load and applies to every connection.
+    "journal_mode": "WAL",
+    # In WAL mode, NORMAL only syncs at checkpoints: a power cut may lose the last commits, but cannot corrupt the
+    # database.
+    "synchronous": "NORMAL",
+    # In KiB when negative: 256 MB of page cache instead of 2 MB
+    "cache_size": -262144,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# PRAGMAs that SQLite refuses to change inside a transaction
+_OUTSIDE_TRANSACTION_PRAGMAS = ("journal_mode", "synchronous", "temp_store")
+
+
+def bulk_load_pragmas():
+    """
+    :return:
+        The PRAGMAs of the bulk load profile, as a list of (name, value) pairs, journal_mode first.
+    """
+    pragmas = dict(DEFAULT_BULK_LOAD_PRAGMAS)
+    pragmas.update(getattr(settings, "SQLITE_BULK_LOAD_PRAGMAS", {}))
+    return sorted(pragmas.items(), key=lambda pragma: (pragma[0] != "journal_mode", pragma[0]))
+
+
+class BulkLoadProfile(object):
+    """
+    Tune SQLite for loading lots of data for as long as the block runs, and tidy up after it.
+
+    SQLite's defaults suit small databases written to now and then: every commit is synced to disk, the page cache
+    is 2 MB, and while a long import transaction holds its locks, the admin and the API wait on them. Within the
+    block, every connection to the database, including those opened meanwhile by worker threads or after the
+    importer closes its own, gets the PRAGMAs of :func:`bulk_load_pragmas`: WAL journaling, so that readers go on
+    reading while the import writes, relaxed syncing, and a larger page cache and memory map. When the block ends,
+    the connection gets its own settings back except for WAL journaling, which stays so readers are never blocked,
+    and the load is finished off with ANALYZE, so that the query planner knows how the tables grew, and a checkpoint
+    that moves the write-ahead log into the database and truncates it.
+
+    It does nothing for other database backends, or when not enabled. Inside a transaction, as in tests, the journal
+    and sync modes, temp_store and the checkpoint are left alone, as SQLite refuses to change them there.
+
+    :param using:
+        The alias of the database to load.
+    :param enabled:
+        Whether to apply the profile at all, so that commands can make it optional without a block of their own.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, enabled=True):
+        self.using = using
+        self.enabled = enabled
+        self._saved = None
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def _applies(self):
+        return self.enabled and self.connection.vendor == "sqlite"
+
+    def __enter__(self):
+        if not self._applies():
+            return self
+
+        connection_created.connect(self._connection_created)
+        # Opening the connection configures it through the hook; one that is already open is configured here
+        self.connection.ensure_connection()
+        if self._saved is None:
+            self._configure(self.connection)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._applies():
+            return
+
+        connection_created.disconnect(self._connection_created)
+        saved, self._saved = self._saved, None
+        # The importer may have closed the connection the block was entered with and opened another since
+        if saved is not None and self.connection.connection is not None:
+            cursor = self.connection.cursor()
+            for name, value in saved:
+                if self._can_set(self.connection, name):
+                    cursor.execute("PRAGMA {0} = {1}".format(name, value))
+
+        if exc_type is None:
+            self.finish()
+
+    def _connection_created(self, sender, connection, **kwargs):
+        if connection.alias == self.using:
+            self._configure(connection)
+
+    @staticmethod
+    def _can_set(connection, name):
+        return name not in _OUTSIDE_TRANSACTION_PRAGMAS or not connection.in_atomic_block
+
+    def _configure(self, connection):
+        cursor = connection.connection.cursor()
+        pragmas = [(name, value) for name, value in bulk_load_pragmas() if self._can_set(connection, name)]
+
+        if self._saved is None:
+            self._saved = []
+            for name, _ in pragmas:
+                row = cursor.execute("PRAGMA {0}".format(name)).fetchone()
+                # No row means it does not apply, like mmap_size to an in-memory database
+                if name != "journal_mode" and row is not None:
+                    self._saved.append((name, row[0]))
+
+        for name, value in pragmas:
+            cursor.execute("PRAGMA {0} = {1}".format(name, value))
+
+    def finish(self):
+        """
+        Update the query planner's statistics and checkpoint the write-ahead log.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("ANALYZE")
+        if not self.connection.in_atomic_block:
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
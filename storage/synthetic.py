@@ -0,0 +1,88 @@
+# encoding: utf-8
+
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+from storage.isbn import isbn10_check_digit, isbn13_check_digit
+
+
+class _CatalogBook(object):
+    def __init__(self, number, aliases_per_book):
+        self.book_id = "book-{0}".format(number)
+        self.title = "Synthetic book {0}".format(number)
+        self.version = 1
+
+        stem = "{0:09d}".format(number % 10 ** 9)
+        isbn10 = stem + isbn10_check_digit(stem)
+        isbn13 = "978" + stem + isbn13_check_digit("978" + stem)
+        self.aliases = [("ISBN-10", isbn10), ("ISBN-13", isbn13)][:aliases_per_book]
+        for extra in range(aliases_per_book - len(self.aliases)):
+            self.aliases.append(("Proprietary", "P{0}-{1}".format(number, extra)))
+
+
+def generate_feed(
+    file_handle,
+    books,
+    seed=0,
+    aliases_per_book=2,
+    version_churn=0.2,
+    missing_version_rate=0.05,
+    alias_as_id_rate=0.05,
+    conflicting_alias_rate=0.02,
+    first_book=0
+):
+    """
+    Write a synthetic publisher feed of `books` <book> elements, wrapped in a <books> element, for benchmarking and
+    testing the import at scale. The same arguments always produce the same feed.
+
+    Besides new books, the feed reproduces the problems we have seen in the update files, at the given rates:
+
+    * version churn: a new edition of a book that appeared earlier in the feed;
+    * missing versions: a book without a <version>, as in update-3.xml;
+    * alias used as ID: a book identified by one of its aliases rather than its book ID, as in update-1.xml (ISBN) and
+      update-3.xml (a proprietary alias);
+    * conflicting aliases: a book carrying an alias that belongs to a different book, as in update-2.xml.
+
+    :param file_handle:
+        Where to write the feed.
+    :param books:
+        How many <book> elements to write.
+    :param seed:
+        The seed for the random choices.
+    :param aliases_per_book:
+        How many aliases each book has: an ISBN-10, an ISBN-13 and then proprietary ones.
+    :param first_book:
+        The number of the first book, so that separately generated feeds can describe different books.
+    """
+    rng = random.Random(seed)
+    catalog = []
+
+    file_handle.write("<books>\n")
+    for _ in xrange(books):
+        if catalog and rng.random() < version_churn:
+            book = rng.choice(catalog)
+            book.version += 1
+        else:
+            book = _CatalogBook(first_book + len(catalog), aliases_per_book)
+            catalog.append(book)
+
+        book_id = book.book_id
+        if rng.random() < alias_as_id_rate and book.aliases:
+            book_id = rng.choice(book.aliases)[1]
+
+        aliases = list(book.aliases)
+        if len(catalog) > 1 and rng.random() < conflicting_alias_rate:
+            other = rng.choice(catalog)
+            if other is not book and other.aliases:
+                aliases.append(rng.choice(other.aliases))
+
+        file_handle.write("<book id={0}>".format(quoteattr(book_id)))
+        file_handle.write("<title>{0}</title>".format(escape(book.title)))
+        if rng.random() >= missing_version_rate:
+            file_handle.write("<version>{0}.0</version>".format(book.version))
+        file_handle.write("<description>Edition {0} of {1}.</description>".format(book.version, escape(book.title)))
+        file_handle.write("<aliases>")
+        for scheme, value in aliases:
+            file_handle.write("<alias scheme={0} value={1}/>".format(quoteattr(scheme), quoteattr(value)))
+        file_handle.write("</aliases></book>\n")
+    file_handle.write("</books>\n")
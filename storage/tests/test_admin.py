@@ -0,0 +1,75 @@
+# encoding: utf-8
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from storage.models import Alias, AliasUsedAsBookIdIssue, Book
+
+
+class TestAdmin(TestCase):
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.login(username="admin", password="admin")
+
+    def _create_books(self, count):
+        for number in xrange(Book.objects.count(), count):
+            book = Book.objects.create(book_id="book-{0}".format(number), title="Book", version="1.0")
+            alias = Alias.objects.create(book=book, scheme="ISBN-10", value=str(1000000000 + number))
+            AliasUsedAsBookIdIssue.objects.create(alias_used=alias, book_resolved=book, source_file="feed.xml")
+
+    def _queries(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [query["sql"] for query in context.captured_queries]
+
+    def test_changelists_run_constant_queries(self):
+        """
+        Test that the number of queries for a changelist page does not grow with the number of rows shown.
+        """
+        for model in (Book, AliasUsedAsBookIdIssue):
+            url = reverse("admin:storage_{0}_changelist".format(model._meta.model_name))
+
+            self._create_books(2)
+            few = self._queries(url)
+            self._create_books(20)
+            many = self._queries(url)
+
+            self.assertEqual(len(few), len(many), "Assert that {0} runs the same queries for 2 and 20 rows.".format(
+                model.__name__
+            ))
+            self.assertFalse(
+                [sql for sql in many if "COUNT(" in sql],
+                "Assert that the unfiltered changelist is not counted."
+            )
+
+    def test_book_search_by_alias_value(self):
+        """
+        Test that books can be found by book ID or by the exact value of an alias.
+        """
+        self._create_books(3)
+        url = reverse("admin:storage_book_changelist")
+
+        response = self.client.get(url, {"q": "1000000001"})
+        self.assertEqual([book.book_id for book in response.context["cl"].result_list], ["book-1"])
+
+        response = self.client.get(url, {"q": "book-2"})
+        self.assertEqual([book.book_id for book in response.context["cl"].result_list], ["book-2"])
+        self.assertEqual(response.context["cl"].full_result_count, 3)
+
+    def test_book_search_by_text(self):
+        """
+        Test that books can be found by the words and phrases of their title and description.
+        """
+        self._create_books(3)
+        Book.objects.filter(book_id="book-1").update(title="Italian cooking")
+        Book.objects.filter(book_id="book-2").update(description="Cooking, the Italian way")
+        url = reverse("admin:storage_book_changelist")
+
+        response = self.client.get(url, {"q": "italian cooking"})
+        self.assertEqual(sorted(book.book_id for book in response.context["cl"].result_list), ["book-1", "book-2"])
+
+        response = self.client.get(url, {"q": '"italian cooking"'})
+        self.assertEqual([book.book_id for book in response.context["cl"].result_list], ["book-1"])
@@ -0,0 +1,326 @@
+# encoding: utf-8
+
+import glob
+import os
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from storage.models import (
+    Alias,
+    AliasPointsToConflictingBookIssue,
+    AliasUsedAsBookIdIssue,
+    AliasUsedToResolveBookIdIssue,
+    Book,
+    ImportManifest,
+    VersionUnspecifiedIssue
+)
+from storage.batch import WriteCounts
+from storage.resolution import alias_cache
+import storage.tools
+
+DATA_FILES = \
+    sorted(glob.glob(os.path.join(settings.BASE_DIR, "data", "initial", "*.xml"))) + \
+    sorted(glob.glob(os.path.join(settings.BASE_DIR, "data", "update", "*.xml")))
+
+FEED = """
+<books>
+    <book id="book-10">
+        <title>Book 10</title>
+        <version>1.0</version>
+        <aliases>
+            <alias scheme="ISBN-10" value="1000000010"/>
+            <alias scheme="ISBN-13" value="1000000000010"/>
+        </aliases>
+    </book>
+    <book id="1000000010">
+        <title>Book 10, second edition</title>
+        <version>2.0</version>
+        <aliases>
+            <alias scheme="ISBN-10" value="1000000010"/>
+            <alias scheme="Proprietary" value="P-10"/>
+        </aliases>
+    </book>
+    <book id="P-11">
+        <title>Book 11</title>
+        <aliases>
+            <alias scheme="Proprietary" value="P-10"/>
+            <alias scheme="ISBN-10" value="1000000011"/>
+        </aliases>
+    </book>
+    <book id="book-11">
+        <title>Book 11</title>
+        <aliases>
+            <alias scheme="ISBN-13" value="1000000000010"/>
+        </aliases>
+    </book>
+    <book id="book-11">
+        <title>Book 11</title>
+        <aliases>
+            <alias scheme="ISBN-10" value="1000000011"/>
+        </aliases>
+    </book>
+    <book id="book-12">
+        <title>Book 12</title>
+        <version>1.0</version>
+        <description>Book 12 has a description</description>
+        <aliases>
+            <alias scheme="ISBN-10" value="1000000012"/>
+        </aliases>
+    </book>
+    <book id="book-12">
+        <title>Book 12</title>
+        <version>1.0</version>
+        <description>Book 12 has a new description</description>
+        <aliases>
+            <alias scheme="ISBN-13" value="1000000000010"/>
+        </aliases>
+    </book>
+</books>
+"""
+
+# The same ISBNs written as ISBN-10s and ISBN-13s, with and without hyphens
+ISBN_FEED = """
+<books>
+    <book id="book-20">
+        <title>Book 20</title>
+        <version>1.0</version>
+        <aliases>
+            <alias scheme="ISBN-10" value="0-306-40615-2"/>
+        </aliases>
+    </book>
+    <book id="978-0-306-40615-7">
+        <title>Book 20</title>
+        <version>2.0</version>
+        <aliases>
+            <alias scheme="ISBN-10" value="0306406152"/>
+            <alias scheme="ISBN-13" value="9780306406157"/>
+        </aliases>
+    </book>
+    <book id="book-21">
+        <title>Book 21</title>
+        <version>1.0</version>
+        <aliases>
+            <alias scheme="ISBN-10" value="080442957X"/>
+        </aliases>
+    </book>
+    <book id="0-8044-2957-x">
+        <title>Book 21</title>
+        <version>2.0</version>
+    </book>
+    <book id="book-21">
+        <title>Book 21</title>
+        <version>2.0</version>
+        <aliases>
+            <alias scheme="ISBN-13" value="978 0 306 40615 7"/>
+        </aliases>
+    </book>
+</books>
+"""
+
+
+def _dump_database():
+    """
+    Describe everything an import wrote in terms that do not depend on primary keys.
+    """
+    def book_key(book):
+        return book.book_id, book.version
+
+    def alias_key(alias):
+        return book_key(alias.book), alias.scheme, alias.value, alias.canonical_value
+
+    return {
+        "books": sorted((b.book_id, b.version, b.title, b.description) for b in Book.objects.all()),
+        "aliases": sorted(alias_key(a) for a in Alias.objects.all()),
+        "alias_as_id": sorted(
+            (alias_key(i.alias_used), book_key(i.book_resolved), i.source_file)
+            for i in AliasUsedAsBookIdIssue.objects.all()
+        ),
+        "alias_to_resolve": sorted(
+            (alias_key(i.alias_used), book_key(i.book_resolved), i.source_file)
+            for i in AliasUsedToResolveBookIdIssue.objects.all()
+        ),
+        "conflicts": sorted(
+            (book_key(i.book), i.scheme, i.value, i.source_file)
+            for i in AliasPointsToConflictingBookIssue.objects.all()
+        ),
+        "versions": sorted((i.book_id, i.source_file) for i in VersionUnspecifiedIssue.objects.all()),
+    }
+
+
+def _clear_database():
+    for model in (
+        AliasPointsToConflictingBookIssue,
+        AliasUsedAsBookIdIssue,
+        AliasUsedToResolveBookIdIssue,
+        VersionUnspecifiedIssue,
+        Alias,
+        Book,
+        ImportManifest
+    ):
+        model.objects.all().delete()
+
+
+class TestBatch(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+
+    def _import_one_at_a_time(self, sources):
+        for filename, handle in sources:
+            for element in storage.tools.iter_book_elements(handle):
+                storage.tools.process_book_element(element, filename)
+
+    def _import_in_batches(self, sources, batch_size):
+        for filename, handle in sources:
+            storage.tools.process_book_elements(
+                storage.tools.iter_book_elements(handle),
+                filename,
+                batch_size=batch_size
+            )
+
+    def _assert_same_result(self, make_sources, batch_size):
+        self._import_one_at_a_time(make_sources())
+        expected = _dump_database()
+        _clear_database()
+
+        self._import_in_batches(make_sources(), batch_size)
+        self.assertEqual(_dump_database(), expected)
+        return expected
+
+    def test_batch_matches_one_at_a_time_for_data_files(self):
+        """
+        Importing the initial data and the updates in batches should produce exactly the same rows and issues as
+        importing them one book at a time.
+        """
+        def make_sources():
+            return [(filename, open(filename, "rb")) for filename in DATA_FILES]
+
+        self._assert_same_result(make_sources, batch_size=10)
+
+    def test_batch_matches_one_at_a_time_within_a_batch(self):
+        """
+        Books later in a batch should see the books, aliases and issues created by earlier books in the same batch, as
+        well as those from earlier batches.
+        """
+        def make_sources():
+            return [("feed.xml", BytesIO(FEED)), ("feed-again.xml", BytesIO(FEED))]
+
+        result = self._assert_same_result(make_sources, batch_size=500)
+        self.assertTrue(all(result.values()), "Assert that the feed exercises every kind of row and issue.")
+        _clear_database()
+        self._assert_same_result(make_sources, batch_size=2)
+
+    def test_batch_matches_one_at_a_time_for_isbn_forms(self):
+        """
+        Books identified by another form of a stored ISBN should resolve, conflict and inherit aliases the same way in
+        batches as one book at a time.
+        """
+        def make_sources():
+            return [("feed.xml", BytesIO(ISBN_FEED))]
+
+        result = self._assert_same_result(make_sources, batch_size=500)
+        self.assertEqual(len(result["alias_as_id"]), 2, "Assert that both ISBNs used as IDs were resolved.")
+        self.assertEqual(len(result["conflicts"]), 1, "Assert that the ISBN-13 form of book-20's ISBN conflicted.")
+        self.assertEqual(set(book_id for book_id, _, _, _ in result["books"]), set(["book-20", "book-21"]))
+
+    def test_issues_recorded_under_either_form_of_a_path(self):
+        """
+        An issue recorded under a unicode path should be found again in a batch reading the same file by its byte path,
+        rather than inserted again for the unique constraint to reject.
+        """
+        feed = """<books><book id="book-60"><title>Book 60</title></book></books>"""
+        path = u"f\xe9ed.xml"
+        for element in storage.tools.iter_book_elements(BytesIO(feed)):
+            storage.tools.process_book_element(element, path)
+        alias_cache.clear()
+
+        with CaptureQueriesContext(connection) as context:
+            storage.tools.process_book_elements(storage.tools.iter_book_elements(BytesIO(feed)), path.encode("utf-8"))
+
+        insert = 'INSERT INTO "{0}"'.format(VersionUnspecifiedIssue._meta.db_table)
+        self.assertFalse([query for query in context.captured_queries if insert in query["sql"]])
+        self.assertEqual(VersionUnspecifiedIssue.objects.filter(book_id="book-60").count(), 1)
+
+    def test_batch_query_count_does_not_grow_with_batch_size(self):
+        """
+        A batch should cost the same number of queries whether it holds a handful of books or many.
+        """
+        def make_feed(start, count):
+            books = "".join(
+                """<book id="book-{0}"><title>Book {0}</title>
+                <aliases><alias scheme="ISBN-10" value="{0}"/><alias scheme="ISBN-13" value="978{0}"/></aliases>
+                </book>""".format(number)
+                for number in range(start, start + count)
+            )
+            return BytesIO("<books>{0}</books>".format(books))
+
+        def count_queries(feed):
+            with CaptureQueriesContext(connection) as context:
+                storage.tools.process_book_elements(storage.tools.iter_book_elements(feed), "feed.xml")
+            return len(context.captured_queries)
+
+        small = count_queries(make_feed(1000, 5))
+        large = count_queries(make_feed(2000, 60))
+
+        self.assertEqual(small, large, "Assert that the number of queries does not depend on the number of books.")
+        self.assertEqual(Book.objects.filter(book_id__startswith="book-").count(), 65)
+
+    def test_unchanged_books_are_not_written(self):
+        """
+        Re-importing books as they are stored should write nothing and leave their modified time alone, and a book
+        whose fields or aliases did change should get a single UPDATE, whether books are imported one at a time or in
+        batches.
+        """
+        def make_feed(title, aliases):
+            return BytesIO(
+                """<books>
+                <book id="book-50"><title>Book 50</title><version>1.0</version><aliases>{1}</aliases></book>
+                <book id="book-51"><title>{0}</title><version>1.0</version></book>
+                </books>""".format(title, "".join(
+                    '<alias scheme="ISBN-10" value="{0}"/>'.format(value) for value in aliases
+                ))
+            )
+
+        def import_feed(feed, batch_size):
+            elements = storage.tools.iter_book_elements(feed)
+            if batch_size:
+                return storage.tools.process_book_elements(elements, "feed.xml", batch_size=batch_size)
+            counts = WriteCounts()
+            for element in elements:
+                counts.add(storage.tools.process_book_element(element, "feed.xml"))
+            return counts
+
+        def writes(context):
+            statements = (re.search(r"\b(INSERT|UPDATE|DELETE)\b", query["sql"]) for query in context.captured_queries)
+            return [statement.group(1) for statement in statements if statement is not None]
+
+        def modified_times():
+            return dict(Book.objects.values_list("book_id", "last_modified_time"))
+
+        for batch_size in (None, 500):
+            _clear_database()
+            alias_cache.clear()
+
+            self.assertEqual(import_feed(make_feed("Book 51", ["5000000050"]), batch_size), WriteCounts(created=2))
+            before = modified_times()
+
+            with CaptureQueriesContext(connection) as context:
+                counts = import_feed(make_feed("Book 51", ["5000000050"]), batch_size)
+            self.assertEqual(counts, WriteCounts(unchanged=2))
+            self.assertEqual(writes(context), [], "Assert that nothing is written for unchanged books.")
+            self.assertEqual(modified_times(), before, "Assert that unchanged books keep their modified time.")
+
+            with CaptureQueriesContext(connection) as context:
+                counts = import_feed(make_feed("Book 51, Second Edition", ["5000000050", "5000000051"]), batch_size)
+            self.assertEqual(counts, WriteCounts(updated=2))
+            self.assertEqual(
+                sorted(writes(context)),
+                ["INSERT", "UPDATE", "UPDATE"],
+                "Assert that the new alias is inserted and each changed book is updated once."
+            )
+            after = modified_times()
+            self.assertTrue(all(after[book_id] > before[book_id] for book_id in before))
+            self.assertEqual(Book.objects.get(book_id="book-51").title, "Book 51, Second Edition")
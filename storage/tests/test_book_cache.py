@@ -0,0 +1,195 @@
+# encoding: utf-8
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from storage.book_cache import BookCache, book_cache
+from storage.importer import import_files
+from storage.models import Alias, Book
+from storage.resolution import alias_cache
+import storage.tools
+
+FEED = """<books>
+    <book id="book-1"><title>Book 1</title><version>1.0</version>
+        <aliases><alias scheme="ISBN-10" value="1000000001"/></aliases></book>
+    <book id="book-2"><title>Book 2</title><version>1.0</version></book>
+</books>"""
+
+
+def _import(feed, batch_size=None):
+    if batch_size is None:
+        for element in storage.tools.iter_book_elements(BytesIO(feed)):
+            storage.tools.process_book_element(element, "feed.xml")
+    else:
+        storage.tools.process_book_elements(storage.tools.iter_book_elements(BytesIO(feed)), "feed.xml", batch_size)
+
+
+class TestBookCache(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+        _import(FEED)
+        # Forget the evictions of the import, which the first request would otherwise repeat once it finishes
+        book_cache.clear()
+
+    def tearDown(self):
+        book_cache.clear()
+
+    def _get(self, *args):
+        name = {1: "storage_book", 2: "storage_book_version"}[len(args)]
+        return json.loads(self.client.get(reverse(name, args=args)).content)
+
+    def _get_alias(self, scheme, value):
+        return json.loads(self.client.get(reverse("storage_alias", args=[scheme, value])).content)
+
+    def test_hot_reads_run_no_queries(self):
+        """
+        Test that once a book has been served, by its ID, its ID and version or an alias, it is served again without a
+        query.
+        """
+        for url in (
+            reverse("storage_book", args=["book-1"]),
+            reverse("storage_book_version", args=["book-1", "1"]),
+            reverse("storage_alias", args=["ISBN-13", "978-1-00-000000-9"]),
+        ):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content)
+            self.assertEqual(second["ETag"], first["ETag"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("storage_alias", args=["ISBN-10", "1000000001"]))
+        self.assertEqual(json.loads(response.content)["book_id"], "book-1")
+
+    def test_import_evicts_changed_books(self):
+        """
+        Test that the import evicts a book whose title or aliases change, and the latest version of a book that gains
+        a version, one element at a time and in batches.
+        """
+        self._get("book-1")
+        self._get("book-2")
+
+        _import(FEED.replace("Book 1", "Book 1, revised"))
+        self.assertEqual(self._get("book-1")["title"], "Book 1, revised")
+
+        _import(FEED.replace('<version>1.0</version></book>', '<version>2.0</version></book>'), batch_size=10)
+        self.assertEqual(self._get("book-2")["version"], "2.0")
+
+        _import(FEED.replace('value="1000000001"/>', 'value="1000000001"/><alias scheme="Proprietary" value="A"/>'))
+        self.assertEqual(len(self._get("book-1")["aliases"]), 2)
+
+        _import(FEED.replace('value="1000000001"/>', 'value="1000000001"/><alias scheme="Proprietary" value="B"/>'), 10)
+        self.assertEqual(len(self._get("book-1")["aliases"]), 3)
+
+    def test_edits_evict_changed_books(self):
+        """
+        Test that saving or deleting a book or an alias, as the admin does, evicts what it changed.
+        """
+        self.assertEqual(self._get_alias("ISBN-10", "1000000001")["book_id"], "book-1")
+        self.assertEqual(self._get("book-1", "1.0")["book_id"], "book-1")
+
+        Alias.objects.get(value="1000000001").delete()
+        self.assertIn("error", self._get_alias("ISBN-10", "1000000001"))
+        self.assertEqual(self._get("book-1", "1.0")["aliases"], [])
+
+        book = Book.objects.get(book_id="book-1")
+        book.book_id = "book-3"
+        book.save()
+        self.assertIn("error", self._get("book-1"))
+        self.assertIn("error", self._get("book-1", "1.0"))
+        self.assertEqual(self._get("book-3")["book_id"], "book-3")
+
+        book.delete()
+        self.assertIn("error", self._get("book-3"))
+
+    def test_after_commit_evicts_again(self):
+        """
+        Test that a book cached while a transaction was writing it is evicted once the transaction commits.
+        """
+        book = Book.objects.get(book_id="book-1")
+        book.title = "Book 1, revised"
+        book.save()
+        # A request that could not see the uncommitted title yet
+        stale = Book(pk=book.pk, book_id="book-1", version="1.0", title="Book 1")
+        stale.last_modified_time = book.last_modified_time
+        book_cache.add(stale, [], latest=True)
+
+        book_cache.after_commit()
+        self.assertEqual(self._get("book-1")["title"], "Book 1, revised")
+
+    def test_stale_documents_expire(self):
+        """
+        Test that a book cached after the eviction of a commit that changed it is only served until it expires.
+        """
+        short = BookCache(timeout=0.05)
+        book = Book.objects.get(book_id="book-1")
+        book.title = "Book 1, revised"
+        book.save()
+        short.after_commit()
+        # A request that read the book before the commit, and caches it only now
+        stale = Book(pk=book.pk, book_id="book-1", version="1.0", title="Book 1")
+        stale.last_modified_time = book.last_modified_time
+        short.add(stale, [], latest=True)
+        self.assertEqual(json.loads(short.get_book("book-1").body)["title"], "Book 1")
+
+        time.sleep(0.1)
+        self.assertIsNone(short.get_book("book-1"))
+        self.assertRaises(ValueError, BookCache, timeout=None)
+
+    def test_warm_after_import(self):
+        """
+        Test that an import can cache the books it wrote, so that the first request for them runs no query.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "feed.xml")
+            with open(filename, "wb") as file_handle:
+                file_handle.write(FEED.replace("book-2", "book-3").replace("Book 1", "Book 1, revised"))
+            import_files([filename], warm_cache=True, stdout=BytesIO())
+        finally:
+            shutil.rmtree(directory)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self._get("book-1")["title"], "Book 1, revised")
+            self.assertEqual(self._get("book-3", "1.0")["book_id"], "book-3")
+
+        self.assertEqual(book_cache.warm(), 3)
+        with self.assertNumQueries(0):
+            self._get("book-2")
+
+    def test_file_based_backend(self):
+        """
+        Test that the cache works the same over the file-based backend, which separate processes can share.
+        """
+        directory = tempfile.mkdtemp()
+        caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "files": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory},
+        }
+        try:
+            with override_settings(CACHES=caches):
+                files = BookCache("files")
+                book = Book.objects.get(book_id="book-1")
+                files.add(book, list(book.aliases.all()), latest=True)
+
+                self.assertEqual(BookCache("files").get_book("book-1").body, files.get_book("book-1", "1.0").body)
+                files.invalidate(book_pks=[book.pk])
+                self.assertIsNone(BookCache("files").get_book("book-1"))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_disabled(self):
+        """
+        Test that a cache without a backend caches nothing.
+        """
+        disabled = BookCache(None)
+        disabled.add(Book.objects.get(book_id="book-1"), [], latest=True)
+        self.assertIsNone(disabled.get_book("book-1"))
+        self.assertEqual(disabled.warm(), 0)
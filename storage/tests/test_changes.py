@@ -0,0 +1,176 @@
+# encoding: utf-8
+
+import json
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from storage.changes import atomic_changes, changes_since, format_cursor, parse_cursor
+from storage.models import Alias, AliasDeletion, AliasPointsToConflictingBookIssue, Book
+
+
+class TestChanges(TestCase):
+    def setUp(self):
+        self.books = [
+            Book.objects.create(book_id="book-{0}".format(number), title="Book {0}".format(number), version="1.0")
+            for number in range(5)
+        ]
+        for book in self.books:
+            Alias.objects.create(book=book, scheme="ISBN-10", value="100000000{0}".format(book.book_id[-1]))
+
+        # Everything an import batch writes shares one modified time
+        self.written = timezone.now() - timedelta(hours=1)
+        Book.objects.update(last_modified_time=self.written)
+        Alias.objects.update(last_modified_time=self.written)
+
+    def _sync(self, cursor=None, limit=2):
+        changes = []
+        while True:
+            page = changes_since(cursor, limit)
+            changes.extend(page.changes)
+            cursor = page.cursor
+            if not page.more:
+                return changes, cursor
+
+    def test_pages_are_stable_when_changes_share_a_modified_time(self):
+        """
+        Test that paging through changes sharing one modified time lists each exactly once, books before aliases.
+        """
+        changes, cursor = self._sync(limit=3)
+        self.assertEqual(
+            [(change.kind, change.instance.pk) for change in changes],
+            [("book", book.pk) for book in self.books] +
+            [("alias", pk) for pk in Alias.objects.order_by("pk").values_list("pk", flat=True)]
+        )
+        self.assertEqual(cursor, changes[-1].cursor)
+        self.assertEqual(self._sync(cursor), ([], cursor), "Assert that a synced consumer gets nothing new.")
+
+    @override_settings(STORAGE_CHANGE_FEED_LAG=0)
+    def test_sync_only_lists_what_changed_since(self):
+        """
+        Test that a sync from a cursor lists the rows modified since, including alias deletions, along with the book
+        they were deleted from, and conflicts.
+        """
+        _, cursor = self._sync()
+
+        book = self.books[2]
+        book.title = "Book 2, Second Edition"
+        book.save()
+        self.books[3].aliases.all().delete()
+        AliasPointsToConflictingBookIssue.objects.create(
+            book=self.books[0],
+            scheme="ISBN-13",
+            value="1000000000001",
+            source_file="update.xml"
+        )
+
+        with self.assertNumQueries(4):
+            page = changes_since(cursor)
+        self.assertEqual(
+            [(change.kind, change.instance.book_id) for change in page.changes],
+            [("book", "book-2"), ("alias_deleted", "book-3"), ("book", "book-3"), ("conflict", self.books[0].pk)]
+        )
+        self.assertFalse(page.more)
+
+    def test_cursors_stay_behind_uncommitted_changes(self):
+        """
+        Test that the feed only lists changes up to its high-water mark, so that no cursor passes a change that may not
+        have committed yet.
+        """
+        _, cursor = self._sync()
+        Book.objects.create(book_id="book-5", title="Book 5", version="1.0")
+
+        page = changes_since(cursor)
+        self.assertEqual(page, ([], cursor, False, page.high_water))
+        self.assertLessEqual(page.high_water, timezone.now() - timedelta(seconds=10))
+        self.assertEqual(json.loads(self.client.get(reverse("storage_changes")).content)["changes"][-1]["value"],
+                         "1000000004")
+
+        with override_settings(STORAGE_CHANGE_FEED_LAG=0):
+            self.assertEqual([change.instance.book_id for change in changes_since(cursor).changes], ["book-5"])
+
+    def test_changes_are_stamped_as_they_commit(self):
+        """
+        Test that the changes of a transaction share the time it ended, however long ago the first was written.
+        """
+        with atomic_changes():
+            first = Book.objects.create(book_id="book-5", title="Book 5", version="1.0")
+            Alias.objects.create(book=first, scheme="ISBN-10", value="1000000005")
+            self.books[0].title = "Book 0, revised"
+            self.books[0].save()
+            ended = timezone.now()
+
+        stamps = set(Book.objects.filter(book_id__in=["book-0", "book-5"]).values_list("last_modified_time", flat=True))
+        stamps.update(Alias.objects.filter(value="1000000005").values_list("last_modified_time", flat=True))
+        self.assertEqual(len(stamps), 1)
+        self.assertGreaterEqual(stamps.pop(), ended)
+        self.assertEqual(Book.objects.get(book_id="book-1").last_modified_time, self.written)
+
+    def test_book_deletion_leaves_alias_deletions(self):
+        """
+        Test that deleting a book records the deletion of its aliases.
+        """
+        self.books[1].delete()
+        self.assertEqual(
+            list(AliasDeletion.objects.values_list("book_id", "version", "scheme", "value")),
+            [("book-1", "1.0", "ISBN-10", "1000000001")]
+        )
+
+    def test_cursor_round_trip(self):
+        """
+        Test that a cursor survives being written out and read back, and that garbage is rejected.
+        """
+        changes, _ = self._sync()
+        for change in changes:
+            self.assertEqual(parse_cursor(format_cursor(change.cursor)), change.cursor)
+
+        for token in ("", "abc", "1-2", "1-9-1", "-1-0-1"):
+            with self.assertRaises(ValueError):
+                parse_cursor(token)
+
+    def test_changes_api(self):
+        """
+        Test that the API pages through the changes with the cursor it hands out.
+        """
+        url = reverse("storage_changes")
+        response = self.client.get(url, {"limit": 6})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(len(data["changes"]), 6)
+        self.assertTrue(data["more"])
+        self.assertEqual(data["changes"][0]["book"]["book_id"], "book-0")
+        self.assertEqual(data["changes"][5], {
+            "kind": "alias",
+            "cursor": data["cursor"],
+            "modified": self.written.isoformat(),
+            "book_id": "book-0",
+            "version": "1.0",
+            "scheme": "ISBN-10",
+            "value": "1000000000",
+        })
+
+        data = json.loads(self.client.get(url, {"cursor": data["cursor"], "limit": 6}).content)
+        self.assertEqual([change["value"] for change in data["changes"]], ["1000000001", "1000000002", "1000000003",
+                                                                           "1000000004"])
+        self.assertFalse(data["more"])
+
+        self.assertEqual(self.client.get(url, {"cursor": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"limit": 0}).status_code, 400)
+
+    def test_export_changes_command(self):
+        """
+        Test that the command prints every change after the cursor as JSON lines, and the cursor to continue from.
+        """
+        stdout, stderr = BytesIO(), BytesIO()
+        call_command("export_changes", page_size=4, stdout=stdout, stderr=stderr)
+        changes = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(changes), 10)
+        self.assertIn("Next cursor: {0}".format(changes[-1]["cursor"]), stderr.getvalue())
+
+        stdout = BytesIO()
+        call_command("export_changes", cursor=changes[4]["cursor"], stdout=stdout, stderr=BytesIO())
+        self.assertEqual([json.loads(line) for line in stdout.getvalue().splitlines()], changes[5:])
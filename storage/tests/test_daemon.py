@@ -0,0 +1,190 @@
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from io import BytesIO
+
+from django.test import TestCase
+from storage.daemon import DropDirectoryWatcher, IngestionDaemon, Turnstile
+from storage.models import Book, ImportManifest
+from storage.resolution import alias_cache
+from storage.tests.test_batch import DATA_FILES
+
+
+class _Notifier(object):
+    """
+    Stands in for a pyinotify notifier, delivering the events a test sends.
+    """
+    Event = namedtuple("Event", ["name", "pathname"])
+
+    def __init__(self, events):
+        self.events = events
+        self.pending = []
+
+    def send(self, pathname):
+        self.pending.append(self.Event(os.path.basename(pathname), pathname))
+
+    def check_events(self):
+        return bool(self.pending)
+
+    def read_events(self):
+        pass
+
+    def process_events(self):
+        self.events.extend(self.pending)
+        del self.pending[:]
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _drop(self, name, content, age=10):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as file_handle:
+            file_handle.write(content)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_watcher_waits_for_complete_files(self):
+        """
+        Test that files are reported once, oldest first, and only once nothing has written to them for a while.
+        """
+        watcher = DropDirectoryWatcher(self.directory, settle=5, use_inotify=False)
+        newer = self._drop("newer.xml", "<book/>", age=10)
+        older = self._drop("older.xml", "<book/>", age=20)
+        self._drop("writing.xml", "<bo", age=0)
+        self._drop("upload.xml.part", "<book/>")
+        self._drop(".hidden.xml", "<book/>")
+
+        self.assertEqual(watcher.poll(), [older, newer])
+        self.assertEqual(watcher.poll(), [], "Assert that files are only reported once.")
+
+        watcher.forget(older)
+        self.assertEqual(watcher.poll(), [older])
+
+    def test_watcher_takes_files_within_seconds_by_default(self):
+        """
+        Test that without inotify, a file that went quiet a few seconds ago is taken, and one just written is not.
+        """
+        watcher = DropDirectoryWatcher(self.directory, use_inotify=False)
+        quiet = self._drop("quiet.xml", "<book/>", age=3)
+        self._drop("writing.xml", "<bo", age=0)
+        self.assertEqual(watcher.poll(), [quiet])
+
+    def test_watcher_with_inotify_waits_for_the_writer(self):
+        """
+        Test that with inotify, a file is not imported when its upload stalls for longer than the settle window, only
+        once it is closed, and that files that were there before watching started are still found.
+        """
+        daemon = IngestionDaemon(self.directory, workers=0, settle=0.05, use_inotify=False, stdout=BytesIO())
+        daemon.run(once=True)
+        notifier = daemon.watcher._notifier = _Notifier(daemon.watcher._events)
+
+        existing = self._drop("existing.xml", """<book id="book-1"><title>Book 1</title></book>""", age=0)
+        self.assertEqual(daemon.watcher.wait(), [], "Assert that files there at startup are left to settle.")
+        time.sleep(0.1)
+        self.assertEqual(daemon.watcher.wait(), [existing])
+
+        path = os.path.join(self.directory, "stalled.xml")
+        with open(path, "wb") as file_handle:
+            file_handle.write("""<book id="book-2"><title>Book 2""")
+            file_handle.flush()
+            time.sleep(0.1)
+            daemon._enqueue(daemon.watcher.wait())
+            self.assertTrue(os.path.exists(path), "Assert that the stalled upload was not picked up.")
+            self.assertFalse(Book.objects.filter(book_id="book-2").exists())
+
+            file_handle.write("""</title></book>""")
+        notifier.send(path)
+
+        daemon._enqueue(daemon.watcher.wait())
+        self.assertEqual(Book.objects.get(book_id="book-2").title, "Book 2")
+        self.assertEqual(os.listdir(daemon.failed_directory), [])
+
+    def test_turnstile_lets_threads_through_in_ticket_order(self):
+        """
+        Test that threads pass the turnstile in ticket order however they arrive.
+        """
+        turnstile = Turnstile()
+        passed = []
+
+        def enter(ticket):
+            with turnstile.turn(ticket):
+                passed.append(ticket)
+
+        threads = [threading.Thread(target=enter, args=(ticket, )) for ticket in (3, 1, 0, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(passed, [0, 1, 2, 3])
+
+    def test_daemon_imports_and_moves_files(self):
+        """
+        Test that dropped files are imported in arrival order and moved to done, or failed if they cannot be imported.
+        """
+        for age, filename in zip(range(60, 0, -10), DATA_FILES):
+            with open(filename, "rb") as file_handle:
+                self._drop(os.path.basename(filename), file_handle.read(), age=age)
+        self._drop("broken.xml", "<book id=\"book-9\">", age=1)
+
+        stdout = BytesIO()
+        daemon = IngestionDaemon(self.directory, workers=0, settle=0, use_inotify=False, stdout=stdout)
+        daemon.run(once=True)
+
+        self.assertEqual(
+            sorted(os.listdir(daemon.done_directory)),
+            sorted(os.path.basename(filename) for filename in DATA_FILES)
+        )
+        self.assertEqual(os.listdir(daemon.failed_directory), ["broken.xml"])
+        self.assertIn("Failed to import", stdout.getvalue())
+
+        self.assertEqual(
+            sorted(Book.objects.values_list("book_id", "version")),
+            [("book-1", "1.0"), ("book-1", "2.0"), ("book-2", "1.0"), ("book-2", "2.0"), ("book-3", "1.0"),
+             ("book-3", "2.0")],
+            "Assert that the updates were applied after the initial files."
+        )
+        self.assertEqual(ImportManifest.objects.filter(status=ImportManifest.STATUS_FAILED).count(), 1)
+
+        # The same file dropped again is recognized as unchanged
+        with open(DATA_FILES[0], "rb") as file_handle:
+            self._drop(os.path.basename(DATA_FILES[0]), file_handle.read())
+        daemon.run(once=True)
+        self.assertIn("Skipped", stdout.getvalue())
+        self.assertEqual(len(os.listdir(daemon.done_directory)), len(DATA_FILES) + 1)
+
+    def test_daemon_forgets_aliases_between_files(self):
+        """
+        Test that the daemon does not resolve a file against aliases cached before it, which another process may have
+        edited since.
+        """
+        alias_cache.add("ISBN-10", "1000000001", 1, 1, "book-1")
+        with open(DATA_FILES[0], "rb") as file_handle:
+            self._drop(os.path.basename(DATA_FILES[0]), file_handle.read())
+
+        IngestionDaemon(self.directory, workers=0, settle=0, use_inotify=False, stdout=BytesIO()).run(once=True)
+        self.assertIsNone(alias_cache.get("ISBN-10", "1000000001"))
+
+    def test_daemon_reads_files_that_keep_their_modified_time(self):
+        """
+        Test that a file dropped again with new contents of the same size and the same modified time, as `cp -p` or
+        `rsync -t` would leave it, is imported rather than taken to be unchanged.
+        """
+        daemon = IngestionDaemon(self.directory, workers=0, settle=0, use_inotify=False, stdout=BytesIO())
+        for title in ("Book 1", "Book 2"):
+            feed = """<book id="book-1"><title>{0}</title><version>1.0</version></book>""".format(title)
+            os.utime(self._drop("book.xml", feed), (1000000000, 1000000000))
+            daemon.run(once=True)
+
+        self.assertEqual(Book.objects.get(book_id="book-1").title, "Book 2")
@@ -0,0 +1,114 @@
+# encoding: utf-8
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from contextlib import closing
+from io import BytesIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from storage.export import export_catalog, iter_catalog
+from storage.importer import import_files
+from storage.models import Alias, Book
+from storage.resolution import alias_cache
+from storage.tests.test_batch import DATA_FILES
+import storage.tools
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+        import_files(DATA_FILES, stdout=open(os.devnull, "w"))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _books(self):
+        return sorted(
+            (book.book_id, book.version, book.title, book.description, sorted(
+                (alias.scheme, alias.value) for alias in book.aliases.all()
+            ))
+            for book in Book.objects.all()
+        )
+
+    def test_catalog_holds_every_book_with_aliases_and_issues(self):
+        """
+        Test that every book is exported once, in primary key order, with its aliases and the issues raised against it.
+        """
+        documents = list(iter_catalog(chunk_size=2))
+        self.assertEqual(
+            [(document["book_id"], document["version"]) for document in documents],
+            list(Book.objects.order_by("pk").values_list("book_id", "version"))
+        )
+        self.assertEqual(
+            sorted(
+                (document["book_id"], document["version"], document["title"], document["description"], sorted(
+                    (alias["scheme"], alias["value"]) for alias in document["aliases"]
+                ))
+                for document in documents
+            ),
+            self._books()
+        )
+
+        issues = set(issue["issue"] for document in documents for issue in document["issues"])
+        self.assertEqual(issues, set([
+            "AliasPointsToConflictingBookIssue",
+            "AliasUsedAsBookIdIssue",
+            "AliasUsedToResolveBookIdIssue",
+            "VersionUnspecifiedIssue",
+        ]), "Assert that the data files raise every kind of issue, and that each is exported.")
+
+    def test_queries_per_chunk_do_not_grow_with_chunk_size(self):
+        """
+        Test that exporting costs a fixed number of queries per chunk of books, however many books a chunk holds.
+        """
+        books = Book.objects.count()
+        with CaptureQueriesContext(connection) as one_chunk:
+            list(iter_catalog(chunk_size=books))
+        with CaptureQueriesContext(connection) as chunk_per_book:
+            list(iter_catalog(chunk_size=1))
+
+        # Each chunk reads books, aliases, three issue tables by book and one by book ID; the last read finds no books
+        self.assertEqual(len(one_chunk.captured_queries), 6 + 1)
+        self.assertEqual(len(chunk_per_book.captured_queries), 6 * books + 1)
+
+    def test_xml_export_can_be_imported(self):
+        """
+        Test that the XML export is a feed the importer reads back into the same books and aliases.
+        """
+        feed = BytesIO()
+        self.assertEqual(export_catalog(feed, "xml"), Book.objects.count())
+
+        feed.seek(0)
+        records = [
+            storage.tools.read_book_element(element, "export.xml")
+            for element in storage.tools.iter_book_elements(feed)
+        ]
+        self.assertEqual(
+            sorted(
+                (record.book_id, record.version, record.title, record.description, sorted(record.aliases))
+                for record in records
+            ),
+            self._books()
+        )
+
+    def test_export_command_writes_gzipped_json_lines(self):
+        """
+        Test that the command picks the format and compression from the file name.
+        """
+        filename = os.path.join(self.directory, "catalog.jsonl.gz")
+        call_command("export_catalog", filename, stdout=BytesIO())
+
+        with closing(gzip.GzipFile(filename, "rb")) as file_handle:
+            documents = [json.loads(line) for line in file_handle]
+        self.assertEqual(len(documents), Book.objects.count())
+        self.assertEqual(
+            sum(len(document["aliases"]) for document in documents),
+            Alias.objects.count()
+        )
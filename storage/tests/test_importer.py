@@ -0,0 +1,376 @@
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.test import TestCase
+from lxml import etree
+from storage.importer import import_files, partition_records
+import storage.importer
+import storage.tools
+from storage.models import Alias, Book, ImportManifest
+from storage.resolution import alias_cache
+from storage.tests.test_batch import DATA_FILES, FEED, _clear_database, _dump_database
+from storage.tools import BookRecord
+
+
+def _record(book_id, *values):
+    return BookRecord(
+        book_id=book_id,
+        version=None,
+        title=book_id,
+        description=None,
+        aliases=tuple(("ISBN-10", value) for value in values),
+        source_file="feed.xml"
+    )
+
+
+class TestImporter(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_feed_files(self):
+        """
+        Split the test feed into one file per book, so that versions of the same book live in different files.
+        """
+        filenames = []
+        for number, line in enumerate(FEED.split("<book ")[1:]):
+            filename = os.path.join(self.directory, "feed-{0}.xml".format(number))
+            with open(filename, "wb") as file_handle:
+                file_handle.write("<book " + line.replace("</books>", ""))
+            filenames.append(filename)
+        return filenames
+
+    def test_partition_records_groups_books_sharing_identifiers(self):
+        """
+        Test that records sharing any identifier are grouped together, in import order.
+        """
+        first = _record("book-1", "1")
+        unrelated = _record("book-2", "2")
+        by_isbn = _record("1", "3")
+        linked = _record("book-3", "3")
+
+        groups = partition_records([
+            ("book-1", first),
+            ("book-2", unrelated),
+            ("book-1", by_isbn),
+            ("book-3", linked),
+        ])
+
+        self.assertEqual(groups, [[first, by_isbn, linked], [unrelated]])
+
+    def test_import_files_with_workers_matches_sequential_import(self):
+        """
+        Test that the parallel import writes the same books, aliases and issues as importing the files in order.
+        """
+        filenames = list(DATA_FILES) + self._write_feed_files()
+
+        import_files(filenames, stdout=BytesIO())
+        expected = _dump_database()
+        _clear_database()
+
+        import_files(filenames, workers=1, batch_size=3, stdout=BytesIO())
+        self.assertEqual(_dump_database(), expected)
+
+    def test_import_files_with_workers_matches_sequential_import_for_isbn_forms(self):
+        """
+        Test that books sharing an ISBN written in different forms are written in file order by the parallel import, as
+        they resolve to the same book.
+        """
+        contents = [
+            """<book id="book-1"><title>Book 1</title><version>1.0</version>
+            <aliases><alias scheme="ISBN-10" value="0-306-40615-2"/></aliases></book>""",
+            """<book id="book-2"><title>Book 2</title><version>2.0</version>
+            <aliases><alias scheme="ISBN-13" value="9780306406157"/></aliases></book>""",
+            """<book id="book-1"><title>Book 1, again</title>
+            <aliases><alias scheme="ISBN-10" value="0-306-40615-2"/></aliases></book>""",
+        ]
+        filenames = []
+        for number, content in enumerate(contents):
+            filename = os.path.join(self.directory, "book-{0}.xml".format(number))
+            with open(filename, "wb") as file_handle:
+                file_handle.write(content)
+            filenames.append(filename)
+
+        import_files(filenames, stdout=BytesIO())
+        expected = _dump_database()
+        self.assertEqual(Book.objects.filter(book_id="book-1").count(), 3, "Assert that book-2 resolved to book-1.")
+        _clear_database()
+        alias_cache.clear()
+
+        import_files(filenames, workers=1, batch_size=3, stdout=BytesIO())
+        self.assertEqual(_dump_database(), expected)
+
+    def test_import_files_with_workers_rolls_back_only_the_failing_file(self):
+        """
+        Test that a file failing to write in a parallel import is rolled back and reported on its own, and that the
+        files around it are still written as they would be one after another.
+        """
+        filenames = self._write_feed_files()
+        failing = filenames[1]
+        process_book_records = storage.importer.process_book_records
+
+        def failing_writes(records):
+            if any(record.source_file == failing for record in records):
+                raise RuntimeError("Write failed")
+            return process_book_records(records)
+
+        import_files([filename for filename in filenames if filename != failing], stdout=BytesIO())
+        expected = _dump_database()
+        _clear_database()
+        alias_cache.clear()
+
+        storage.importer.process_book_records = failing_writes
+        try:
+            stdout = BytesIO()
+            failures = import_files(filenames, workers=1, batch_size=3, stdout=stdout)
+        finally:
+            storage.importer.process_book_records = process_book_records
+
+        self.assertEqual([failure.filename for failure in failures], [failing])
+        self.assertIn("Failed to import {0}: Write failed".format(failing), stdout.getvalue())
+        self.assertEqual(ImportManifest.objects.get(path=failing).status, ImportManifest.STATUS_FAILED)
+        self.assertEqual(_dump_database(), expected)
+
+    def test_import_files_with_workers_records_files_with_their_books(self):
+        """
+        Test that a parallel import records its files in the manifest in the transaction that writes their books, so
+        that a run dying in between leaves neither, and the next run imports the files once.
+        """
+        filenames = self._write_feed_files()
+        record_import = storage.importer.record_import
+
+        def dying_record_import(state, error=None, **kwargs):
+            raise KeyboardInterrupt()
+
+        storage.importer.record_import = dying_record_import
+        try:
+            self.assertRaises(KeyboardInterrupt, import_files, filenames, workers=1, stdout=BytesIO())
+        finally:
+            storage.importer.record_import = record_import
+
+        self.assertFalse(Book.objects.exists())
+        self.assertFalse(ImportManifest.objects.exists())
+
+        alias_cache.clear()
+        import_files(filenames, workers=1, stdout=BytesIO())
+        self.assertEqual(ImportManifest.objects.filter(status=ImportManifest.STATUS_IMPORTED).count(), len(filenames))
+
+    def test_import_files_rolls_back_only_the_failing_file(self):
+        """
+        Test that a file failing halfway through is rolled back and reported, while the files around it in the same
+        transaction are committed.
+        """
+        contents = [
+            """<book id="book-1"><title>Book 1</title><version>1.0</version>
+            <aliases><alias scheme="ISBN-10" value="1000000001"/></aliases></book>""",
+            """<books><book id="book-2"><title>Book 2</title><version>1.0</version>
+            <aliases><alias scheme="ISBN-10" value="1000000002"/></aliases></book><book id="book-3">""",
+            """<book id="book-4"><title>Book 4</title><version>1.0</version>
+            <aliases><alias scheme="ISBN-10" value="1000000002"/></aliases></book>""",
+        ]
+        filenames = []
+        for number, content in enumerate(contents):
+            filename = os.path.join(self.directory, "book-{0}.xml".format(number))
+            with open(filename, "wb") as file_handle:
+                file_handle.write(content)
+            filenames.append(filename)
+
+        stdout = BytesIO()
+        failures = import_files(filenames, commit_every=3, stdout=stdout)
+
+        self.assertEqual([failure.filename for failure in failures], [filenames[1]])
+        self.assertIsInstance(failures[0].error, etree.XMLSyntaxError)
+        self.assertIn("Failed to import {0}".format(filenames[1]), stdout.getvalue())
+        self.assertEqual(
+            ImportManifest.objects.get(path=filenames[1]).status,
+            ImportManifest.STATUS_FAILED,
+            "Assert that the failure was recorded in the manifest, so the file is retried next time."
+        )
+
+        self.assertEqual(
+            sorted(Book.objects.values_list("book_id", flat=True)),
+            ["book-1", "book-4"],
+            "Assert that the book written before the failure was rolled back."
+        )
+        self.assertEqual(
+            Alias.objects.get(value="1000000002").book.book_id,
+            "book-4",
+            "Assert that the alias from the rolled back file was not left behind in the cache."
+        )
+
+    def test_import_files_skips_unchanged_files(self):
+        """
+        Test that files are only imported again when their contents change, or when forced.
+        """
+        filename = os.path.join(self.directory, "book.xml")
+        with open(filename, "wb") as file_handle:
+            file_handle.write("""<book id="book-1"><title>Book 1</title><version>1.0</version></book>""")
+
+        import_files([filename], stdout=BytesIO())
+        manifest = ImportManifest.objects.get(path=filename)
+        self.assertEqual(manifest.status, ImportManifest.STATUS_IMPORTED)
+        self.assertEqual(manifest.size, os.path.getsize(filename))
+
+        stdout = BytesIO()
+        with self.assertNumQueries(1):
+            import_files([filename], stdout=stdout)
+        self.assertIn("Skipping 1 unchanged files.", stdout.getvalue())
+
+        # Touching the file without changing it is caught by the digest
+        os.utime(filename, (0, 0))
+        stdout = BytesIO()
+        import_files([filename], stdout=stdout)
+        self.assertNotIn("Importing", stdout.getvalue())
+        self.assertEqual(ImportManifest.objects.get(path=filename).mtime, 0)
+
+        import_files([filename], force=True, stdout=BytesIO())
+        self.assertEqual(Book.objects.filter(book_id="book-1").count(), 1)
+
+        # Rewriting the file with the same size and modification time, as `cp -p` would, is caught by the digest too,
+        # unless modification times are trusted
+        with open(filename, "wb") as file_handle:
+            file_handle.write("""<book id="book-1"><title>Book 2</title><version>1.0</version></book>""")
+        os.utime(filename, (0, 0))
+        stdout = BytesIO()
+        import_files([filename], trust_mtime=True, stdout=stdout)
+        self.assertIn("Skipping 1 unchanged files.", stdout.getvalue())
+        import_files([filename], stdout=BytesIO())
+        self.assertEqual(Book.objects.get(book_id="book-1").title, "Book 2")
+
+        with open(filename, "wb") as file_handle:
+            file_handle.write("""<book id="book-1"><title>Book 1</title><version>2.0</version></book>""")
+        stdout = BytesIO()
+        import_files([filename], stdout=stdout)
+        self.assertIn("Importing {0}".format(filename), stdout.getvalue())
+        self.assertEqual(Book.objects.filter(book_id="book-1").count(), 2)
+
+    def test_import_files_sees_aliases_edited_elsewhere(self):
+        """
+        Test that an import resolves against aliases as they are now, even where another process moved them since the
+        last import, without the signals that keep the alias cache up to date in this one.
+        """
+        filenames = []
+        for number, (book_id, version) in enumerate((("book-1", "1.0"), ("book-new", "2.0"))):
+            filename = os.path.join(self.directory, "book-{0}.xml".format(number))
+            with open(filename, "wb") as file_handle:
+                file_handle.write(
+                    """<book id="{0}"><title>Book</title><version>{1}</version>
+                    <aliases><alias scheme="ISBN-10" value="1000000001"/></aliases></book>""".format(book_id, version)
+                )
+            filenames.append(filename)
+
+        import_files(filenames[:1], stdout=BytesIO())
+        book_2 = Book.objects.create(book_id="book-2", title="Book 2", version="1.0")
+        Alias.objects.filter(value="1000000001").update(book=book_2)
+
+        import_files(filenames[1:], stdout=BytesIO())
+        self.assertEqual(
+            sorted(Book.objects.values_list("book_id", "version")),
+            [("book-1", "1.0"), ("book-2", "1.0"), ("book-2", "2.0")],
+            "Assert that the new version went to the book the alias belongs to now."
+        )
+
+    def test_import_files_stamps_changes_as_they_commit(self):
+        """
+        Test that everything a transaction of the import wrote carries the time it committed, so that the change feed
+        cannot list past what it wrote first before it commits.
+        """
+        filenames = self._write_feed_files()
+        import_files(filenames, commit_every=len(filenames), stdout=BytesIO())
+
+        stamps = set(Book.objects.values_list("last_modified_time", flat=True))
+        stamps.update(Alias.objects.values_list("last_modified_time", flat=True))
+        self.assertEqual(len(stamps), 1)
+
+    def _import_with_crash(self, filename, crash_at, **options):
+        """
+        Import a file, failing on the book `crash_at` in file order as though the import had died there.
+        """
+        process_book_element, read_book_element = storage.tools.process_book_element, storage.tools.read_book_element
+        calls = []
+
+        def crashing(function):
+            def wrapper(*args, **kwargs):
+                calls.append(None)
+                if len(calls) == crash_at:
+                    raise RuntimeError("Crashed")
+                return function(*args, **kwargs)
+            return wrapper
+
+        storage.tools.process_book_element = crashing(process_book_element)
+        storage.tools.read_book_element = crashing(read_book_element)
+        try:
+            return import_files([filename], stdout=BytesIO(), **options)
+        finally:
+            storage.tools.process_book_element = process_book_element
+            storage.tools.read_book_element = read_book_element
+
+    def test_resume_matches_uninterrupted_import(self):
+        """
+        Test that an import resumed from its last checkpoint writes exactly what an uninterrupted one does: the books
+        it committed before dying are not imported again, which would give those without a version yet another one.
+        """
+        filename = os.path.join(self.directory, "feed.xml")
+        with open(filename, "wb") as file_handle:
+            file_handle.write(FEED)
+
+        for batch_size in (None, 10):
+            import_files([filename], checkpoint_every=2, batch_size=batch_size, stdout=BytesIO())
+            expected = _dump_database()
+            self.assertEqual(ImportManifest.objects.get().status, ImportManifest.STATUS_IMPORTED)
+            _clear_database()
+            alias_cache.clear()
+
+            failures = self._import_with_crash(filename, 6, checkpoint_every=2, batch_size=batch_size)
+            self.assertEqual(len(failures), 1)
+            manifest = ImportManifest.objects.get()
+            self.assertEqual((manifest.status, manifest.checkpoint), (ImportManifest.STATUS_FAILED, 4))
+            self.assertEqual(Book.objects.count(), 4, "Assert that only the books of the two checkpoints are left.")
+
+            failures = import_files([filename], resume=True, checkpoint_every=3, stdout=BytesIO())
+            self.assertIsInstance(failures[0].error, ValueError, "Assert that other checkpoints are refused.")
+            self.assertEqual(ImportManifest.objects.get().checkpoint, 4)
+
+            # The checkpoint and batch sizes the import was started with are resumed with
+            self._import_with_crash(filename, 3, resume=True)
+            manifest = ImportManifest.objects.get()
+            self.assertEqual(
+                (manifest.checkpoint, manifest.checkpoint_every, manifest.batch_size),
+                (6, 2, batch_size or 0),
+                "Assert that the resumed import took its next checkpoint two books later."
+            )
+
+            stdout = BytesIO()
+            failures = import_files([filename], resume=True, stdout=stdout)
+            self.assertEqual(failures, [])
+            self.assertIn("Resuming {0} after book 6.".format(filename), stdout.getvalue())
+            self.assertEqual(_dump_database(), expected)
+            manifest = ImportManifest.objects.get()
+            self.assertEqual((manifest.status, manifest.checkpoint), (ImportManifest.STATUS_IMPORTED, 0))
+            _clear_database()
+            alias_cache.clear()
+
+    def test_resume_starts_over_on_changed_files(self):
+        """
+        Test that a checkpoint is not resumed from once the file it was taken of has changed.
+        """
+        filename = os.path.join(self.directory, "feed.xml")
+        with open(filename, "wb") as file_handle:
+            file_handle.write(FEED)
+        self._import_with_crash(filename, 3, checkpoint_every=2)
+        self.assertEqual(ImportManifest.objects.get().checkpoint, 2)
+
+        with open(filename, "wb") as file_handle:
+            file_handle.write(FEED.replace("Book 10", "Book Ten"))
+        stdout = BytesIO()
+        import_files([filename], resume=True, stdout=stdout)
+
+        self.assertNotIn("Resuming", stdout.getvalue())
+        self.assertEqual(Book.objects.get(book_id="book-10", version="1.0").title, "Book Ten")
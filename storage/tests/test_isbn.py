@@ -0,0 +1,40 @@
+# encoding: utf-8
+
+from django.test import TestCase
+from storage.isbn import alias_identity, canonical_value, to_isbn13
+
+
+class TestIsbn(TestCase):
+    def test_to_isbn13(self):
+        """
+        Test that every form of an ISBN reads as the same ISBN-13, and that anything else is not an ISBN.
+        """
+        for value in ("0306406152", "0-306-40615-2", "978-0-306-40615-7", "9780306406157", " 978 0306406157 "):
+            self.assertEqual(to_isbn13(value), "9780306406157", value)
+        self.assertEqual(to_isbn13("0-8044-2957-x"), "9780804429573", "Assert that an X check digit is read.")
+        self.assertEqual(to_isbn13("9791234567896"), "9791234567896", "Assert that 979 ISBNs are kept.")
+
+        self.assertIsNone(to_isbn13("0306406153"), "Assert that a wrong ISBN-10 check digit is refused.")
+        self.assertIsNone(to_isbn13("9780306406158"), "Assert that a wrong ISBN-13 check digit is refused.")
+        self.assertIsNone(to_isbn13("1234567890128"), "Assert that an EAN which is not an ISBN is refused.")
+        self.assertIsNone(to_isbn13("12345ABC"))
+        self.assertIsNone(to_isbn13(""))
+        self.assertIsNone(to_isbn13(None))
+
+    def test_canonical_value(self):
+        """
+        Test that only values of the ISBN schemes are normalized, and only when they are valid ISBNs.
+        """
+        self.assertEqual(canonical_value("ISBN-10", "0-306-40615-2"), "9780306406157")
+        self.assertEqual(canonical_value("ISBN-13", "0-306-40615-2"), "9780306406157")
+        self.assertEqual(canonical_value("ISBN-10", "1000000002"), "1000000002")
+        self.assertEqual(canonical_value("Proprietary", "0-306-40615-2"), "0-306-40615-2")
+
+    def test_alias_identity(self):
+        """
+        Test that an ISBN is the same identifier in either ISBN scheme, unlike other aliases.
+        """
+        self.assertEqual(alias_identity("ISBN-10", "0306406152"), alias_identity("ISBN-13", "978-0-306-40615-7"))
+        self.assertEqual(alias_identity("ISBN-10", "1000000002"), alias_identity("ISBN-13", "1000000002"))
+        self.assertNotEqual(alias_identity("Proprietary", "0306406152"), alias_identity("ISBN-10", "0306406152"))
+        self.assertNotEqual(alias_identity("Proprietary", "P-1"), alias_identity("Other", "P-1"))
@@ -0,0 +1,84 @@
+# encoding: utf-8
+
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+from storage.issues import IssueRecorder, bulk_create_issues
+from storage.models import Alias, AliasUsedAsBookIdIssue, Book, VersionUnspecifiedIssue
+
+
+class TestIssueRecorder(TestCase):
+    def setUp(self):
+        self.recorder = IssueRecorder()
+        self.book = Book.objects.create(book_id="book-1", title="Book 1", version="1.0")
+        self.alias = Alias.objects.create(book=self.book, scheme="ISBN-10", value="1000000001")
+
+    def test_buffered_issues_are_deduplicated_and_bulk_inserted(self):
+        """
+        Test that issues recorded several times, or already in the database, are written once, with a lookup and an
+        insert in a savepoint per issue type.
+        """
+        VersionUnspecifiedIssue.objects.create(book_id="book-1", source_file="update-3.xml")
+
+        with self.assertNumQueries(8):
+            with self.recorder.buffering():
+                for _ in range(3):
+                    self.recorder.record(VersionUnspecifiedIssue, book_id="book-1", source_file="update-3.xml")
+                    self.recorder.record(VersionUnspecifiedIssue, book_id="book-2", source_file=u"update-3.xml")
+                    self.recorder.record(
+                        AliasUsedAsBookIdIssue,
+                        alias_used_id=self.alias.pk,
+                        book_resolved=self.book,
+                        source_file="update-1.xml"
+                    )
+                self.assertEqual(len(self.recorder), 3, "Assert that the issues were buffered.")
+
+        self.assertEqual(VersionUnspecifiedIssue.objects.count(), 2)
+        self.assertEqual(AliasUsedAsBookIdIssue.objects.count(), 1)
+
+        with self.assertNumQueries(0):
+            with self.recorder.buffering():
+                self.recorder.record(
+                    AliasUsedAsBookIdIssue,
+                    alias_used=self.alias,
+                    book_resolved_id=self.book.pk,
+                    source_file="update-1.xml"
+                )
+
+    def test_unbuffered_issues_are_written_immediately(self):
+        """
+        Test that issues recorded outside of an import are written straight away.
+        """
+        self.recorder.record(VersionUnspecifiedIssue, book_id="book-1", source_file="update-3.xml")
+        self.recorder.record(VersionUnspecifiedIssue, book_id="book-1", source_file="update-3.xml")
+        self.assertEqual(VersionUnspecifiedIssue.objects.count(), 1)
+
+    def test_failed_block_writes_nothing(self):
+        """
+        Test that issues buffered in a block that raises are discarded.
+        """
+        with self.assertRaises(ValueError):
+            with self.recorder.buffering():
+                self.recorder.record(VersionUnspecifiedIssue, book_id="book-1", source_file="update-3.xml")
+                raise ValueError()
+
+        self.assertEqual(len(self.recorder), 0)
+        self.assertFalse(VersionUnspecifiedIssue.objects.exists())
+
+    def test_database_rejects_duplicate_issues(self):
+        """
+        Test that the database enforces one issue per distinct set of values, and that bulk inserts skip issues another
+        importer has just written.
+        """
+        VersionUnspecifiedIssue.objects.create(book_id="book-1", source_file="update-3.xml")
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                VersionUnspecifiedIssue.objects.create(book_id="book-1", source_file="update-3.xml")
+
+        bulk_create_issues(VersionUnspecifiedIssue, [
+            VersionUnspecifiedIssue(book_id="book-1", source_file="update-3.xml"),
+            VersionUnspecifiedIssue(book_id="book-2", source_file="update-3.xml"),
+        ])
+        self.assertEqual(
+            sorted(VersionUnspecifiedIssue.objects.values_list("book_id", flat=True)),
+            ["book-1", "book-2"]
+        )
@@ -33,4 +33,29 @@ class TestModels(TestCase):
         The alias should also have a __unicode__ method that specifies the book and the ID scheme and value.
         """
         expected = u"Book: {0}, ID Scheme: {1}, Value: {2}".format(unicode(self.book), u"ISBN-10", u"1000000001")
-        self.assertEqual(expected, unicode(self.alias))
\ No newline at end of file
+        self.assertEqual(expected, unicode(self.alias))
+
+
+class TestVersionSortKey(TestCase):
+    def test_version_sort_key_orders_versions_numerically(self):
+        """
+        Versions should sort by their number rather than as text, with textual editions next to the number they start
+        with.
+        """
+        versions = ["10.0", "2.0", "20th anniversary edition", "2.5", "21.0", "Special edition", "20.0", "1.0"]
+        ordered = sorted(versions, key=models.version_sort_key)
+        self.assertEqual(
+            ordered,
+            ["Special edition", "1.0", "2.0", "2.5", "10.0", "20.0", "20th anniversary edition", "21.0"]
+        )
+
+    def test_book_save_sets_version_key(self):
+        """
+        Saving a book should keep its sort key in step with its version.
+        """
+        book = models.Book.objects.create(book_id="book-1", title="The Title", version="2.0")
+        self.assertEqual(book.version_key, models.version_sort_key("2.0"))
+
+        book.version = "10.0"
+        book.save()
+        self.assertEqual(models.Book.objects.get(pk=book.pk).version_key, models.version_sort_key("10.0"))
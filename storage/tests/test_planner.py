@@ -0,0 +1,66 @@
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.test import TestCase
+from storage.batch import ISSUE_MODELS
+from storage.importer import import_files
+from storage.models import Alias, Book
+from storage.planner import plan_import
+from storage.resolution import alias_cache
+from storage.tests.test_batch import DATA_FILES, FEED
+
+
+class TestPlanner(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.feed = os.path.join(self.directory, "feed.xml")
+        with open(self.feed, "wb") as file_handle:
+            file_handle.write(FEED)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _counts(self):
+        return [Book.objects.count(), Alias.objects.count()] + [model.objects.count() for model in ISSUE_MODELS]
+
+    def test_plan_matches_import(self):
+        """
+        Test that the plan predicts exactly what the import then writes, without writing anything itself.
+        """
+        import_files(DATA_FILES[:3], stdout=BytesIO())
+        before = self._counts()
+
+        planner = plan_import(DATA_FILES[3:] + [self.feed], batch_size=2)
+        self.assertEqual(self._counts(), before, "Assert that planning wrote nothing.")
+
+        import_files(DATA_FILES[3:] + [self.feed], stdout=BytesIO())
+        after = self._counts()
+
+        summary = planner.report()["summary"]
+        self.assertEqual(summary["books_created"], after[0] - before[0])
+        self.assertEqual(summary["aliases_added"] + summary["aliases_inherited"], after[1] - before[1])
+        self.assertEqual(
+            [summary[model.__name__] for model in ISSUE_MODELS],
+            [issues - known for issues, known in zip(after[2:], before[2:])]
+        )
+        self.assertGreaterEqual(summary["new_versions"], 3, "Assert that the update files create new versions.")
+        self.assertGreater(summary["aliases_inherited"], 0)
+        self.assertGreater(summary["versions_inferred"], 0)
+
+    def test_plan_skips_unreadable_files(self):
+        """
+        Test that a file that cannot be parsed is reported and changes nothing in the plan.
+        """
+        broken = os.path.join(self.directory, "broken.xml")
+        with open(broken, "wb") as file_handle:
+            file_handle.write("<books><book id=\"book-1\"><title>Book 1</title></book><book>")
+
+        planner = plan_import([broken])
+        self.assertEqual([filename for filename, _ in planner.failures], [broken])
+        self.assertEqual(planner.books_read, 0)
+        self.assertIn("Cannot read {0}".format(broken), planner.format_summary())
@@ -0,0 +1,68 @@
+# encoding: utf-8
+
+from io import BytesIO
+
+from django.test import TestCase
+from storage.importer import import_files
+from storage.profiling import ImportProfiler, percentile
+from storage.resolution import alias_cache
+from storage.tests.test_batch import DATA_FILES
+import storage.batch
+import storage.tools
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+
+    def test_percentile(self):
+        """
+        Test the nearest-rank percentiles.
+        """
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_profiler_accounts_for_every_book_and_query(self):
+        """
+        Test that the profiler sees every book and file, and that the phases add up to the whole import.
+        """
+        with ImportProfiler() as profiler:
+            import_files(DATA_FILES, stdout=BytesIO())
+        report = profiler.report()
+
+        self.assertEqual(report["books"], len(DATA_FILES))
+        self.assertEqual(len(report["slowest_files"]), len(DATA_FILES))
+        self.assertEqual(sum(phase["queries"] for phase in report["phases"]), report["queries"])
+        self.assertAlmostEqual(sum(phase["seconds"] for phase in report["phases"]), report["seconds"], places=3)
+
+        phases = dict((phase["phase"], phase) for phase in report["phases"])
+        self.assertEqual(phases["resolve"]["calls"], len(DATA_FILES))
+        self.assertGreater(phases["issues"]["calls"], 0, "Assert that the issues in the update files were seen.")
+        self.assertIn("Per-book latency", profiler.format_report())
+
+        self.assertGreater(report["alias_cache"]["misses"], 0)
+        self.assertEqual(report["alias_cache"]["max_size"], alias_cache.max_size)
+        self.assertIn("Alias cache: ", profiler.format_report())
+
+    def test_profiler_sees_files_imported_in_checkpoints(self):
+        """
+        Test that the profiler sees the files of an import committed in checkpoints too.
+        """
+        with ImportProfiler() as profiler:
+            import_files(DATA_FILES, checkpoint_every=1, stdout=BytesIO())
+        report = profiler.report()
+
+        self.assertEqual(report["books"], len(DATA_FILES))
+        self.assertEqual(sorted(entry["filename"] for entry in report["slowest_files"]), sorted(DATA_FILES))
+
+    def test_profiler_puts_functions_back(self):
+        """
+        Test that an import after profiling runs the original functions, so the profiler costs nothing when off.
+        """
+        originals = (storage.tools._resolve_book_id, storage.batch.BookSnapshot.__dict__["flush"])
+        with ImportProfiler():
+            self.assertNotEqual(storage.tools._resolve_book_id, originals[0])
+        self.assertEqual((storage.tools._resolve_book_id, storage.batch.BookSnapshot.__dict__["flush"]), originals)
@@ -0,0 +1,93 @@
+# encoding: utf-8
+
+from django.test import TestCase
+from lxml import etree
+from storage.models import Alias, Book
+from storage.resolution import AliasResolutionCache, alias_cache, lookup_alias
+import storage.tools
+
+
+class TestResolution(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+
+        self.book = Book.objects.create(
+            book_id="book-1",
+            title="Book 1",
+            version="1.0"
+        )
+        self.alias = Alias.objects.create(
+            book=self.book,
+            scheme="ISBN-10",
+            value="1000000001"
+        )
+
+    def test_lookup_alias_is_cached(self):
+        """
+        Test that a known alias is only looked up in the database once.
+        """
+        with self.assertNumQueries(1):
+            first = lookup_alias("ISBN-10", "1000000001")
+        with self.assertNumQueries(0):
+            second = lookup_alias("ISBN-10", "1000000001")
+
+        self.assertEqual(first, second)
+        self.assertEqual(first.book_id, "book-1")
+        self.assertEqual(first.alias_pk, self.alias.pk)
+        self.assertEqual(alias_cache.stats()["hits"], 1)
+        self.assertEqual(alias_cache.stats()["misses"], 1)
+
+    def test_unknown_alias_is_not_cached(self):
+        """
+        Test that missing aliases are not remembered, so an alias created later is found.
+        """
+        self.assertIsNone(lookup_alias("ISBN-13", "1000000000001"))
+        Alias.objects.create(book=self.book, scheme="ISBN-13", value="1000000000001")
+        self.assertEqual(lookup_alias("ISBN-13", "1000000000001").book_id, "book-1")
+
+    def test_cache_is_invalidated_by_changes(self):
+        """
+        Test that deleting an alias or changing the ID of its book evicts it from the cache.
+        """
+        lookup_alias("ISBN-10", "1000000001")
+        self.book.book_id = "book-one"
+        self.book.save()
+        self.assertEqual(lookup_alias("ISBN-10", "1000000001").book_id, "book-one")
+
+        self.alias.delete()
+        self.assertIsNone(lookup_alias("ISBN-10", "1000000001"))
+
+    def test_cache_evicts_least_recently_used(self):
+        """
+        Test that a full cache drops the entry that was used least recently.
+        """
+        cache = AliasResolutionCache(max_size=2)
+        cache.add("ISBN-10", "1", 1, 1, "book-1")
+        cache.add("ISBN-10", "2", 2, 2, "book-2")
+        cache.get("ISBN-10", "1")
+        cache.add("ISBN-10", "3", 3, 3, "book-3")
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("ISBN-10", "2"))
+        self.assertEqual(cache.get("ISBN-10", "1").book_id, "book-1")
+        self.assertEqual(cache.get("ISBN-10", "3").book_id, "book-3")
+
+    def test_process_book_element_writes_new_aliases_through(self):
+        """
+        Test that aliases created during an import are cached, so updates to the same book resolve without queries for
+        their aliases.
+        """
+        xml_string = """
+        <book id="book-2">
+            <title>Book 2</title>
+            <version>1.0</version>
+            <aliases>
+                <alias scheme="ISBN-10" value="1000000002"/>
+            </aliases>
+        </book>
+        """
+        storage.tools.process_book_element(book_element=etree.fromstring(xml_string), filename="book-2.xml")
+
+        entry = alias_cache.get("ISBN-10", "1000000002")
+        self.assertEqual(entry.book_id, "book-2")
+        self.assertEqual(entry.alias_pk, Alias.objects.get(scheme="ISBN-10", value="1000000002").pk)
@@ -0,0 +1,177 @@
+# encoding: utf-8
+
+import re
+from io import BytesIO
+
+from django.contrib.admin import site
+from django.core.management.color import no_style
+from django.db import connection
+from django.test import TestCase
+from storage.models import (
+    Alias,
+    AliasPointsToConflictingBookIssue,
+    AliasUsedAsBookIdIssue,
+    AliasUsedToResolveBookIdIssue,
+    Book,
+    ImportManifest,
+    VersionUnspecifiedIssue,
+    alias_filter,
+    version_sort_key
+)
+from storage.admin import BookEditionAdmin
+import storage.schema
+
+
+class TestSchema(TestCase):
+    def test_upgrade_is_a_no_op_on_current_schema(self):
+        """
+        Test that upgrading a database created from the current models changes nothing.
+        """
+        stdout = BytesIO()
+        storage.schema.upgrade(stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_upgrade_adds_and_backfills_version_key(self):
+        """
+        Test that a book table from before the version sort key gets the column, its values and its index.
+        """
+        for number in range(3):
+            Book.objects.create(book_id="book-1", title="Book 1", version="{0}.0".format(number + 1))
+
+        cursor = connection.cursor()
+        fields = [Book._meta.get_field("book_id"), Book._meta.get_field("version_key")]
+        for statement in connection.creation.sql_destroy_indexes_for_fields(Book, fields, no_style()):
+            cursor.execute(statement)
+        cursor.execute("ALTER TABLE storage_book DROP COLUMN version_key")
+
+        stdout = BytesIO()
+        storage.schema.upgrade(stdout=stdout)
+
+        self.assertIn("Adding column storage_book.version_key", stdout.getvalue())
+        self.assertIn("Filled in storage_book.version_key for 3 rows", stdout.getvalue())
+        for book in Book.objects.all():
+            self.assertEqual(book.version_key, version_sort_key(book.version))
+
+        cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM storage_book WHERE book_id = %s ORDER BY version_key DESC",
+            ["x"]
+        )
+        self.assertIn("INDEX", " ".join(unicode(row[-1]) for row in cursor.fetchall()))
+
+    def test_upgrade_adds_and_backfills_canonical_value(self):
+        """
+        Test that an alias table from before canonical values gets the column, its values and its index.
+        """
+        book = Book.objects.create(book_id="book-1", title="Book 1", version="1.0")
+        Alias.objects.create(book=book, scheme="ISBN-10", value="0-306-40615-2")
+        Alias.objects.create(book=book, scheme="Proprietary", value="")
+
+        cursor = connection.cursor()
+        fields = [Alias._meta.get_field("canonical_value")]
+        for statement in connection.creation.sql_destroy_indexes_for_fields(Alias, fields, no_style()):
+            cursor.execute(statement)
+        cursor.execute("ALTER TABLE storage_alias DROP COLUMN canonical_value")
+
+        stdout = BytesIO()
+        storage.schema.upgrade(stdout=stdout)
+
+        self.assertIn("Adding column storage_alias.canonical_value", stdout.getvalue())
+        self.assertIn("Filled in storage_alias.canonical_value for 2 rows", stdout.getvalue())
+        self.assertEqual(
+            sorted(Alias.objects.values_list("value", "canonical_value")),
+            [("", ""), ("0-306-40615-2", "9780306406157")]
+        )
+
+        cursor.execute("EXPLAIN QUERY PLAN SELECT id FROM storage_alias WHERE canonical_value = %s", ["x"])
+        self.assertIn("INDEX", " ".join(unicode(row[-1]) for row in cursor.fetchall()))
+
+    def test_upgrade_adds_import_checkpoints(self):
+        """
+        Test that a manifest from before checkpoints gets the columns, with existing files at no checkpoint.
+        """
+        ImportManifest.objects.create(path="/feed.xml", size=1, mtime=0, digest="x", status="imported")
+        for column in ("checkpoint", "checkpoint_every", "batch_size"):
+            connection.cursor().execute("ALTER TABLE storage_importmanifest DROP COLUMN {0}".format(column))
+
+        stdout = BytesIO()
+        storage.schema.upgrade(stdout=stdout)
+
+        for column in ("checkpoint", "checkpoint_every", "batch_size"):
+            self.assertIn("Adding column storage_importmanifest.{0}\n".format(column), stdout.getvalue())
+        manifest = ImportManifest.objects.get(path="/feed.xml")
+        self.assertEqual((manifest.checkpoint, manifest.checkpoint_every, manifest.batch_size), (0, 0, 0))
+
+
+class TestQueryPlans(TestCase):
+    """
+    Every query the import runs to resolve a book should be answered from an index rather than by scanning a table.
+    """
+    def assertUsesIndex(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        details = [unicode(row[-1]) for row in cursor.fetchall()]
+
+        table_steps = [detail for detail in details if "storage_" in detail]
+        self.assertTrue(table_steps, "Assert that the plan reads a table: {0}".format(details))
+        for detail in table_steps:
+            # A full-text MATCH shows up as a scan of the virtual table with an index whose plan holds an M
+            full_text_match = re.match(r"SCAN storage_book_search VIRTUAL TABLE INDEX \d+:M", detail)
+            self.assertTrue(
+                detail.startswith("SEARCH") and ("INDEX" in detail or "PRIMARY KEY" in detail) or full_text_match,
+                "Assert that the query searches an index: {0}\n{1}".format(sql, details)
+            )
+
+    def test_alias_lookup_by_scheme_and_value(self):
+        self.assertUsesIndex(Alias.objects.filter(scheme="ISBN-10", value="1000000001").select_related("book")[:1])
+
+    def test_alias_lookup_by_values(self):
+        self.assertUsesIndex(Alias.objects.filter(value__in=["1000000001", "1000000002"]).select_related("book"))
+        self.assertUsesIndex(
+            Alias.objects.filter(canonical_value__in=["9781000000009", "1000000002"]).select_related("book")
+        )
+
+    def test_alias_lookup_by_isbn(self):
+        self.assertUsesIndex(
+            Alias.objects.filter(**alias_filter("ISBN-13", "9781000000009")).select_related("book")[:1]
+        )
+
+    def test_alias_lookup_by_book(self):
+        self.assertUsesIndex(Alias.objects.filter(book__in=[1, 2]))
+        self.assertUsesIndex(Alias.objects.filter(book=1, scheme="ISBN-10", value="1000000001"))
+
+    def test_book_lookup_by_book_id(self):
+        self.assertUsesIndex(Book.objects.filter(book_id="book-1")[:1])
+        self.assertUsesIndex(Book.objects.filter(book_id__in=["book-1", "book-2"]))
+
+    def test_book_lookup_by_book_id_and_version(self):
+        self.assertUsesIndex(Book.objects.filter(book_id="book-1", version="1.0"))
+
+    def test_latest_book_version(self):
+        self.assertUsesIndex(Book.objects.filter(book_id="book-1").order_by("-version_key").only("version")[:1])
+
+    def test_issue_lookups(self):
+        self.assertUsesIndex(AliasUsedAsBookIdIssue.objects.filter(
+            alias_used=1, book_resolved=1, source_file="update-1.xml"
+        ))
+        self.assertUsesIndex(AliasUsedToResolveBookIdIssue.objects.filter(
+            alias_used=1, book_resolved=1, source_file="update-3.xml"
+        ))
+        self.assertUsesIndex(AliasPointsToConflictingBookIssue.objects.filter(
+            book=1, scheme="ISBN-13", source_file="update-2.xml", value="1000000000001"
+        ))
+        self.assertUsesIndex(VersionUnspecifiedIssue.objects.filter(book_id="book-3", source_file="update-3.xml"))
+        self.assertUsesIndex(VersionUnspecifiedIssue.objects.filter(source_file__in=["update-3.xml"]))
+
+    def test_admin_book_search(self):
+        book_admin = BookEditionAdmin(Book, site)
+        queryset, _ = book_admin.get_search_results(None, Book.objects.order_by("-id"), "1000000001")
+        self.assertUsesIndex(queryset[:100])
+        queryset, _ = book_admin.get_search_results(None, Book.objects.order_by("-id"), '"second edition"')
+        self.assertUsesIndex(queryset[:100])
+
+    def test_api_lookups(self):
+        self.assertUsesIndex(Book.objects.filter(book_id="book-1", version="1.0").order_by("title", "version")[:1])
+        self.assertUsesIndex(
+            Book.objects.filter(aliases__scheme="ISBN-10", aliases__value="1000000001").order_by("aliases__id")[:1]
+        )
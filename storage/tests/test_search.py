@@ -0,0 +1,130 @@
+# encoding: utf-8
+
+from io import BytesIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from storage.models import Book
+from storage.resolution import alias_cache
+from storage.search import (
+    SEARCH_TABLE,
+    create_search_index,
+    rebuild_search_index,
+    search_books,
+    search_index_exists,
+    search_terms
+)
+import storage.schema
+import storage.search
+import storage.tools
+
+
+def _book_ids(books):
+    return [(book.book_id, book.version) for book in books]
+
+
+def _drop_search_index():
+    cursor = connection.cursor()
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute("DROP TRIGGER {0}_{1}".format(SEARCH_TABLE, trigger))
+    cursor.execute("DROP TABLE {0}".format(SEARCH_TABLE))
+    storage.search._indexed_databases.clear()
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+
+    def tearDown(self):
+        # Tests that drop the index are rolled back, but the record that it exists may be out of date
+        storage.search._indexed_databases.clear()
+
+    def test_search_terms(self):
+        """
+        Test that a search is read as words and quoted phrases, and that FTS5 syntax in it is searched for as text.
+        """
+        self.assertEqual(search_terms(u'python "data science" cookbook'), [u"python", u"data science", u"cookbook"])
+        self.assertEqual(search_terms(u'  ""  '), [])
+        self.assertEqual(search_books(u'title: NEAR( AND "'), [])
+        self.assertEqual(search_books(u""), [])
+
+    def test_index_follows_writes(self):
+        """
+        Test that books are found as soon as they are imported, by their new text once they change, and not at all once
+        they are deleted, whether they were written one at a time or in batches.
+        """
+        feed = """<books>
+            <book id="book-1"><title>Learning Python</title><version>1.0</version>
+            <description>A gentle introduction to programming</description></book>
+            <book id="book-2"><title>Gardening</title><version>1.0</version></book>
+        </books>"""
+        for element in storage.tools.iter_book_elements(BytesIO(feed)):
+            storage.tools.process_book_element(element, "feed.xml")
+        self.assertEqual(_book_ids(search_books(u"python")), [("book-1", "1.0")])
+        self.assertEqual(_book_ids(search_books(u"gentle introduction")), [("book-1", "1.0")])
+
+        updated_feed = feed.replace("Learning Python", "Learning Haskell")
+        storage.tools.process_book_elements(storage.tools.iter_book_elements(BytesIO(updated_feed)), "feed.xml")
+        self.assertEqual(search_books(u"python"), [])
+        self.assertEqual(_book_ids(search_books(u"haskell")), [("book-1", "1.0")])
+
+        batched_feed = feed.replace("book-2", "book-3").replace("Gardening", "Advanced gardening")
+        storage.tools.process_book_elements(storage.tools.iter_book_elements(BytesIO(batched_feed)), "feed.xml")
+        self.assertEqual(_book_ids(search_books(u"gardening")), [("book-2", "1.0"), ("book-3", "1.0")])
+
+        Book.objects.filter(book_id="book-3").delete()
+        self.assertEqual(_book_ids(search_books(u"gardening")), [("book-2", "1.0")])
+
+    def test_results_are_ranked_and_paged(self):
+        """
+        Test that matches in the title come before matches in the description, and that results can be paged.
+        """
+        Book.objects.create(book_id="book-1", title="Cooking", version="1.0", description="Recipes, mostly Italian")
+        Book.objects.create(book_id="book-2", title="Italian cooking", version="1.0", description="Recipes")
+        Book.objects.create(book_id="book-3", title="Baking", version="1.0", description="Bread")
+
+        self.assertEqual(_book_ids(search_books(u"italian")), [("book-2", "1.0"), ("book-1", "1.0")])
+        self.assertEqual(_book_ids(search_books(u"italian", limit=1, offset=1)), [("book-1", "1.0")])
+        self.assertEqual(_book_ids(search_books(u'"italian cooking"')), [("book-2", "1.0")])
+        self.assertEqual(_book_ids(search_books(u"italian bread")), [])
+
+    def test_search_without_index(self):
+        """
+        Test that searching still works, with a scan, on a database without the index.
+        """
+        Book.objects.create(book_id="book-1", title="Italian cooking", version="1.0")
+        _drop_search_index()
+
+        self.assertFalse(search_index_exists())
+        self.assertEqual(_book_ids(search_books(u"italian")), [("book-1", "1.0")])
+
+    def test_upgrade_creates_and_fills_index(self):
+        """
+        Test that a database from before the index gets it, holding the books already stored.
+        """
+        Book.objects.create(book_id="book-1", title="Italian cooking", version="1.0")
+        _drop_search_index()
+
+        stdout = BytesIO()
+        storage.schema.upgrade(stdout=stdout)
+
+        self.assertIn("Creating full-text index {0}".format(SEARCH_TABLE), stdout.getvalue())
+        self.assertEqual(_book_ids(search_books(u"italian")), [("book-1", "1.0")])
+        self.assertFalse(create_search_index(), "Assert that the index is only created once.")
+
+    def test_rebuild_command(self):
+        """
+        Test that rebuilding repairs an index that missed writes.
+        """
+        book = Book.objects.create(book_id="book-1", title="Italian cooking", version="1.0")
+        connection.cursor().execute("DROP TRIGGER {0}_update".format(SEARCH_TABLE))
+        Book.objects.filter(pk=book.pk).update(title="French cooking")
+        self.assertEqual(search_books(u"french"), [])
+
+        stdout = BytesIO()
+        call_command("rebuild_search_index", stdout=stdout)
+
+        self.assertIn("Rebuilt", stdout.getvalue())
+        self.assertEqual(_book_ids(search_books(u"french")), [("book-1", "1.0")])
+        self.assertTrue(rebuild_search_index())
@@ -0,0 +1,141 @@
+# encoding: utf-8
+
+import bz2
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import closing
+
+from django.test import TestCase
+from storage.importer import import_files
+from storage.models import AliasUsedAsBookIdIssue
+from storage.resolution import alias_cache
+from storage.sources import iter_feed_sources, lzma
+from storage.tests.test_batch import DATA_FILES, FEED, _clear_database, _dump_database
+import storage.sources
+
+
+def _strip_directories(dump):
+    """
+    Replace the source files in a database dump with the name of the file or archive member alone.
+    """
+    return dict(
+        (name, sorted(row[:-1] + (os.path.basename(row[-1].split(":")[-1]), ) for row in rows))
+        if name not in ("books", "aliases") else (name, rows)
+        for name, rows in dump.items()
+    )
+
+
+class TestSources(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read(self, filename):
+        return [(source_file, file_handle.read()) for source_file, file_handle in iter_feed_sources(filename)]
+
+    def test_compressed_feeds(self):
+        """
+        Test that single compressed feeds are decompressed as they are read, and keep their own name as source file.
+        """
+        openers = [("feed.xml.gz", gzip.GzipFile), ("feed.xml.bz2", bz2.BZ2File)]
+        if lzma is not None:
+            openers.append(("feed.xml.xz", lzma.LZMAFile))
+
+        for name, open_compressed in openers:
+            with closing(open_compressed(self._path(name), "wb")) as file_handle:
+                file_handle.write(FEED)
+            self.assertEqual(self._read(self._path(name)), [(self._path(name), FEED)])
+
+        with open(self._path("feed.xml"), "wb") as file_handle:
+            file_handle.write(FEED)
+        self.assertEqual(self._read(self._path("feed.xml")), [(self._path("feed.xml"), FEED)])
+
+    def test_archived_feeds(self):
+        """
+        Test that each XML member of zip and tar archives is read in order, named after the archive and the member.
+        """
+        archive = self._path("feeds.zip")
+        with closing(zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED)) as zip_file:
+            zip_file.writestr("b.xml", FEED)
+            zip_file.writestr("README.txt", "Not a feed")
+            zip_file.writestr("nested/a.xml", FEED)
+        self.assertEqual(
+            self._read(archive),
+            [(archive + ":b.xml", FEED), (archive + ":nested/a.xml", FEED)],
+            "Assert that members are read in archive order and that other files are skipped."
+        )
+
+        with open(self._path("feed.xml"), "wb") as file_handle:
+            file_handle.write(FEED)
+        for name, mode in (("feeds.tar", "w"), ("feeds.tar.gz", "w:gz"), ("feeds.tbz2", "w:bz2")):
+            with closing(tarfile.open(self._path(name), mode)) as tar_file:
+                tar_file.add(self._path("feed.xml"), "feed.xml")
+                tar_file.add(self._path("feed.xml"), "notes.txt")
+            self.assertEqual(self._read(self._path(name)), [(self._path(name) + ":feed.xml", FEED)])
+
+    def test_xz_tarball_is_closed(self):
+        """
+        Test that the decompressed stream of a .tar.xz, which tarfile does not close, is closed once it has been read.
+        """
+        with open(self._path("feed.xml"), "wb") as file_handle:
+            file_handle.write(FEED)
+        with closing(tarfile.open(self._path("feeds.tar.xz"), "w")) as tar_file:
+            tar_file.add(self._path("feed.xml"), "feed.xml")
+
+        # Stand in for the xz decompressor with the file itself, which was written uncompressed
+        opened = []
+
+        def open_uncompressed(filename):
+            opened.append(open(filename, "rb"))
+            return opened[-1]
+
+        open_xz = storage.sources._open_xz
+        storage.sources._open_xz = open_uncompressed
+        try:
+            self.assertEqual(self._read(self._path("feeds.tar.xz")), [(self._path("feeds.tar.xz") + ":feed.xml", FEED)])
+        finally:
+            storage.sources._open_xz = open_xz
+
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+    def test_import_archive_matches_plain_files(self):
+        """
+        Test that importing the data files from a zip archive and a gzipped tarball writes the same books, aliases and
+        issues as importing them unpacked, with issues pointing at the archive members.
+        """
+        import_files(DATA_FILES, stdout=open(os.devnull, "w"))
+        expected = _strip_directories(_dump_database())
+        self.assertTrue(expected["alias_as_id"], "Assert that the data files raise issues.")
+
+        for name, mode in (("data.zip", None), ("data.tar.gz", "w:gz")):
+            _clear_database()
+            alias_cache.clear()
+
+            archive = self._path(name)
+            if mode is None:
+                with closing(zipfile.ZipFile(archive, "w")) as zip_file:
+                    for filename in DATA_FILES:
+                        zip_file.write(filename, os.path.basename(filename))
+            else:
+                with closing(tarfile.open(archive, mode)) as tar_file:
+                    for filename in DATA_FILES:
+                        tar_file.add(filename, os.path.basename(filename))
+
+            failures = import_files([archive], stdout=open(os.devnull, "w"))
+            self.assertEqual(failures, [])
+            self.assertEqual(_strip_directories(_dump_database()), expected)
+            self.assertTrue(
+                all(issue.source_file.startswith(archive + ":") for issue in AliasUsedAsBookIdIssue.objects.all()),
+                "Assert that issues are traced back to the archive member they were raised by."
+            )
@@ -0,0 +1,84 @@
+# encoding: utf-8
+
+from io import BytesIO
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import TestCase
+from django.test.utils import override_settings
+from storage.importer import import_files
+from storage.models import Book
+from storage.resolution import alias_cache
+from storage.sqlite import DEFAULT_BULK_LOAD_PRAGMAS, BulkLoadProfile, bulk_load_pragmas
+from storage.tests.test_batch import DATA_FILES
+
+
+def pragma(name):
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA {0}".format(name))
+    return cursor.fetchone()[0]
+
+
+class TestBulkLoadProfile(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+
+    def test_pragmas(self):
+        """
+        Test that journal_mode comes first, as the other PRAGMAs apply to the journal it sets, and that the setting
+        overrides and adds to the defaults.
+        """
+        self.assertEqual(bulk_load_pragmas()[0], ("journal_mode", "WAL"))
+        self.assertEqual(dict(bulk_load_pragmas()), DEFAULT_BULK_LOAD_PRAGMAS)
+
+        with override_settings(SQLITE_BULK_LOAD_PRAGMAS={"cache_size": -1024, "foreign_keys": "OFF"}):
+            pragmas = dict(bulk_load_pragmas())
+        self.assertEqual(pragmas["cache_size"], -1024)
+        self.assertEqual(pragmas["foreign_keys"], "OFF")
+        self.assertEqual(pragmas["mmap_size"], DEFAULT_BULK_LOAD_PRAGMAS["mmap_size"])
+
+    def test_profile_is_applied_and_put_back(self):
+        """
+        Test that the connection has the profile's settings within the block and its own back after it.
+        """
+        cache_size, synchronous = pragma("cache_size"), pragma("synchronous")
+
+        with BulkLoadProfile():
+            self.assertEqual(pragma("cache_size"), DEFAULT_BULK_LOAD_PRAGMAS["cache_size"])
+            self.assertEqual(pragma("synchronous"), synchronous, "Assert that the test's transaction was respected.")
+
+        self.assertEqual(pragma("cache_size"), cache_size)
+
+    def test_disabled_profile_does_nothing(self):
+        """
+        Test that a profile that is not enabled leaves the connection alone.
+        """
+        cache_size = pragma("cache_size")
+        with BulkLoadProfile(enabled=False):
+            self.assertEqual(pragma("cache_size"), cache_size)
+
+    def test_connections_opened_within_the_block_are_configured(self):
+        """
+        Test that a connection created while the block runs gets the profile too.
+        """
+        with BulkLoadProfile():
+            connection.cursor().execute("PRAGMA cache_size = -2000")
+            connection_created.send(sender=connection.__class__, connection=connection)
+            self.assertEqual(pragma("cache_size"), DEFAULT_BULK_LOAD_PRAGMAS["cache_size"])
+
+        # Once the block is over, connections are left as they are opened
+        connection.cursor().execute("PRAGMA cache_size = -2000")
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(pragma("cache_size"), -2000)
+
+    def test_import_under_profile(self):
+        """
+        Test that importing under the profile stores the books, and leaves statistics for the query planner.
+        """
+        with BulkLoadProfile():
+            self.assertEqual(import_files(DATA_FILES, stdout=BytesIO()), [])
+
+        self.assertTrue(Book.objects.exists())
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*) FROM sqlite_stat1")
+        self.assertGreater(cursor.fetchone()[0], 0, "Assert that ANALYZE ran.")
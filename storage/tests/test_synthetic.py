@@ -0,0 +1,82 @@
+# encoding: utf-8
+
+from io import BytesIO
+
+from django.test import TestCase
+from lxml import etree
+from storage.benchmark import benchmark_import
+from storage.models import AliasPointsToConflictingBookIssue, AliasUsedAsBookIdIssue, Book, VersionUnspecifiedIssue
+from storage.profiling import QueryCounter
+from storage.resolution import alias_cache
+from storage.synthetic import generate_feed, isbn10_check_digit, isbn13_check_digit
+
+
+def _feed(books, **options):
+    file_handle = BytesIO()
+    generate_feed(file_handle, books, **options)
+    return file_handle.getvalue()
+
+
+class TestSynthetic(TestCase):
+    def setUp(self):
+        alias_cache.clear()
+
+    def test_check_digits(self):
+        """
+        Test the ISBN check digits against published ISBNs.
+        """
+        self.assertEqual(isbn10_check_digit("030640615"), "2")
+        self.assertEqual(isbn10_check_digit("080442957"), "X")
+        self.assertEqual(isbn13_check_digit("978030640615"), "7")
+
+    def test_generate_feed_is_reproducible(self):
+        """
+        Test that the same seed writes the same feed, and a different one a different feed.
+        """
+        self.assertEqual(_feed(200, seed=1), _feed(200, seed=1))
+        self.assertNotEqual(_feed(200, seed=1), _feed(200, seed=2))
+
+        books = etree.fromstring(_feed(200, seed=1)).findall("book")
+        self.assertEqual(len(books), 200)
+        self.assertTrue(
+            all(len(book.findall("aliases/alias")) >= 2 for book in books),
+            "Assert that every book has the requested number of aliases."
+        )
+
+    def test_generated_feed_reproduces_update_problems(self):
+        """
+        Test that importing a generated feed runs into every problem the rates ask for.
+        """
+        result = benchmark_import(
+            300,
+            seed=3,
+            batch_size=50,
+            version_churn=0.3,
+            missing_version_rate=0.1,
+            alias_as_id_rate=0.1,
+            conflicting_alias_rate=0.1
+        )
+
+        self.assertEqual(result.books, 300)
+        self.assertGreater(result.queries, 0)
+        self.assertGreater(Book.objects.exclude(version="1.0").count(), 0, "Assert that some books had new editions.")
+        self.assertGreater(VersionUnspecifiedIssue.objects.count(), 0)
+        self.assertGreater(AliasUsedAsBookIdIssue.objects.count(), 0)
+        self.assertGreater(AliasPointsToConflictingBookIssue.objects.count(), 0)
+
+    def test_benchmark_counts_alias_cache_lookups(self):
+        """
+        Test that the benchmark reports how many alias lookups the alias cache answered.
+        """
+        result = benchmark_import(100, seed=1, version_churn=0.5)
+        self.assertGreater(result.alias_cache_hits, 0)
+        self.assertGreater(result.alias_cache_misses, 0)
+
+    def test_query_counter(self):
+        """
+        Test that queries are counted without DEBUG recording them.
+        """
+        with QueryCounter() as counter:
+            Book.objects.count()
+            list(Book.objects.all())
+        self.assertEqual(counter.count, 2)
@@ -2,7 +2,11 @@
 # Created by David Rideout <drideout@safaribooksonline.com> on 2/7/14 5:01 PM
 # Copyright (c) 2013 Safari Books Online, LLC. All rights reserved.
 
+from io import BytesIO
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from lxml import etree
 from storage.models import (
     Alias,
@@ -12,11 +16,14 @@ from storage.models import (
     Book,
     VersionUnspecifiedIssue
 )
+from storage.resolution import alias_cache
 import storage.tools
 
 
 class TestTools(TestCase):
     def setUp(self):
+        alias_cache.clear()
+
         book1 = Book.objects.create(
             book_id="book-1",
             title="Book 1",
@@ -210,4 +217,135 @@ class TestTools(TestCase):
             version_issue.source_file,
             "book-version.xml",
             "Assert that the version imputation was properly recorded."
-        )
\ No newline at end of file
+        )
+
+    def test_storage_tools_iter_book_elements_single_book(self):
+        """
+        Test that a file holding a single <book> as its root still yields that book.
+        """
+        xml_string = """<book id="book-3"><title>Book 3</title><version>1.0</version></book>"""
+
+        elements = list(storage.tools.iter_book_elements(BytesIO(xml_string)))
+        self.assertEqual(len(elements), 1, "Assert that the root book element was yielded.")
+
+    def test_storage_tools_iter_book_elements_feed(self):
+        """
+        Test streaming a feed that wraps several books, and that books are released once they have been processed.
+        """
+        xml_string = """
+        <books>
+            <book id="book-3">
+                <title>Book 3</title>
+                <version>1.0</version>
+                <aliases>
+                    <alias scheme="ISBN-10" value="1000000003"/>
+                </aliases>
+            </book>
+            <!-- a comment between books -->
+            <book id="book-4">
+                <title>Book 4</title>
+                <aliases>
+                    <alias scheme="ISBN-10" value="1000000004"/>
+                </aliases>
+            </book>
+        </books>
+        """
+
+        seen = []
+        for element in storage.tools.iter_book_elements(BytesIO(xml_string)):
+            storage.tools.process_book_element(book_element=element, filename="feed.xml")
+            seen.append(element)
+            self.assertEqual(
+                element.getparent().index(element),
+                0,
+                "Assert that books before the current one have been dropped from the tree."
+            )
+
+        self.assertEqual(len(seen[0]), 0, "Assert that the first book was cleared after being processed.")
+        self.assertEqual(Book.objects.get(book_id="book-3").title, "Book 3")
+        self.assertEqual(Book.objects.get(book_id="book-4").version, "1.0")
+        self.assertEqual(Alias.objects.get(scheme="ISBN-10", value="1000000004").book.book_id, "book-4")
+
+    def test_storage_tools_process_book_element_infers_version_after_latest(self):
+        """
+        Test that a missing version is inferred from the latest version on file, comparing versions as numbers.
+        """
+        book1 = Book.objects.get(book_id="book-1")
+        for version in ("2.0", "10.0", "9.0"):
+            Book.objects.create(book_id="book-1", title=book1.title, version=version)
+
+        xml_string = """
+        <book id="book-1">
+            <title>Book 1</title>
+        </book>
+        """
+
+        xml = etree.fromstring(xml_string)
+        storage.tools.process_book_element(book_element=xml, filename="book-version.xml")
+
+        self.assertTrue(Book.objects.filter(book_id="book-1", version="11.0").exists())
+
+    def test_storage_tools_process_book_element_infers_version_after_textual_edition(self):
+        """
+        Test that a textual edition on file does not stop us from inferring the next version.
+        """
+        Book.objects.create(book_id="book-2", title="Book 2", version="3rd ed.")
+
+        xml_string = """
+        <book id="book-2">
+            <title>Book 2</title>
+        </book>
+        """
+
+        xml = etree.fromstring(xml_string)
+        storage.tools.process_book_element(book_element=xml, filename="book-version.xml")
+
+        self.assertTrue(Book.objects.filter(book_id="book-2", version="4.0").exists())
+
+    def test_storage_tools_process_book_element_matches_isbns_in_any_form(self):
+        """
+        Test that an ISBN-13 used as the book ID finds the book holding the same ISBN as an ISBN-10, with one alias
+        lookup, and that an alias written in another form is neither added twice nor missed as a conflict.
+        """
+        book3 = Book.objects.create(book_id="book-3", title="Book 3", version="1.0")
+        isbn10 = Alias.objects.create(book=book3, scheme="ISBN-10", value="0-306-40615-2")
+        self.assertEqual(isbn10.canonical_value, "9780306406157")
+
+        xml_string = """
+        <book id="978-0-306-40615-7">
+            <title>Book 3</title>
+            <version>1.0</version>
+            <aliases>
+                <alias scheme="ISBN-10" value="0306406152"/>
+                <alias scheme="ISBN-13" value="9780306406157"/>
+            </aliases>
+        </book>
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            storage.tools.process_book_element(book_element=etree.fromstring(xml_string), filename="book-isbn.xml")
+        isbn_lookups = [query for query in context.captured_queries if '"storage_alias"."scheme" IN' in query["sql"]]
+        self.assertEqual(len(isbn_lookups), 1, "Assert that every form of the ISBN was found by the same lookup.")
+
+        self.assertEqual(Book.objects.filter(book_id="book-3").count(), 1)
+        self.assertEqual(AliasUsedAsBookIdIssue.objects.get(source_file="book-isbn.xml").alias_used, isbn10)
+        self.assertEqual(
+            sorted(book3.aliases.values_list("scheme", "value")),
+            [("ISBN-10", "0-306-40615-2"), ("ISBN-13", "9780306406157")],
+            "Assert that the ISBN-10 was not added again in another form."
+        )
+
+        xml_string = """
+        <book id="book-1">
+            <title>Book 1</title>
+            <version>1.0</version>
+            <aliases>
+                <alias scheme="ISBN-13" value="978-0-306-40615-7"/>
+            </aliases>
+        </book>
+        """
+
+        storage.tools.process_book_element(book_element=etree.fromstring(xml_string), filename="book-conflict.xml")
+
+        self.assertTrue(AliasPointsToConflictingBookIssue.objects.filter(book=book3, source_file="book-conflict.xml"))
+        self.assertFalse(Alias.objects.filter(book__book_id="book-1", scheme="ISBN-13").exists())
@@ -0,0 +1,174 @@
+# encoding: utf-8
+
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from storage.book_cache import book_cache
+from storage.models import Alias, Book
+
+
+class TestViews(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(book_id="book-1", title="Book 1", version="1.0")
+        self.latest = Book.objects.create(book_id="book-1", title="Book 1", version="10.0")
+        Book.objects.create(book_id="book-1", title="Book 1", version="2.0")
+        Alias.objects.create(book=self.book, scheme="ISBN-10", value="1000000001")
+        Alias.objects.create(book=self.latest, scheme="ISBN-13", value="1000000000001")
+        book_cache.clear()
+
+    def test_book_by_id(self):
+        """
+        Test that a book ID finds the latest version, and a book ID and version that version.
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("storage_book", args=["book-1"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        data = json.loads(response.content)
+        self.assertEqual(data["version"], "10.0", "Assert that the versions are compared as numbers.")
+        self.assertEqual(data["aliases"], [{"scheme": "ISBN-13", "value": "1000000000001"}])
+
+        response = self.client.get(reverse("storage_book_version", args=["book-1", "1"]))
+        self.assertEqual(json.loads(response.content)["version"], "1.0")
+
+        response = self.client.get(reverse("storage_book_version", args=["book-1", "3.0"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_book_by_alias(self):
+        """
+        Test that an alias finds the book it belongs to.
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("storage_alias", args=["ISBN-10", "1000000001"]))
+        self.assertEqual(json.loads(response.content)["version"], "1.0")
+
+        # The same ISBN, written as a hyphenated ISBN-13
+        response = self.client.get(reverse("storage_alias", args=["ISBN-13", "978-1-00-000000-9"]))
+        self.assertEqual(json.loads(response.content)["version"], "1.0")
+
+        response = self.client.get(reverse("storage_alias", args=["Proprietary", "1000000001"]))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("error", json.loads(response.content))
+
+    def test_conditional_requests(self):
+        """
+        Test that a client holding the current version gets a 304 from the cache, without a query, and a changed book
+        is sent in full.
+        """
+        url = reverse("storage_book", args=["book-1"])
+        response = self.client.get(url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        self.latest.title = "Book 1, revised"
+        self.latest.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        self.latest.aliases.all().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200, "Assert that deleting an alias changes the book it belonged to.")
+        self.assertEqual(json.loads(response.content)["aliases"], [])
+
+    def test_read_only(self):
+        """
+        Test that the API does not accept writes.
+        """
+        response = self.client.post(reverse("storage_book", args=["book-1"]))
+        self.assertEqual(response.status_code, 405)
+
+    def _resolve(self, identifiers):
+        return self.client.post(
+            reverse("storage_resolve"),
+            json.dumps({"identifiers": identifiers}),
+            content_type="application/json"
+        )
+
+    def test_resolve_books(self):
+        """
+        Test that bulk resolution follows the trust rules of the import and flags the same resolutions.
+        """
+        other = Book.objects.create(book_id="book-2", title="Book 2", version="1.0")
+        Alias.objects.create(book=other, scheme="Proprietary", value="ABC")
+
+        response = self._resolve([
+            "book-1",
+            "1000000001",
+            "ABC",
+            ["ISBN-13", "1000000000001"],
+            {"scheme": "Proprietary", "value": "ABC"},
+            "unknown",
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)["results"]
+
+        self.assertEqual(
+            [(result["book"] or {}).get("version") for result in results],
+            ["10.0", "1.0", "1.0", "10.0", "1.0", None]
+        )
+        self.assertEqual([result["trusted"] for result in results], [True, True, False, True, False, False])
+        self.assertEqual(
+            [result["flag"] for result in results],
+            [
+                None,
+                "alias_used_as_book_id",
+                "alias_used_to_resolve_book_id",
+                None,
+                "alias_used_to_resolve_book_id",
+                None
+            ]
+        )
+        self.assertEqual(results[2]["book"]["book_id"], "book-2")
+
+    def test_resolve_books_runs_constant_queries(self):
+        """
+        Test that resolving a hundred identifiers costs the same two queries as resolving one.
+        """
+        with self.assertNumQueries(2):
+            self._resolve(["1000000001"])
+        with self.assertNumQueries(2):
+            self._resolve(["{0}".format(1000000000 + number) for number in range(100)] + [["ISBN-13", "1"]])
+
+    def test_resolve_books_rejects_bad_requests(self):
+        """
+        Test that malformed bodies are rejected with a 400.
+        """
+        self.assertEqual(self._resolve([["ISBN-10"]]).status_code, 400)
+        self.assertEqual(self._resolve("1000000001").status_code, 400)
+        response = self.client.post(reverse("storage_resolve"), "nope", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse("storage_resolve")).status_code, 405)
+
+    def test_search(self):
+        """
+        Test that a search lists the matching books, best first, from two queries, and that bad requests get a 400.
+        """
+        Book.objects.create(book_id="book-2", title="Cooking", version="1.0", description="Mostly Italian recipes")
+        Book.objects.create(book_id="book-3", title="Italian cooking", version="1.0")
+
+        # The first search checks that the index exists
+        self.client.get(reverse("storage_search"), {"q": "cooking"})
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("storage_search"), {"q": "italian"})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data["query"], "italian")
+        self.assertEqual([result["book_id"] for result in data["results"]], ["book-3", "book-2"])
+
+        response = self.client.get(reverse("storage_search"), {"q": "italian", "limit": 1, "offset": 1})
+        self.assertEqual([result["book_id"] for result in json.loads(response.content)["results"]], ["book-2"])
+
+        for params in ({}, {"q": " "}, {"q": "italian", "limit": 0}, {"q": "italian", "offset": "-1"}):
+            response = self.client.get(reverse("storage_search"), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", json.loads(response.content))
@@ -2,14 +2,40 @@
 # Created by David Rideout <drideout@safaribooksonline.com> on 2/7/14 4:58 PM
 # Copyright (c) 2013 Safari Books Online, LLC. All rights reserved.
 
+from collections import namedtuple
+
+from lxml import etree
+from storage.batch import BOOK_CREATED, BOOK_UNCHANGED, BOOK_UPDATED, WriteCounts, process_book_records
+from storage.isbn import ISBN_SCHEMES, canonical_value
+from storage.issues import issue_recorder
 from storage.models import (
-    Alias,
     AliasPointsToConflictingBookIssue,
     AliasUsedAsBookIdIssue,
     AliasUsedToResolveBookIdIssue,
     Book,
-    VersionUnspecifiedIssue
+    VersionUnspecifiedIssue,
+    version_number
 )
+from storage.resolution import alias_cache, lookup_alias
+
+# How many book records :func:`process_book_elements` resolves against one in-memory snapshot
+DEFAULT_BATCH_SIZE = 500
+
+
+BookRecord = namedtuple("BookRecord", ["book_id", "version", "title", "description", "aliases", "source_file"])
+
+
+def _record_issue(model, **kwargs):
+    """
+    Record an issue for manual review, once per distinct set of values. During an import, issues are buffered and
+    written together when the file is done (see :class:`storage.issues.IssueRecorder`).
+
+    :param model:
+        The issue model, such as :class:`VersionUnspecifiedIssue`.
+    :param kwargs:
+        The field values of the issue.
+    """
+    issue_recorder.record(model, **kwargs)
 
 
 def _fetch_book_id_by_aliases(aliases, source_file):
@@ -26,52 +52,52 @@ def _fetch_book_id_by_aliases(aliases, source_file):
     """
     for alias in aliases:
         scheme, value = alias.get("scheme"), alias.get("value")
-        existing_alias = Alias.objects.filter(scheme=scheme, value=value).first()
+        existing_alias = lookup_alias(scheme, value)
 
         # If we match with an existing alias, use it to get the book ID and mark our decision with this book and which
         # source file introduced the issue
         if existing_alias is not None:
-            alias_resolution, _ = AliasUsedToResolveBookIdIssue.objects.get_or_create(
-                alias_used=existing_alias,
-                book_resolved=existing_alias.book,
+            _record_issue(
+                AliasUsedToResolveBookIdIssue,
+                alias_used_id=existing_alias.alias_pk,
+                book_resolved_id=existing_alias.book_pk,
                 source_file=source_file
             )
-            alias_resolution.save()
 
-            return existing_alias.book.book_id
+            return existing_alias.book_id
 
     return None
 
 
-def _fetch_book_id_by_scheme(scheme, source_file, value):
+def _fetch_book_id_by_isbn(source_file, value):
     """
-    Attempt to resolve a book ID by a particular alias scheme (i.e. ISBN-10, ISBN-13). This is for when we are checking
-    if the given book ID has been erroneously marked as an alias like an ISBN-10 instead of the book ID.
+    Attempt to resolve a book ID as an ISBN. This is for when we are checking if the given book ID has been erroneously
+    marked as an alias like an ISBN-10 instead of the book ID. An ISBN is matched in any form and against both ISBN
+    schemes (see :func:`storage.resolution.lookup_alias`), so one lookup covers ISBN-10 and ISBN-13.
 
-    :param scheme:
-        The given scheme (such as ISBN-10).
     :param source_file:
         The source file we are receiving updates from in case we need to record problems.
     :param value:
-        The value for the scheme (such as 1000000001).
+        The book ID that may be an ISBN (such as 1000000001).
 
     :return:
         The book ID if one is found, otherwise None.
     """
-    alias = Alias.objects.filter(scheme=scheme, value=value).first()
+    # Both ISBN schemes share one identity, so either scheme finds an ISBN-10 or ISBN-13 in any form
+    alias = lookup_alias(ISBN_SCHEMES[0], value)
 
     # If a book alias (i.e. an ISBN-10) is being used as the book ID, the updates have shown us that this cannot be
     # reliably used as a proxy for the book ID. What we do instead is mark that the book ID is actually an alias and
     # that the file needs manual review so we don't corrupt any data. For further discussion, see
     # :class:`AliasUsedAsBookIdIssue`.
     if alias is not None:
-        alias_error, _ = AliasUsedAsBookIdIssue.objects.get_or_create(
-            alias_used=alias,
-            book_resolved=alias.book,
+        _record_issue(
+            AliasUsedAsBookIdIssue,
+            alias_used_id=alias.alias_pk,
+            book_resolved_id=alias.book_pk,
             source_file=source_file
         )
-        alias_error.save()
-        return alias.book.book_id
+        return alias.book_id
 
     return None
 
@@ -84,6 +110,9 @@ def _infer_book_version(book_id, filename, version):
     other versions of the book. If there are, we sort them by their version number and increment the newest version we
     have on file.
 
+    Finding the latest version is a single query ordered by :attr:`Book.version_key`, which also copes with
+    versions that are not plain numbers (see :func:`storage.models.version_sort_key`).
+
     We also mark whenever we have to guess by incrementing the version number of an existing version we have. We do this
     bookkeeping to mark our version resolutions should further updates prove that this was not the right decision. For
     further discussion, see :class:`VersionUnspecifiedIssue`.
@@ -104,17 +133,15 @@ def _infer_book_version(book_id, filename, version):
     except (TypeError, ValueError):
         # Otherwise, get the version from an existing book we have in the system and again, mark that we made this
         # inference of the version so we can go back if need be
-        version_missing_error, _ = VersionUnspecifiedIssue.objects.get_or_create(book_id=book_id, source_file=filename)
-        version_missing_error.save()
+        _record_issue(VersionUnspecifiedIssue, book_id=book_id, source_file=filename)
 
-        existing_books = list(Book.objects.all().filter(book_id=book_id))
+        latest_book = Book.objects.filter(book_id=book_id).order_by("-version_key").only("version").first()
         # If absolutely no books exist with this ID, mark it as 1.0
-        if len(existing_books) == 0:
+        if latest_book is None:
             return "1.0"
 
-        # Otherwise, find the latest version and return the version + 1
-        existing_books.sort(key=lambda x: -float(x.version))
-        return str(float(existing_books[-1].version) + 1)
+        # Otherwise, take the latest version and return the version + 1
+        return str(version_number(latest_book.version) + 1)
 
 
 def _process_book_aliases(aliases, book, book_id, filename):
@@ -134,26 +161,38 @@ def _process_book_aliases(aliases, book, book_id, filename):
         The resolved identifier for the book.
     :param filename:
         The source file we are receiving updates from in case we need to record problems.
+
+    :return:
+        Whether any alias was added to the book.
     """
+    added = False
     for alias in aliases:
         scheme = alias.get("scheme")
         value = alias.get("value")
 
-        alias = Alias.objects.filter(scheme=scheme, value=value).first()
+        existing_alias = lookup_alias(scheme, value)
         # If the alias already exists, check that it points to this book. If it doesn't, we need to flag this for
         # manual review.
-        if alias is not None and alias.book.book_id != book_id:
-            conflict_error, _ = AliasPointsToConflictingBookIssue.objects.get_or_create(
-                book=alias.book,
+        if existing_alias is not None and existing_alias.book_id != book_id:
+            _record_issue(
+                AliasPointsToConflictingBookIssue,
+                book_id=existing_alias.book_pk,
                 scheme=scheme,
                 source_file=filename,
                 value=value
             )
-            conflict_error.save()
             continue
 
-        book.aliases.get_or_create(scheme=scheme, value=value)
-    book.save()
+        new_alias, created = book.aliases.get_or_create(
+            scheme=scheme,
+            canonical_value=canonical_value(scheme, value),
+            defaults={"value": value}
+        )
+        added = added or created
+
+        # The first alias with this scheme and value is the one resolution will find from now on
+        if existing_alias is None:
+            alias_cache.add(scheme, value, new_alias.pk, book.pk, book_id)
 
     # If the update has missing aliases, go ahead and use fill in any missing ones from a previous version of the book
     existing_book = Book.objects.filter(book_id=book_id).first()
@@ -163,9 +202,14 @@ def _process_book_aliases(aliases, book, book_id, filename):
     )
 
     for scheme, value in missing_aliases:
-        book.aliases.get_or_create(scheme=scheme, value=value)
+        _, created = book.aliases.get_or_create(
+            scheme=scheme,
+            canonical_value=canonical_value(scheme, value),
+            defaults={"value": value}
+        )
+        added = added or created
 
-    book.save()
+    return added
 
 
 def _resolve_book_id(aliases, book_id, filename):
@@ -177,7 +221,7 @@ def _resolve_book_id(aliases, book_id, filename):
 
     Check that an ISBN-10 or ISBN-13 exist with the given ID. If one does, resolve use the book ID of the book that the
     ISBN alias points to. ISBN is a universal, non-proprietary identifier, so we have some confidence in making this
-    resolution.
+    resolution. The ID may be either form of the ISBN, with or without hyphens, and is found with a single lookup.
 
     Check the aliases listed in the book element for a match. If one matches, use its identifier. This is less reliable
     as we know aliases can be flaky, but is appropriate given the data we have seen and does the job adequately.
@@ -199,30 +243,129 @@ def _resolve_book_id(aliases, book_id, filename):
 
     # If there is no existing book or alias to help us resolve, default to a new book ID.
     return \
-        _fetch_book_id_by_scheme(scheme="ISBN-10", source_file=filename, value=book_id) or \
-        _fetch_book_id_by_scheme(scheme="ISBN-13", source_file=filename, value=book_id) or \
+        _fetch_book_id_by_isbn(source_file=filename, value=book_id) or \
         _fetch_book_id_by_aliases(aliases=aliases, source_file=filename) or \
         book_id
 
 
+def iter_book_elements(file_handle):
+    """
+    Stream the <book> elements out of an XML feed. A feed is either a single <book> document, like the files under
+    data/, or a larger document from a publisher wrapping any number of <book> elements. We walk the document with
+    iterparse rather than building the whole tree, and once the caller is done with an element we clear it and drop
+    any siblings that came before it, so memory use stays flat no matter how many books the feed holds.
+
+    :param file_handle:
+        The open XML file.
+
+    :return:
+        A generator of <book> elements, in document order.
+    """
+    for _, element in etree.iterparse(file_handle, events=("end",), tag="book"):
+        # Anything before this book in the document (earlier, already cleared books and comments) is no longer needed
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+        yield element
+        element.clear()
+
+
 def process_book_element(book_element, filename):
     """
     Process a book element into the database.
 
+    Feeds are re-sent whole, so most of their books are already stored exactly as they are. Saving those anyway would
+    bump their modified time, and anything asking what changed since some point in time would get the whole catalog
+    back. So the element is compared with the stored book and its aliases first: a new book is inserted with its
+    fields, an existing book is saved once if its title, description or aliases changed, and not at all otherwise.
+
     :param book_element:
         The XML book element.
     :param filename:
         The filename of the XML - this is to mark files that have problems and need review.
+
+    :return:
+        What happened to the book: :data:`storage.batch.BOOK_CREATED`, :data:`storage.batch.BOOK_UPDATED` or
+        :data:`storage.batch.BOOK_UNCHANGED`.
     """
     book_id = book_element.get("id")
     aliases = book_element.xpath("aliases/alias")
+    title = book_element.findtext("title")
+    description = book_element.findtext("description")
 
     resolved_book_id = _resolve_book_id(aliases, book_id, filename)
     version = _infer_book_version(resolved_book_id, filename, book_element.findtext("version"))
 
-    book, _ = Book.objects.get_or_create(book_id=resolved_book_id, version=version)
-    book.title = book_element.findtext("title")
-    book.description = book_element.findtext("description")
-    _process_book_aliases(aliases, book, resolved_book_id, filename)
+    book, created = Book.objects.get_or_create(
+        book_id=resolved_book_id,
+        version=version,
+        defaults={"title": title, "description": description}
+    )
+    changed = not created and (book.title, book.description) != (title, description)
+    if changed:
+        # Saved before the aliases, which look up the first version of the book by title
+        book.title = title
+        book.description = description
+        book.save()
+
+    if _process_book_aliases(aliases, book, resolved_book_id, filename) and not created and not changed:
+        # New aliases change the book too, so its modified time moves on
+        book.save()
+        changed = True
+
+    if created:
+        return BOOK_CREATED
+    return BOOK_UPDATED if changed else BOOK_UNCHANGED
+
+
+def read_book_element(book_element, filename):
+    """
+    Copy what we need out of a book element into a plain :class:`BookRecord`. Unlike the element, the record stays
+    usable after :func:`iter_book_elements` has cleared the element, so records can be collected into batches.
+
+    :param book_element:
+        The XML book element.
+    :param filename:
+        The filename of the XML - this is to mark files that have problems and need review.
+
+    :return:
+        The :class:`BookRecord` for the element.
+    """
+    return BookRecord(
+        book_id=book_element.get("id"),
+        version=book_element.findtext("version"),
+        title=book_element.findtext("title"),
+        description=book_element.findtext("description"),
+        aliases=tuple((alias.get("scheme"), alias.get("value")) for alias in book_element.xpath("aliases/alias")),
+        source_file=filename
+    )
+
+
+def process_book_elements(book_elements, filename, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Process many book elements into the database in batches. This produces the same books, aliases and issues as
+    calling :func:`process_book_element` on each element in turn, but each batch is resolved against an in-memory
+    snapshot loaded with a few IN queries and written back with bulk inserts (see :class:`storage.batch.BookSnapshot`),
+    rather than costing dozens of queries per book.
+
+    :param book_elements:
+        An iterable of XML book elements, such as :func:`iter_book_elements`.
+    :param filename:
+        The filename of the XML - this is to mark files that have problems and need review.
+    :param batch_size:
+        How many books to resolve and write together.
 
-    book.save()
\ No newline at end of file
+    :return:
+        The :class:`storage.batch.WriteCounts` of every batch together.
+    """
+    counts = WriteCounts()
+    batch = []
+    for book_element in book_elements:
+        batch.append(read_book_element(book_element, filename))
+        if len(batch) >= batch_size:
+            counts += process_book_records(batch)
+            batch = []
+
+    if batch:
+        counts += process_book_records(batch)
+    return counts
@@ -0,0 +1,11 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns(
+    "storage.views",
+    url(r"^books/(?P<book_id>[^/]+)/$", "book_by_id", name="storage_book"),
+    url(r"^books/(?P<book_id>[^/]+)/(?P<version>[^/]+)/$", "book_by_id", name="storage_book_version"),
+    url(r"^resolve/$", "resolve_books", name="storage_resolve"),
+    url(r"^changes/$", "changes", name="storage_changes"),
+    url(r"^search/$", "search", name="storage_search"),
+    url(r"^aliases/(?P<scheme>[^/]+)/(?P<value>[^/]+)/$", "book_by_alias", name="storage_alias"),
+)
@@ -1,3 +1,182 @@
-from django.shortcuts import render
+# encoding: utf-8
 
-# Create your views here.
+import json
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+
+from storage.book_cache import book_cache
+from storage.changes import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, changes_since, format_cursor, parse_cursor
+from storage.lookups import aliases_of, find_book, find_book_by_alias, normalize_version, resolve_identifiers
+from storage.search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, search_books
+from storage.serializers import serialize_book, serialize_change, serialize_resolution
+
+# The most identifiers a single bulk resolution request may ask for
+MAX_BULK_IDENTIFIERS = 1000
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), content_type="application/json", status=status)
+
+
+def _not_modified(request, etag, last_modified):
+    """
+    Whether a conditional request already has the current version. As in RFC 7232, If-None-Match is used when
+    given, and If-Modified-Since otherwise.
+    """
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return "*" in etags or etag in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def book_response(request, document, not_found):
+    """
+    Serve a book found by one of the lookups, answering conditional requests for an unchanged book with a 304.
+
+    :param document:
+        The :class:`storage.book_cache.CachedBook` of the book, or None if there is no such book.
+    """
+    if document is None:
+        return json_response({"error": not_found}, status=404)
+
+    if _not_modified(request, document.etag, document.last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(document.body, content_type="application/json")
+
+    response["ETag"] = quote_etag(document.etag)
+    response["Last-Modified"] = http_date(document.last_modified)
+    return response
+
+
+@require_safe
+def book_by_id(request, book_id, version=None):
+    """
+    The latest version of a book, or the given version, from :data:`storage.book_cache.book_cache` when it is there.
+    """
+    if version is None:
+        not_found = u"No book with ID {0}".format(book_id)
+    else:
+        version = normalize_version(version)
+        not_found = u"No version {0} of book {1}".format(version, book_id)
+
+    document = book_cache.get_book(book_id, version)
+    if document is None:
+        book = find_book(book_id, version)
+        if book is not None:
+            document = book_cache.add(book, aliases_of(book), latest=version is None)
+    return book_response(request, document, not_found)
+
+
+@require_safe
+def book_by_alias(request, scheme, value):
+    """
+    The book an alias, such as an ISBN, belongs to, from :data:`storage.book_cache.book_cache` when it is there.
+    """
+    document = book_cache.get_alias(scheme, value)
+    if document is None:
+        book = find_book_by_alias(scheme, value)
+        if book is not None:
+            document = book_cache.add(book, aliases_of(book), alias=(scheme, value))
+    return book_response(request, document, u"No book with {0} {1}".format(scheme, value))
+
+
+def _parse_identifier(identifier):
+    """
+    :return:
+        A (scheme, value) pair for an identifier given as a bare value, a [scheme, value] list or a
+        {"scheme": ..., "value": ...} object, with a scheme of None for bare values.
+    """
+    if isinstance(identifier, basestring):
+        return None, identifier
+    if isinstance(identifier, list) and len(identifier) == 2:
+        scheme, value = identifier
+    elif isinstance(identifier, dict) and "value" in identifier:
+        scheme, value = identifier.get("scheme"), identifier["value"]
+    else:
+        raise ValueError(u"Cannot read identifier {0!r}".format(identifier))
+
+    if not isinstance(value, basestring) or not (scheme is None or isinstance(scheme, basestring)):
+        raise ValueError(u"Cannot read identifier {0!r}".format(identifier))
+    return scheme, value
+
+
+@csrf_exempt
+@require_POST
+def resolve_books(request):
+    """
+    Resolve many identifiers to books in one request. The body is a JSON object whose "identifiers" are bare values,
+    [scheme, value] lists or {"scheme": ..., "value": ...} objects; see :func:`storage.lookups.resolve_identifiers`
+    for how each is resolved and flagged. The results come back in the same order.
+    """
+    try:
+        identifiers = json.loads(request.body)["identifiers"]
+        if not isinstance(identifiers, list):
+            raise ValueError(u"identifiers must be a list")
+        identifiers = [_parse_identifier(identifier) for identifier in identifiers]
+    except (ValueError, KeyError, TypeError) as error:
+        return json_response({"error": u"Expected a JSON object with a list of identifiers: {0}".format(error)}, 400)
+
+    if len(identifiers) > MAX_BULK_IDENTIFIERS:
+        return json_response({"error": u"At most {0} identifiers per request".format(MAX_BULK_IDENTIFIERS)}, 400)
+
+    return json_response({
+        "results": [serialize_resolution(resolution) for resolution in resolve_identifiers(identifiers)]
+    })
+
+
+@require_safe
+def changes(request):
+    """
+    A page of the change feed (see :func:`storage.changes.changes_since`): the books, aliases, alias deletions and
+    alias conflicts modified after the "cursor" parameter, or from the beginning without one, at most "limit" of
+    them. The response holds the cursor to ask for the next page with, whether there may be more changes, and the
+    high-water mark the changes were listed up to.
+    """
+    try:
+        cursor = parse_cursor(request.GET["cursor"]) if request.GET.get("cursor") else None
+        limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(u"limit must be between 1 and {0}".format(MAX_PAGE_SIZE))
+    except ValueError as error:
+        return json_response({"error": unicode(error)}, status=400)
+
+    page = changes_since(cursor, limit)
+    return json_response({
+        "changes": [serialize_change(change) for change in page.changes],
+        "cursor": format_cursor(page.cursor) if page.cursor is not None else None,
+        "more": page.more,
+        "high_water": page.high_water.isoformat(),
+    })
+
+
+@require_safe
+def search(request):
+    """
+    The books whose title or description holds every word and "quoted phrase" of the "q" parameter, best matches
+    first (see :func:`storage.search.search_books`), at most "limit" of them after skipping "offset".
+    """
+    query = request.GET.get("q", "")
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_SEARCH_LIMIT))
+        offset = int(request.GET.get("offset", 0))
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(u"limit must be between 1 and {0}".format(MAX_SEARCH_LIMIT))
+        if offset < 0:
+            raise ValueError(u"offset must not be negative")
+    except ValueError as error:
+        return json_response({"error": unicode(error)}, status=400)
+
+    if not query.strip():
+        return json_response({"error": u"Nothing to search for; pass the words to look for as q"}, status=400)
+
+    return json_response({
+        "query": query,
+        "results": [serialize_book(book) for book in search_books(query, limit=limit, offset=offset)],
+    })